@@ -90,6 +90,30 @@ const fallbackNeighborhoodDetection = async (lat, lng) => {
   };
 };
 
+/**
+ * Send the device position to the backend tracking buffer
+ * @param {string} userId - User's profile ID
+ * @param {GeolocationPosition} position - Position from navigator.geolocation
+ * @param {string} sessionId - Tracking session ID
+ * @returns {Promise<{success: boolean, accepted?: boolean, error?: string}>}
+ */
+export const sendLocationPing = async (userId, position, sessionId) => {
+  try {
+    const response = await api.post('/api/tracking/ping', {
+      user_id: userId,
+      lat: position.coords.latitude,
+      lon: position.coords.longitude,
+      accuracy: position.coords.accuracy,
+      session_id: sessionId
+    });
+
+    return { success: true, accepted: response.data.accepted > 0 };
+  } catch (error) {
+    console.error('Error sending location ping:', error);
+    return { success: false, error: error.message };
+  }
+};
+
 /**
  * Test the neighborhood identification with sample coordinates
  */
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Location
+from .models import GamificationTask, Location
 
 # Register your models here.
 
@@ -9,3 +9,11 @@ class LocationAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('name', 'geohash')
     readonly_fields = ('geohash', 'created_at', 'updated_at')
+
+
+@admin.register(GamificationTask)
+class GamificationTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'user_id', 'status', 'attempts', 'created_at', 'updated_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('user_id',)
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,211 @@
+"""
+Token-bucket admission control for write endpoints
+
+Each protected route has a rate in ADMISSION_RATES ("20/60": 20 requests a
+minute, bursts of up to 20). @admission_control keeps one bucket per user
+the request acts for and one per client IP (ADMISSION_IP_MULTIPLIER times
+the user rate, since many users can share an address) and takes tokens from
+all of them before the view runs. If any bucket is short the request is
+answered with 429 and a Retry-After header straight away, before it
+uploads images, writes to Supabase or calls Gemini.
+
+Buckets live in process memory by default, so each gunicorn worker admits
+the full rate. With ADMISSION_STORE=sqlite they are kept in a local SQLite
+file (ADMISSION_SQLITE_PATH) shared by every worker on the host; each
+admission is one short write transaction. If the store fails, requests are
+admitted rather than rejected.
+"""
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from django.http import JsonResponse
+
+SWEEP_INTERVAL = 60  # seconds between removals of buckets that have refilled
+
+stats = {"admitted": 0, "rejected": 0, "errors": 0}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate: str) -> tuple:
+    """
+    Parse "<requests>/<seconds>"
+
+    Returns:
+        tuple: (capacity in tokens, refill rate in tokens per second)
+    """
+    count, seconds = (float(part) for part in rate.split("/"))
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid admission rate {rate!r}")
+    return count, count / seconds
+
+
+def _admit(levels: dict, requests: list, now: float) -> tuple:
+    """
+    Take tokens from every bucket of a request, or from none
+
+    Args:
+        levels: Bucket key -> (tokens, updated) for the buckets that exist
+        requests: (key, cost, capacity, rate) per bucket
+        now: Current time, in the clock the levels were stored with
+
+    Returns:
+        tuple: (seconds to wait, 0 if admitted; new (key, tokens, updated, full_at) rows)
+    """
+    wait = 0.0
+    rows = []
+    for key, cost, capacity, rate in requests:
+        tokens, updated = levels.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+        cost = min(cost, capacity)  # a request larger than the burst waits for a full bucket
+        if tokens < cost:
+            wait = max(wait, (cost - tokens) / rate)
+        tokens -= cost
+        rows.append((key, tokens, now, now + (capacity - tokens) / rate))
+    return wait, ([] if wait else rows)
+
+
+class MemoryBuckets:
+    """Buckets for this process only"""
+
+    def __init__(self):
+        self._levels = {}  # key -> (tokens, updated, full_at)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def take(self, requests: list) -> float:
+        now = time.monotonic()
+        with self._lock:
+            levels = {key: self._levels[key][:2] for key, *_ in requests if key in self._levels}
+            wait, rows = _admit(levels, requests, now)
+            for key, tokens, updated, full_at in rows:
+                self._levels[key] = (tokens, updated, full_at)
+            if now - self._last_sweep > SWEEP_INTERVAL:
+                self._last_sweep = now
+                for key in [key for key, level in self._levels.items() if level[2] <= now]:
+                    del self._levels[key]
+        return wait
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file shared by the processes on one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, requests: list) -> float:
+        now = time.time()  # shared between processes, unlike time.monotonic()
+        conn = self._connection()
+        keys = [key for key, *_ in requests]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found = conn.execute(
+                f"SELECT key, tokens, updated FROM buckets WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+            wait, rows = _admit({key: (tokens, updated) for key, tokens, updated in found}, requests, now)
+            conn.executemany(
+                "INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, "
+                "full_at = excluded.full_at",
+                rows,
+            )
+            if now - self._last_sweep > SWEEP_INTERVAL:
+                self._last_sweep = now
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_buckets():
+    """Get the process-wide bucket store selected by ADMISSION_STORE"""
+    key = (settings.ADMISSION_STORE, str(settings.ADMISSION_SQLITE_PATH))
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                if settings.ADMISSION_STORE == "sqlite":
+                    store = SQLiteBuckets(str(settings.ADMISSION_SQLITE_PATH))
+                elif settings.ADMISSION_STORE == "memory":
+                    store = MemoryBuckets()
+                else:
+                    raise ValueError(f"Unknown ADMISSION_STORE {settings.ADMISSION_STORE!r}")
+                _stores[key] = store
+    return store
+
+
+def client_ip(request) -> str:
+    """The client address; behind a trusted proxy, the one it appended to X-Forwarded-For"""
+    if settings.ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR") or "unknown"
+
+
+def admission_control(route: str, users=None):
+    """
+    Reject requests over the route's rate with 429 before the view runs
+
+    Args:
+        route: Key of ADMISSION_RATES
+        users: Called with the view's arguments (keyword arguments, e.g.
+            payload); returns {user_id: tokens} for the users the request acts
+            for, e.g. one token per report in a batch. The client IP is
+            charged the total (at least 1).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.ADMISSION_ENABLED:
+                return view(request, *args, **kwargs)
+
+            capacity, rate = parse_rate(settings.ADMISSION_RATES[route])
+            costs = users(*args, **kwargs) if users else {}
+            requests = [(f"{route}:user:{user}", cost, capacity, rate) for user, cost in costs.items() if user]
+            multiplier = settings.ADMISSION_IP_MULTIPLIER
+            requests.append((f"{route}:ip:{client_ip(request)}", sum(costs.values()) or 1,
+                             capacity * multiplier, rate * multiplier))
+            try:
+                wait = get_buckets().take(requests)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"ERROR: Admission store failed, admitting {request.path}: {e}")
+                wait = 0
+
+            if wait:
+                stats["rejected"] += 1
+                retry_after = max(1, math.ceil(wait))
+                response = JsonResponse({"detail": "Too many requests", "retry_after": retry_after}, status=429)
+                response["Retry-After"] = str(retry_after)
+                return response
+            stats["admitted"] += 1
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
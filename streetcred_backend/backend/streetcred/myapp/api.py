@@ -1,8 +1,12 @@
+from itertools import chain, islice
 from ninja import NinjaAPI, Schema
 from ninja.errors import HttpError
 import pygeohash as pgh
 from django.http import HttpResponse
-from .auth import get_supabase_client
+from .admission import admission_control
+from .auth import get_supabase_client, iter_table_rows
+from .response_cache import cached_route, conditional_route, invalidate
+from .streaming import stream_collection
 
 api = NinjaAPI(
     title="StreetCred API",
@@ -38,34 +42,45 @@ class LocationOut(Schema):
     map_url: str = None
 
 
+def _locations_watermark(request):
+    """(row count, latest updated_at); an edit bumps updated_at, a delete the count"""
+    from django.db.models import Count, Max
+    from .models import Location
+
+    marks = Location.objects.aggregate(count=Count("id"), updated_at=Max("updated_at"))
+    return marks["count"], marks["updated_at"]
+
+
 @api.get("/locations", tags=["Locations"], summary="Get all locations")
+@conditional_route(_locations_watermark)
+@cached_route(ttl=60, tags=("locations",))
 def get_all_locations(request):
     """
     Get all locations from the database.
 
-    Returns a list of all locations ordered by most recent first.
+    Returns a list of all locations ordered by most recent first, streamed
+    as it is read (`?format=ndjson` for one location per line).
     """
     from .models import Location
 
-    locations = Location.objects.all().order_by('-created_at')
-
-    return {
-        "count": locations.count(),
-        "locations": [
-            {
-                "id": loc.id,
-                "name": loc.name,
-                "lat": loc.lat,
-                "lon": loc.lon,  # lng from database -> lon in API response
-                "geohash": loc.geohash,
-                "created_at": loc.created_at.isoformat(),
-            }
-            for loc in locations
-        ]
-    }
+    locations = Location.objects.order_by('-created_at')
+    rows = (
+        {
+            "id": row_id,
+            "name": name,
+            "lat": lat,
+            "lon": lon,
+            "geohash": geohash,
+            "created_at": created_at.isoformat(),
+        }
+        for row_id, name, lat, lon, geohash, created_at in locations.values_list(
+            "id", "name", "lat", "lon", "geohash", "created_at"
+        ).iterator(chunk_size=2000)
+    )
+    return stream_collection(request, rows, "locations", head={"count": locations.count()})
 
 
-@api.delete("/location/{location_id}", tags=["Locations"], summary="Delete location")
+@api.delete("/location/{int:location_id}", tags=["Locations"], summary="Delete location")
 def delete_location(request, location_id: int):
     """
     Delete a location by its ID.
@@ -78,6 +93,7 @@ def delete_location(request, location_id: int):
     try:
         location = Location.objects.get(id=location_id)
         location.delete()
+        invalidate("locations")
         return {"status": "success", "message": f"Location {location_id} deleted"}
     except Location.DoesNotExist:
         raise HttpError(404, "Location not found")
@@ -96,50 +112,100 @@ def add_location(request, payload: LocationIn):
     # Create and save location to database
     location = Location.objects.create(
         lat=payload.lat,
-        lng=payload.lon,  # lon from API -> lng in database
+        lon=payload.lon,
         name=payload.name
     )
     # geohash auto-generated by model's save() method
+    invalidate("locations")
 
     return {
         'status': 'success',
         'geohash': location.geohash,
         'location': {
             'lat': location.lat,
-            'lon': location.lng,  # lng from database -> lon in API response
+            'lon': location.lon,
             'name': location.name
         },
         'map_url': '/map/'  # URL to view the map
     }
 
 
-@api.get("/locations/nearby")
+@api.get("/locations/nearby", tags=["Locations"], summary="Get nearby locations")
 def get_nearby_facilities(request, lat: float, lon: float, radius: int = 300):
-    """Get facilities near coordinates"""
-    # Convert radius to appropriate precision
-    # 300m ≈ precision 7
-    area_hash = pgh.encode(lat, lon, precision=7)
-
-    # Query DB with geohash prefix for efficiency
-    # facilities = db.query(
-    #     "SELECT * FROM facilities WHERE geohash LIKE $1",
-    #     f"{area_hash}%"
-    # )
+    """
+    Get locations within a radius of a point, nearest first.
 
-    # Filter by exact distance
-    results = []
-    # for facility in facilities:
-    #     distance = pgh.geohash_approximate_distance(
-    #         pgh.encode(lat, lng, 9),
-    #         facility.geohash
-    #     )
-    #     if distance <= radius:
-    #         results.append({**facility, 'distance': distance})
+    Args:
+        lat, lon: Search center
+        radius: Search radius in meters (max 10000)
 
-    return sorted(results, key=lambda x: x.get('distance', 0))
+    The radius is turned into a few geokey ranges, so the lookup is a set
+    of index seeks followed by an exact distance check.
+    """
+    from .models import Location
+
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise HttpError(400, "Invalid coordinates")
+    if not 0 < radius <= 10000:
+        raise HttpError(400, "Radius must be between 1 and 10000 meters")
+
+    return [
+        {
+            "id": loc.id,
+            "name": loc.name,
+            "lat": loc.lat,
+            "lon": loc.lon,
+            "geohash": loc.geohash,
+            "distance": round(distance, 1),
+        }
+        for loc, distance in Location.objects.within_radius(lat, lon, radius)
+    ]
+
+
+@api.get("/cities", tags=["Locations"], summary="List supported cities")
+def get_cities(request):
+    """
+    List configured cities with their bounds and whether their data is loaded in this process
+    """
+    from .cities import get_city_registry
+
+    return {"cities": get_city_registry().status()}
+
+
+@api.get("/nearest", tags=["Locations"], summary="Get the nearest facilities or reports")
+def get_nearest(request, lat: float, lon: float, k: int = 5, layers: str = "hydrants,locations",
+                max_distance: float = None):
+    """
+    Get the k closest hydrants, locations and/or reports, nearest first.
+
+    Args:
+        lat, lon: Search center
+        k: Number of results (max 100)
+        layers: Comma-separated subset of hydrants,locations,reports
+        max_distance: Optional cutoff in meters
+
+    No radius is needed; the answer comes from a per-layer KD-tree.
+    """
+    from .nearest import nearest
+    from .tiles import parse_layers
+
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise HttpError(400, "Invalid coordinates")
+    if not 1 <= k <= 100:
+        raise HttpError(400, "k must be between 1 and 100")
+    if max_distance is not None and max_distance <= 0:
+        raise HttpError(400, "max_distance must be positive")
+    try:
+        selected = parse_layers(layers)
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+    results = nearest(lat, lon, k, selected, max_distance)
+    return {"lat": lat, "lon": lon, "k": k, "count": len(results), "results": results}
 
 
 @api.post("/report/create")
+@admission_control("report-submit")
 def create_report(request, lat: float, lon: float, facility_id: int):
     """Create report with duplicate detection"""
     # Check for duplicates
@@ -164,13 +230,49 @@ def create_report(request, lat: float, lon: float, facility_id: int):
     return {"status": "created"}
 
 
+@api.get("/tiles/{int:z}/{int:x}/{int:y}.mvt", tags=["Tiles"], summary="Get map vector tile")
+def get_map_tile(request, z: int, x: int, y: int, layers: str = None):
+    """
+    Get hydrants, locations and reports for one map tile as a Mapbox Vector Tile.
+
+    Args:
+        layers: Comma-separated subset of hydrants,locations,reports (default: all)
+
+    Tiles are cached and only rebuilt when data inside their area changes.
+    Clients may reuse a tile for TILE_CACHE_MAX_AGE seconds and must then
+    revalidate it with If-None-Match, so edits show up without a reload.
+    """
+    from django.conf import settings
+    from .tiles import get_tile, parse_layers
+
+    try:
+        data, etag = get_tile(z, x, y, parse_layers(layers))
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+    etag = f'"{etag}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(data, content_type="application/vnd.mapbox-vector-tile")
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.TILE_CACHE_MAX_AGE}, must-revalidate"
+    return response
+
+
 # Supabase endpoints
 @api.get("/supabase/{table_name}")
-def get_supabase_table(request, table_name: str):
-    """Get all data from a Supabase table"""
-    supabase = get_supabase_client()
-    response = supabase.table(table_name).select('*').execute()
-    return {"data": response.data, "count": len(response.data)}
+@cached_route(tags=("table:{table_name}",))
+def get_supabase_table(request, table_name: str, order_by: str = "id"):
+    """
+    Get all data from a Supabase table
+
+    Every page is fetched and streamed as it arrives (`?format=ndjson` for
+    one row per line). Pass `order_by` for tables without an id column.
+    """
+    rows = iter_table_rows(table_name, order=order_by)
+    first = list(islice(rows, 1))  # fail with a normal error response if the table can't be read
+    return stream_collection(request, chain(first, rows), "data", tail=lambda count: {"count": count})
 
 
 @api.get("/supabase/{table_name}/{row_id}")
@@ -185,19 +287,92 @@ def get_supabase_row(request, table_name: str, row_id: int):
     return {"data": response.data[0]}
 
 
+@api.get("/debug/ai-metrics")
+def debug_ai_metrics(request):
+    """Gemini neighborhood lookup metrics: fallback usage, breaker state, latency"""
+    from .locater import get_ai_metrics
+    return get_ai_metrics()
+
+
+@api.get("/debug/admission")
+def debug_admission(request):
+    """Admission control: rates per route and admitted/rejected counts"""
+    from django.conf import settings
+    from .admission import stats
+
+    return {
+        "enabled": settings.ADMISSION_ENABLED,
+        "store": settings.ADMISSION_STORE,
+        "rates": settings.ADMISSION_RATES,
+        "ip_multiplier": settings.ADMISSION_IP_MULTIPLIER,
+        **stats,
+    }
+
+
+@api.get("/debug/loader-metrics")
+def debug_loader_metrics(request):
+    """Batched Supabase lookups: loads served, queries sent and round trips saved"""
+    from .loaders import get_loader_metrics
+    return get_loader_metrics()
+
+
+@api.get("/debug/profiles")
+def debug_profiles(request):
+    """
+    List captured request profiles, newest first (staff session or `X-Profile: <PROFILING_TOKEN>`)
+    """
+    from django.conf import settings
+    from .profiling import is_authorized, list_profiles
+
+    if not settings.PROFILING_ENABLED:
+        raise HttpError(404, "Profiling is disabled")
+    if not is_authorized(request):
+        raise HttpError(403, "Not authorized")
+    return {"profiles": list_profiles()}
+
+
+@api.get("/debug/profiles/{profile_id}")
+def debug_profile(request, profile_id: str, format: str = "folded"):
+    """
+    Download a profile as folded stacks (flamegraph.pl, speedscope) or as JSON
+
+    Args:
+        format: "folded" or "json"
+    """
+    from django.conf import settings
+    from .profiling import folded, is_authorized, load_profile
+
+    if not settings.PROFILING_ENABLED:
+        raise HttpError(404, "Profiling is disabled")
+    if not is_authorized(request):
+        raise HttpError(403, "Not authorized")
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HttpError(404, "Profile not found")
+    if format == "json":
+        return profile
+    if format != "folded":
+        raise HttpError(400, "format must be 'folded' or 'json'")
+
+    response = HttpResponse(folded(profile), content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{profile_id}.folded"'
+    return response
+
+
 @api.get("/debug/hydrants")
 def debug_hydrants(request):
     """Debug endpoint to check hydrants data"""
     try:
-        supabase = get_supabase_client()
-        response = supabase.table('hydrants').select('*').execute()
-
-        return {
-            "success": True,
-            "count": len(response.data),
-            "sample": response.data[:3] if response.data else [],
-            "all_data": response.data
-        }
+        rows = iter_table_rows('hydrants')
+        sample = list(islice(rows, 3))
+
+        return stream_collection(
+            request,
+            chain(sample, rows),
+            "all_data",
+            head={"success": True, "sample": sample},
+            tail=lambda count: {"count": count}
+        )
     except Exception as e:
         return {
             "success": False,
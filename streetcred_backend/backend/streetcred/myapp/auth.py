@@ -19,6 +19,41 @@ def get_supabase_client() -> Client:
     return _supabase_client
 
 
+def iter_table_rows(table: str, columns: str = "*", bounds=None, since=None, page_size: int = 1000,
+                    order: str = "id", after=None):
+    """
+    Page through a Supabase table (PostgREST caps each response, so select('*') alone truncates)
+
+    Args:
+        table: Table name
+        columns: Columns to select
+        bounds: Optional (south, west, north, east) filter on lat/lon columns
+        since: Optional ISO timestamp; only rows with created_at >= since
+        page_size: Rows per request
+        order: Unique column to page by
+        after: Optional value; only rows whose `order` column is greater
+
+    Yields:
+        dict: One row at a time, ordered by `order`
+    """
+    supabase = get_supabase_client()
+    start = 0
+    while True:
+        query = supabase.table(table).select(columns)
+        if bounds:
+            south, west, north, east = bounds
+            query = query.gte("lat", south).lte("lat", north).gte("lon", west).lte("lon", east)
+        if since:
+            query = query.gte("created_at", since)
+        if after is not None:
+            query = query.gt(order, after)
+        rows = query.order(order).range(start, start + page_size - 1).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            break
+        start += page_size
+
+
 def get_users(request):
     supabase = get_supabase_client()
     response = supabase.table('users').select('*').execute()
@@ -1,6 +1,10 @@
 from ninja import NinjaAPI, Schema
+from ninja.errors import HttpError
 from typing import List, Optional
-from .badge_rewards import update_user_points, get_user_badges, award_badges_for_points
+from .admission import admission_control
+from .badge_rewards import update_user_points, get_user_badges, award_badges_for_points, user_badges_watermark
+from .loaders import get_loaders
+from .response_cache import cached_route, conditional_route, invalidate
 
 api = NinjaAPI(urls_namespace='badges')
 
@@ -44,6 +48,7 @@ class UserBadgeResponse(Schema):
 
 
 @api.post("/add-points", response=AddPointsResponse)
+@admission_control("add-points", users=lambda payload, **_: {payload.user_id: 1})
 def add_points(request, payload: AddPointsRequest):
     """
     Add points to user and automatically award badges at milestones
@@ -57,10 +62,12 @@ def add_points(request, payload: AddPointsRequest):
         payload.latitude,
         payload.longitude
     )
+    invalidate("table:profiles", "table:user_badges", f"user-badges:{payload.user_id}")
     return result
 
 
 @api.post("/check-milestones")
+@admission_control("check-milestones", users=lambda user_id, **_: {user_id: 1})
 def check_milestones(request, user_id: str, points: int, latitude: float, longitude: float):
     """
     Check and award any missing badges for user's current points
@@ -68,10 +75,23 @@ def check_milestones(request, user_id: str, points: int, latitude: float, longit
     Useful for backfilling badges if points were added outside the system
     """
     result = award_badges_for_points(user_id, points, latitude, longitude)
+    invalidate("table:user_badges", f"user-badges:{user_id}")
     return result
 
 
+def _badges_watermark(request, user_id: str):
+    return user_badges_watermark(user_id)
+
+
+def _progress_watermark(request, user_id: str):
+    # The profile is memoized for the request, so a full response reuses it
+    profile = get_loaders().profiles.load(user_id)
+    return (profile or {}).get("points"), user_badges_watermark(user_id)[0]
+
+
 @api.get("/user-badges/{user_id}")
+@conditional_route(_badges_watermark, tags=("user-badges:{user_id}",), ttl=60)
+@cached_route(ttl=60, tags=("user-badges:{user_id}",))
 def get_badges(request, user_id: str):
     """
     Get all badges earned by a user
@@ -91,21 +111,19 @@ def get_badges(request, user_id: str):
 
 
 @api.get("/badge-progress/{user_id}")
+@conditional_route(_progress_watermark)
 def get_badge_progress(request, user_id: str):
     """
     Get user's badge earning progress
     """
-    from myapp.badge_rewards import _get_supabase, get_next_milestone, get_earned_milestones
+    from myapp.badge_rewards import get_next_milestone, get_earned_milestones
 
     # Get current points
-    supabase = _get_supabase()
-    profile = supabase.table("profiles")\
-        .select("points")\
-        .eq("user_id", user_id)\
-        .single()\
-        .execute()
-
-    points = profile.data.get("points", 0)
+    profile = get_loaders().profiles.load(user_id)
+    if profile is None:
+        raise HttpError(404, "Profile not found")
+
+    points = profile.get("points", 0)
     earned_milestones = get_earned_milestones(points)
 
     # Get earned badges count
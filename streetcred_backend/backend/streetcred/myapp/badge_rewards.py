@@ -1,10 +1,15 @@
 import os
 from dotenv import load_dotenv
 import random
-from myapp.locater import identify_location
+import time
+from myapp.locater import resolve_neighborhood
+from myapp.cities import get_city_registry
+from myapp.loaders import get_loaders
 
 load_dotenv()
 
+POINTS_UPDATE_ATTEMPTS = 10  # compare-and-swap retries when other writers keep changing the total
+
 # Lazy load Supabase client to avoid SSL errors on module import
 _supabase = None
 
@@ -59,57 +64,47 @@ def award_badges_for_points(user_id: str, new_points: int, latitude: float, long
         }
 
     # Check which milestones already have badges awarded
-    supabase = _get_supabase()
-    existing_badges = supabase.table("user_badges")\
-        .select("milestone")\
-        .eq("user_id", user_id)\
-        .execute()
-
-    existing_milestones = [b["milestone"] for b in existing_badges.data]
+    loaders = get_loaders()
+    existing_milestones = [b["milestone"] for b in loaders.user_badges.load(user_id)]
 
     # Find milestones that need badges
     missing_milestones = [m for m in earned_milestones if m not in existing_milestones]
 
     new_badges = []
 
-    # Get location name from coordinates
-    location_name = identify_location(latitude, longitude)
-
-    # Special location names (Columbia University sponsors)
-    special_locations = ["Columbia University", "Capital One", "An Ai World", "BlackRock", "Comet Opik", "Echo Merit Systems"]
-
-    # Award a random badge for each missing milestone
-    for milestone in missing_milestones:
-        # Get badges for this location
-        if location_name == "Columbia University":
-            # For Columbia University, select from special sponsor locations
-            location_badges = supabase.table("badges")\
-                .select("*")\
-                .in_("location_name", special_locations)\
-                .execute()
-        else:
-            # For other locations, exclude special locations
-            location_badges = supabase.table("badges")\
-                .select("*")\
-                .eq("location_name", location_name)\
-                .not_().in_("location_name", special_locations)\
-                .execute()
-
-        if location_badges.data:
-            # Randomly select a badge (random animal) from this location
-            selected_badge = random.choice(location_badges.data)
-
-            # Create user_badge record
-            user_badge = supabase.table("user_badges").insert({
-                "user_id": user_id,
-                "badge_id": selected_badge["id"],
-                "milestone": milestone
-            }).execute()
+    if not missing_milestones:
+        return {
+            "new_badges": [],
+            "total_badges": len(existing_milestones),
+            "next_milestone": get_next_milestone(new_points)
+        }
 
+    # Get location name from coordinates
+    location_name, _ = resolve_neighborhood(latitude, longitude)
+
+    # Get badges for this location (same for every missing milestone) from the
+    # city's badge pool; sponsor neighborhoods (e.g. Columbia University) draw
+    # from the sponsor locations, other neighborhoods never do
+    registry = get_city_registry()
+    city = registry.city_for(latitude, longitude)
+    location_badges = registry.shard(city).badge_pool(location_name) if city and location_name else []
+
+    # Award a random badge (random animal) from this location for each missing milestone
+    if location_badges:
+        selected_badges = [random.choice(location_badges) for _ in missing_milestones]
+
+        # Create all user_badge records in one insert
+        user_badges = _get_supabase().table("user_badges").insert([
+            {"user_id": user_id, "badge_id": badge["id"], "milestone": milestone}
+            for milestone, badge in zip(missing_milestones, selected_badges)
+        ]).execute()
+        loaders.user_badges.clear(user_id)
+
+        for milestone, badge, user_badge in zip(missing_milestones, selected_badges, user_badges.data):
             new_badges.append({
                 "milestone": milestone,
-                "badge": selected_badge,
-                "awarded_at": user_badge.data[0]["earned_at"]
+                "badge": badge,
+                "awarded_at": user_badge["earned_at"]
             })
 
     # Get total badge count
@@ -123,16 +118,65 @@ def award_badges_for_points(user_id: str, new_points: int, latitude: float, long
 
 
 def get_user_badges(user_id: str) -> list:
-    """Get all badges earned by a user"""
+    """Get all badges earned by a user, by milestone"""
+    return list(get_loaders().user_badges.load(user_id))
 
-    supabase = _get_supabase()
-    result = supabase.table("user_badges")\
-        .select("*, badges(*)")\
+
+def user_badges_watermark(user_id: str) -> tuple:
+    """
+    Cheap version of a user's badges, for conditional GETs
+
+    Returns:
+        tuple: (badge count, latest earned_at)
+    """
+    result = _get_supabase().table("user_badges")\
+        .select("earned_at", count="exact")\
         .eq("user_id", user_id)\
-        .order("milestone")\
+        .order("earned_at", desc=True)\
+        .limit(1)\
         .execute()
+    return result.count, result.data[0]["earned_at"] if result.data else None
 
-    return result.data
+
+def add_user_points(user_id: str, points_to_add: int) -> tuple:
+    """
+    Add points to a user's profile
+
+    Args:
+        user_id: User's profile ID
+        points_to_add: Points to add to current total (0 just reads the total)
+
+    Returns:
+        tuple: (previous_points, new_points)
+    """
+    loaders = get_loaders()
+    supabase = _get_supabase()
+    for attempt in range(POINTS_UPDATE_ATTEMPTS):
+        if attempt:
+            # The total we had was stale: re-read it rather than trusting the memo
+            time.sleep(random.uniform(0, 0.05 * attempt))  # back off so colliding writers spread out
+            loaders.profiles.clear(user_id)
+        # A profile prefetched for a batch saves the read; the swap below
+        # fails (and we re-read) if it is out of date
+        profile = loaders.profiles.load(user_id)
+        if profile is None:
+            raise Exception(f"No profile for user {user_id}")
+
+        stored_points = profile.get("points")
+        current_points = stored_points or 0
+        new_points = current_points + points_to_add
+        if not points_to_add:
+            return current_points, new_points
+
+        # Compare-and-swap: only applies if nobody changed the total since the read,
+        # so concurrent workers can't overwrite each other's increments
+        query = supabase.table("profiles").update({"points": new_points}).eq("user_id", user_id)
+        query = query.is_("points", "null") if stored_points is None else query.eq("points", stored_points)
+        if query.execute().data:
+            loaders.profiles.prime(user_id, {**profile, "points": new_points})
+            return current_points, new_points
+
+    raise Exception(f"Could not update points for user {user_id}: concurrent updates kept conflicting")
 
 
 def update_user_points(user_id: str, points_to_add: int, latitude: float, longitude: float) -> dict:
@@ -148,23 +192,7 @@ def update_user_points(user_id: str, points_to_add: int, latitude: float, longit
     Returns:
         dict: Updated profile with badge info
     """
-
-    # Get current points
-    supabase = _get_supabase()
-    profile = supabase.table("profiles")\
-        .select("points")\
-        .eq("user_id", user_id)\
-        .single()\
-        .execute()
-
-    current_points = profile.data.get("points", 0)
-    new_points = current_points + points_to_add
-
-    # Update points in database
-    updated_profile = supabase.table("profiles")\
-        .update({"points": new_points})\
-        .eq("user_id", user_id)\
-        .execute()
+    current_points, new_points = add_user_points(user_id, points_to_add)
 
     # Award badges for new milestones
     badge_result = award_badges_for_points(user_id, new_points, latitude, longitude)
@@ -0,0 +1,170 @@
+"""
+Latency budget and circuit breaker for calls to slow external services
+
+GuardedCall runs the external call on a small worker pool and waits at most
+`budget` seconds for it. If the call is late, fails, the pool is saturated
+or the breaker is open, the caller gets the local fallback instead, so the
+endpoint's latency is bounded by the budget rather than the client timeout.
+
+The breaker opens after `failure_threshold` consecutive failures or
+timeouts. While open, calls go straight to the fallback; after
+`reset_timeout` seconds a single probe call is let through (half-open) and
+its outcome closes or re-opens the breaker. A call that misses the
+deadline counts as a failure even if it completes later, so a service that
+is consistently too slow keeps the breaker open.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (claims the probe slot when half-open)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class GuardedCall:
+    """An external call with a hard deadline, a circuit breaker and a local fallback"""
+
+    def __init__(self, name: str, budget: float, max_concurrency: int = 8,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.budget = budget
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        self._in_flight = 0
+        self._timed_out = set()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.counters = {
+            "calls": 0,
+            "primary": 0,
+            "fallback_timeout": 0,
+            "fallback_error": 0,
+            "fallback_open": 0,
+            "fallback_saturated": 0,
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def _finished(self, future):
+        """Record the outcome of a primary call (late ones were already counted as failures)"""
+        with self._lock:
+            self._in_flight -= 1
+            timed_out = future in self._timed_out
+            self._timed_out.discard(future)
+        if timed_out:
+            return
+        if future.exception() is None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def call(self, primary, fallback, *args):
+        """
+        Run primary(*args) within the budget, else return fallback(*args)
+
+        Returns:
+            tuple: (result, method) where method is "primary" or "fallback"
+        """
+        started = time.perf_counter()
+        self._count("calls")
+        try:
+            if not self.breaker.allow():
+                self._count("fallback_open")
+                return fallback(*args), "fallback"
+            probe = self.breaker.state == HALF_OPEN
+
+            with self._lock:
+                saturated = self._in_flight >= self.max_concurrency
+                if not saturated:
+                    self._in_flight += 1
+            if saturated:
+                # Every worker is stuck on a slow call; don't queue behind them
+                if probe:
+                    self.breaker.record_failure()  # give up the probe slot
+                self._count("fallback_saturated")
+                return fallback(*args), "fallback"
+
+            future = self._executor.submit(primary, *args)
+            future.add_done_callback(self._finished)
+            try:
+                result = future.result(timeout=self.budget)
+            except FutureTimeout:
+                with self._lock:
+                    if not future.done():
+                        self._timed_out.add(future)
+                self._count("fallback_timeout")
+                print(f"ERROR: {self.name} exceeded its {self.budget}s budget, using fallback")
+                self.breaker.record_failure()
+                return fallback(*args), "fallback"
+            except Exception as e:
+                self._count("fallback_error")
+                print(f"ERROR: {self.name} failed, using fallback: {e}")
+                return fallback(*args), "fallback"
+
+            self._count("primary")
+            return result, "primary"
+        finally:
+            with self._lock:
+                self._latencies.append(time.perf_counter() - started)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+
+        fallbacks = counters["calls"] - counters["primary"]
+        return {
+            "name": self.name,
+            "breaker": self.breaker.state,
+            "budget_ms": self.budget * 1000,
+            **counters,
+            "fallback_rate": round(fallbacks / counters["calls"], 3) if counters["calls"] else 0.0,
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+        }
@@ -0,0 +1,208 @@
+"""
+City registry: per-city geo data, loaded on demand
+
+Cities are configured in CITIES_CONFIG_PATH (data/cities.json by default)
+with their bounds, neighborhood boundaries (GeoJSON), the neighborhood
+centers given to Gemini, a fallback neighborhood and the sponsor badge
+rules. Reading the config is cheap. A city's shard (its neighborhood
+polygon index and badge pool) is only built by the first request that
+touches the city, and shards unused for CITY_IDLE_SECONDS, or beyond
+CITY_MAX_LOADED (least recently used first), are dropped, so memory and
+startup time follow the cities that are actually active.
+"""
+import json
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from .neighborhoods import NeighborhoodIndex
+
+SWEEP_INTERVAL = 60  # seconds between idle-shard sweeps
+SPONSOR_POOL = object()  # badge pool key shared by every sponsor neighborhood
+
+
+class City:
+    """Static configuration of one city"""
+
+    def __init__(self, key: str, config: dict, base_dir: Path):
+        self.key = key
+        self.name = config.get("name", key)
+        self.bounds = tuple(float(v) for v in config["bounds"])  # south, west, north, east
+        geojson = config.get("neighborhood_geojson")
+        self.geojson_path = base_dir / geojson if geojson else None
+        self.name_property = config.get("neighborhood_name_property", "name")
+        self.default_neighborhood = config.get("default_neighborhood")
+        self.neighborhood_centers = config.get("neighborhood_centers", {})
+        self.sponsor_neighborhoods = set(config.get("sponsor_neighborhoods", []))
+        self.sponsor_badge_locations = list(config.get("sponsor_badge_locations", []))
+
+    def contains(self, lat: float, lon: float) -> bool:
+        south, west, north, east = self.bounds
+        return south <= lat <= north and west <= lon <= east
+
+
+class CityShard:
+    """A city's loaded data: neighborhood index and cached badge pool"""
+
+    def __init__(self, city: City):
+        self.city = city
+        if city.geojson_path:
+            self.neighborhoods = NeighborhoodIndex.from_geojson(str(city.geojson_path), city.name_property)
+        else:
+            self.neighborhoods = NeighborhoodIndex([])
+        self.loaded_at = self.last_used = time.monotonic()
+        self._badges = {}  # pool key -> (loaded_at, badge rows)
+
+    def find_neighborhood(self, lat: float, lon: float) -> str:
+        """Polygon lookup, falling back to the city's default neighborhood"""
+        return self.neighborhoods.lookup(lat, lon) or self.city.default_neighborhood
+
+    def badge_pool(self, location_name: str) -> list:
+        """
+        Get the badges that can be awarded for a report in a neighborhood
+
+        Sponsor neighborhoods draw from the sponsor locations' badges; every
+        other neighborhood from its own badges (never sponsor ones). Pools are
+        cached for CITY_BADGE_CACHE_SECONDS.
+        """
+        from .loaders import get_loaders
+
+        sponsor = location_name in self.city.sponsor_neighborhoods
+        key = SPONSOR_POOL if sponsor else location_name
+        cached = self._badges.get(key)
+        if cached and time.monotonic() - cached[0] < settings.CITY_BADGE_CACHE_SECONDS:
+            return cached[1]
+
+        badges = get_loaders().badges
+        if sponsor:
+            rows = [row for rows in badges.load_many(self.city.sponsor_badge_locations) for row in rows]
+        elif location_name in self.city.sponsor_badge_locations:
+            rows = []
+        else:
+            rows = list(badges.load(location_name))
+        self._badges[key] = (time.monotonic(), rows)
+        return rows
+
+
+class CityRegistry:
+    def __init__(self, cities: list):
+        self.cities = cities
+        self._by_key = {city.key: city for city in cities}
+        self._shards = {}
+        self._load_locks = {city.key: threading.Lock() for city in cities}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def from_file(cls, path) -> "CityRegistry":
+        path = Path(path)
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls([City(key, city, path.parent) for key, city in config.items()])
+
+    def get(self, key: str):
+        return self._by_key.get(key)
+
+    def city_for(self, lat: float, lon: float):
+        """Get the first configured city whose bounds contain the point, or None"""
+        for city in self.cities:
+            if city.contains(lat, lon):
+                return city
+        return None
+
+    def shard(self, city: City) -> CityShard:
+        """Get a city's shard, loading it on first use"""
+        shard = self._shards.get(city.key)
+        if shard is None:
+            with self._load_locks[city.key]:  # one load per city; other cities aren't blocked
+                shard = self._shards.get(city.key)
+                if shard is None:
+                    shard = CityShard(city)
+                    with self._lock:
+                        self._shards[city.key] = shard
+        shard.last_used = time.monotonic()
+        self._sweep()
+        return shard
+
+    def _sweep(self):
+        now = time.monotonic()
+        max_loaded = max(1, settings.CITY_MAX_LOADED)
+        if now - self._last_sweep < SWEEP_INTERVAL and len(self._shards) <= max_loaded:
+            return
+        with self._lock:
+            self._last_sweep = now
+            for key, shard in list(self._shards.items()):
+                if now - shard.last_used > settings.CITY_IDLE_SECONDS:
+                    del self._shards[key]
+            excess = len(self._shards) - max_loaded
+            if excess > 0:
+                for key in sorted(self._shards, key=lambda k: self._shards[k].last_used)[:excess]:
+                    del self._shards[key]
+
+    def evict(self, key: str = None):
+        """Drop one city's shard (or all of them); it is reloaded on next use"""
+        with self._lock:
+            if key is None:
+                self._shards.clear()
+            else:
+                self._shards.pop(key, None)
+
+    def status(self) -> list:
+        now = time.monotonic()
+        result = []
+        for city in self.cities:
+            shard = self._shards.get(city.key)
+            result.append({
+                "key": city.key,
+                "name": city.name,
+                "bounds": list(city.bounds),
+                "loaded": shard is not None,
+                "neighborhoods": len(shard.neighborhoods.polygons) if shard else None,
+                "idle_seconds": round(now - shard.last_used, 1) if shard else None,
+            })
+        return result
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_city_registry() -> CityRegistry:
+    """Get the process-wide registry, reading the city config on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = CityRegistry.from_file(settings.CITIES_CONFIG_PATH)
+    return _registry
+
+
+def city_for(lat: float, lon: float):
+    return get_city_registry().city_for(float(lat), float(lon))
+
+
+def find_neighborhood(lat: float, lon: float):
+    """Get the neighborhood polygon containing a point, or None outside every boundary"""
+    lat, lon = float(lat), float(lon)
+    registry = get_city_registry()
+    city = registry.city_for(lat, lon)
+    return registry.shard(city).neighborhoods.lookup(lat, lon) if city else None
+
+
+def lookup_many(lats, lons) -> list:
+    """Look up many points at once, one batched lookup per city (None outside every boundary)"""
+    registry = get_city_registry()
+    by_city = {}
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        city = registry.city_for(float(lat), float(lon))
+        if city is not None:
+            by_city.setdefault(city.key, (city, []))[1].append(i)
+
+    names = [None] * len(lats)
+    for city, indexes in by_city.values():
+        found = registry.shard(city).neighborhoods.lookup_many(
+            [lats[i] for i in indexes], [lons[i] for i in indexes]
+        )
+        for i, name in zip(indexes, found):
+            names[i] = name
+    return names
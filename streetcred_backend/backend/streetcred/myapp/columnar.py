@@ -0,0 +1,290 @@
+"""
+Columnar (struct-of-arrays) storage for map points
+
+A list of row dicts costs several hundred bytes per point (the dict, its
+boxed floats and ints, the geohash string). PointColumns keeps one typed
+array per field instead:
+
+- ids: int64
+- lats / lons: float64
+- kinds: uint8 codes into kind_names ("hydrant", "location", ...)
+- geohashes: precision-9 geohash packed into an int64 (see geo.geohash_to_int)
+- names: only for rows that have one, keyed by row number
+- external_ids: the original id of rows whose id isn't an integer (some
+  hydrant sources use string ids, or none); their ids entry is a stable
+  negative stand-in derived from it
+
+That is 33 bytes per point. PointRow is a small view for the occasional
+per-row access (templates, JSON output); bulk work such as radius queries
+runs over the arrays directly, with NumPy when it is installed. The columns
+can also be read-only memoryviews into a mapped snapshot file (see
+point_snapshot.py).
+`manage.py bench_point_memory` compares both representations.
+"""
+import hashlib
+import math
+from array import array
+from .geo import EARTH_RADIUS_M, GEOKEY_PRECISION, haversine_m, int_to_geohash, radius_bbox
+from .geohash_codec import encode_batch_int
+
+CHUNK_SIZE = 10000
+
+_NO_EXTERNAL_ID = object()
+
+
+def _integer_id(row_id):
+    """The id as an int, or None if it isn't an integer"""
+    if isinstance(row_id, float):
+        return int(row_id) if row_id.is_integer() else None
+    try:
+        return int(row_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def stand_in_id(row_id, lat: float, lon: float) -> int:
+    """
+    Negative int64 standing in for a non-integer id in the ids column
+
+    Derived from the id (or, without one, the position), so it is the same
+    on every load and never collides with the positive database ids.
+    """
+    key = f"id:{row_id}" if row_id is not None else f"at:{lat!r},{lon!r}"
+    return -1 - int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") % (1 << 62)
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class PointRow:
+    """Read-only view of one row of a PointColumns"""
+
+    __slots__ = ("columns", "index")
+
+    def __init__(self, columns: "PointColumns", index: int):
+        self.columns = columns
+        self.index = index
+
+    @property
+    def id(self):
+        external = self.columns.external_ids.get(self.index, _NO_EXTERNAL_ID)
+        return self.columns.ids[self.index] if external is _NO_EXTERNAL_ID else external
+
+    @property
+    def lat(self) -> float:
+        return self.columns.lats[self.index]
+
+    @property
+    def lon(self) -> float:
+        return self.columns.lons[self.index]
+
+    @property
+    def kind(self) -> str:
+        return self.columns.kind_names[self.columns.kinds[self.index]]
+
+    @property
+    def name(self):
+        return self.columns.names.get(self.index)
+
+    @property
+    def geohash(self) -> str:
+        return self.geohash_at(GEOKEY_PRECISION)
+
+    def geohash_at(self, precision: int) -> str:
+        """The row's geohash truncated to precision (at most 9)"""
+        code = self.columns.geohashes[self.index] >> 5 * (GEOKEY_PRECISION - precision)
+        return int_to_geohash(code, precision)
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "lat": self.lat, "lon": self.lon, "name": self.name, "type": self.kind}
+
+
+class PointColumns:
+    """Map points stored as parallel typed arrays"""
+
+    __slots__ = ("ids", "lats", "lons", "kinds", "geohashes", "names", "external_ids", "kind_names", "_kind_codes")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.kinds = array("B")
+        self.geohashes = array("q")
+        self.names = {}  # row number -> name, for rows that have one
+        self.external_ids = {}  # row number -> original id, for rows whose id isn't an integer
+        self.kind_names = []
+        self._kind_codes = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> PointRow:
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError("row index out of range")
+        return PointRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield PointRow(self, index)
+
+    def kind_code(self, kind: str) -> int:
+        """Intern a kind name"""
+        code = self._kind_codes.get(kind)
+        if code is None:
+            if len(self.kind_names) >= 256:
+                raise ValueError("at most 256 kinds per store")
+            code = self._kind_codes[kind] = len(self.kind_names)
+            self.kind_names.append(kind)
+        return code
+
+    def extend(self, rows, kind: str) -> int:
+        """
+        Append rows of one kind
+
+        Args:
+            rows: Iterable of (id, lat, lon, name) tuples; rows without
+                usable coordinates are skipped, ids that aren't integers are
+                kept in external_ids
+            kind: Kind name shared by the rows
+
+        Returns:
+            int: Number of rows added
+        """
+        code = self.kind_code(kind)
+        added = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                added += self._append_chunk(chunk, code)
+                chunk = []
+        if chunk:
+            added += self._append_chunk(chunk, code)
+        return added
+
+    def _append_chunk(self, rows: list, code: int) -> int:
+        ids, lats, lons, names, external = [], [], [], [], {}
+        for row_id, lat, lon, name in rows:
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                continue
+            if not (math.isfinite(lat) and math.isfinite(lon)) or abs(lat) > 90 or abs(lon) > 180:
+                continue
+            stored = _integer_id(row_id)
+            if stored is None:
+                stored = stand_in_id(row_id, lat, lon)
+                external[len(ids)] = row_id
+            ids.append(stored)
+            lats.append(lat)
+            lons.append(lon)
+            names.append(name)
+        if not ids:
+            return 0
+
+        start = len(self.ids)
+        codes = encode_batch_int(lats, lons, GEOKEY_PRECISION)
+        self.ids.extend(ids)
+        self.lats.extend(lats)
+        self.lons.extend(lons)
+        self.kinds.extend([code] * len(ids))
+        if isinstance(codes, list):
+            self.geohashes.extend(codes)
+        else:
+            self.geohashes.frombytes(codes.astype("<i8").tobytes())
+        for offset, name in enumerate(names):
+            if name:
+                self.names[start + offset] = str(name)
+        for offset, row_id in external.items():
+            self.external_ids[start + offset] = row_id
+        return len(ids)
+
+    @classmethod
+    def from_buffers(cls, ids, lats, lons, kinds, geohashes, names, kind_names: list,
+                     external_ids=None) -> "PointColumns":
+        """Wrap existing (e.g. memory-mapped) columns without copying; the result is read-only"""
+        columns = cls()
+        columns.ids, columns.lats, columns.lons, columns.kinds, columns.geohashes = ids, lats, lons, kinds, geohashes
+        columns.names = names
+        if external_ids is not None:
+            columns.external_ids = external_ids
+        for kind in kind_names:
+            columns.kind_code(kind)
+        return columns
+
+    def sorted_by_id(self) -> "PointColumns":
+        """A copy with the rows in id order"""
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        columns = PointColumns()
+        columns.kind_names, columns._kind_codes = list(self.kind_names), dict(self._kind_codes)
+        for name in ("ids", "lats", "lons", "kinds", "geohashes"):
+            source = getattr(self, name)
+            setattr(columns, name, array(source.typecode if hasattr(source, "typecode") else source.format,
+                                         (source[i] for i in order)))
+        position = {old: new for new, old in enumerate(order) if old in self.names or old in self.external_ids}
+        columns.names = {position[old]: name for old, name in self.names.items()}
+        columns.external_ids = {position[old]: row_id for old, row_id in self.external_ids.items()}
+        return columns
+
+    @classmethod
+    def from_rows(cls, rows, kind: str) -> "PointColumns":
+        columns = cls()
+        columns.extend(rows, kind)
+        return columns
+
+    def count(self, kind: str) -> int:
+        code = self._kind_codes.get(kind)
+        return 0 if code is None else sum(1 for c in self.kinds if c == code)
+
+    def centroid(self):
+        """Mean lat/lon of every row, or None when empty"""
+        if not self.ids:
+            return None
+        return math.fsum(self.lats) / len(self.lats), math.fsum(self.lons) / len(self.lons)
+
+    def within(self, lat: float, lon: float, radius_m: float) -> list:
+        """
+        Get the rows within radius_m of a point
+
+        Returns:
+            list: (row number, distance_m) pairs, nearest first
+        """
+        south, west, north, east = radius_bbox(lat, lon, radius_m)
+        np = _numpy()
+        if np is None:
+            matches = []
+            for index, (row_lat, row_lon) in enumerate(zip(self.lats, self.lons)):
+                if south <= row_lat <= north and west <= row_lon <= east:
+                    distance = haversine_m(lat, lon, row_lat, row_lon)
+                    if distance <= radius_m:
+                        matches.append((index, distance))
+            matches.sort(key=lambda m: m[1])
+            return matches
+
+        lats = np.frombuffer(self.lats, dtype=np.float64)
+        lons = np.frombuffer(self.lons, dtype=np.float64)
+        candidates = np.flatnonzero((lats >= south) & (lats <= north) & (lons >= west) & (lons <= east))
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(lats[candidates]), np.radians(lons[candidates])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        inside = distances <= radius_m
+        indexes, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return list(zip(indexes[order].tolist(), distances[order].tolist()))
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns (array buffers plus names)"""
+        import sys
+
+        size = sum(memoryview(a).nbytes for a in (self.ids, self.lats, self.lons, self.kinds, self.geohashes))
+        size += sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names.values())
+        size += sys.getsizeof(self.external_ids) + sum(sys.getsizeof(i) for i in self.external_ids.values())
+        return size
@@ -0,0 +1,26 @@
+"""
+Database router for the SQLite performance profile (SQLITE_PERFORMANCE)
+
+Reads go to the 'replica' alias, a read-only connection to the same
+database file. Under WAL it reads a consistent snapshot without waiting on
+the writer, and each thread keeps its own persistent connection per alias,
+so readers and the writer never share a connection or its locks.
+"""
+from django.db import connections
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Inside a write transaction, read from the writer so uncommitted changes are visible
+        if connections["default"].in_atomic_block:
+            return "default"
+        return "replica"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # both aliases are the same database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
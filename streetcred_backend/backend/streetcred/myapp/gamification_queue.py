@@ -0,0 +1,185 @@
+"""
+Durable work queue for points and badge awards
+
+Accepting a report only inserts it and enqueues a "report_accepted" task
+(a GamificationTask row in the local database). Worker processes
+(`manage.py run_gamification_worker`, as many as needed) claim tasks,
+update the user's points, award milestone badges and store the outcome on
+the task, which clients poll via GET /api/reports/gamification/{task_id}.
+
+Claiming is a conditional UPDATE on the task rows, so any number of workers
+can share the queue without handing out a task twice. A claim is a lease:
+tasks held longer than GAMIFICATION_LEASE_SECONDS (a crashed worker) go
+back to the queue. Failed tasks are retried with exponential backoff up to
+GAMIFICATION_MAX_ATTEMPTS.
+
+Tasks for the same user in one claimed batch are applied together (one
+profile read/update and one milestone check), and the profiles and badges
+of every user in the batch are read with one query each (see loaders.py). Adding points is recorded on
+the task before badges are awarded, so a retry after a badge failure never
+adds the points twice.
+"""
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .loaders import loader_scope
+from .models import GamificationTask
+
+
+def enqueue_report_accepted(user_id: str, lat: float, lon: float, report_ids: list, points: int = 1) -> GamificationTask:
+    """
+    Queue the points/badge work for newly accepted reports
+
+    Args:
+        user_id: Reporting user's profile ID
+        lat: Latitude of the (latest) report, used for location badges
+        lon: Longitude of the (latest) report
+        report_ids: Supabase ids of the reports
+        points: Points to award
+
+    Returns:
+        GamificationTask: The pending task
+    """
+    return GamificationTask.objects.create(
+        kind="report_accepted",
+        user_id=user_id,
+        payload={"points": points, "lat": lat, "lon": lon, "report_ids": report_ids},
+    )
+
+
+def task_status(task: GamificationTask) -> dict:
+    return {
+        "task_id": task.id,
+        "user_id": task.user_id,
+        "status": task.status,
+        "attempts": task.attempts,
+        "report_ids": task.payload.get("report_ids", []),
+        "result": task.result if task.status == GamificationTask.DONE else None,
+        "error": task.error,
+        "created_at": task.created_at.isoformat(),
+        "updated_at": task.updated_at.isoformat(),
+    }
+
+
+def claim(batch_size: int, lease_seconds: float = None) -> tuple:
+    """
+    Claim up to batch_size due tasks for this worker
+
+    Returns:
+        tuple: (claim_token, tasks)
+    """
+    now = timezone.now()
+    lease = settings.GAMIFICATION_LEASE_SECONDS if lease_seconds is None else lease_seconds
+    claimable = Q(status=GamificationTask.PENDING, available_at__lte=now) | Q(
+        status=GamificationTask.RUNNING, claimed_at__lt=now - timedelta(seconds=lease)
+    )
+    ids = list(
+        GamificationTask.objects.filter(claimable)
+        .order_by("available_at", "id")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    if not ids:
+        return None, []
+
+    # Rows another worker claimed in the meantime no longer match `claimable`
+    token = uuid.uuid4().hex
+    GamificationTask.objects.filter(claimable, id__in=ids).update(
+        status=GamificationTask.RUNNING,
+        claim_token=token,
+        claimed_at=now,
+        attempts=F("attempts") + 1,
+        updated_at=now,
+    )
+    return token, list(GamificationTask.objects.filter(claim_token=token).order_by("id"))
+
+
+def _complete(token: str, tasks: list, result: dict):
+    GamificationTask.objects.filter(id__in=[t.id for t in tasks], claim_token=token).update(
+        status=GamificationTask.DONE, result=result, error=None, claim_token=None, updated_at=timezone.now()
+    )
+
+
+def _fail(token: str, tasks: list, error: str):
+    now = timezone.now()
+    for task in tasks:
+        if task.attempts >= settings.GAMIFICATION_MAX_ATTEMPTS:
+            status, available_at = GamificationTask.FAILED, task.available_at
+        else:
+            backoff = settings.GAMIFICATION_RETRY_SECONDS * 2 ** (task.attempts - 1)
+            status, available_at = GamificationTask.PENDING, now + timedelta(seconds=backoff)
+        # Keep task.result: it records whether the points were already added
+        GamificationTask.objects.filter(id=task.id, claim_token=token).update(
+            status=status, available_at=available_at, error=error, claim_token=None, updated_at=now
+        )
+
+
+def _process_user(token: str, user_id: str, tasks: list) -> dict:
+    """Apply every claimed task for one user: add their points once, then check milestones once"""
+    from .badge_rewards import add_user_points, award_badges_for_points
+    from .response_cache import invalidate
+
+    unapplied = [t for t in tasks if not (t.result or {}).get("points_applied")]
+    points = sum(t.payload.get("points", 1) for t in unapplied)
+    previous_points, new_points = add_user_points(user_id, points)
+    if unapplied:
+        GamificationTask.objects.filter(id__in=[t.id for t in unapplied], claim_token=token).update(
+            result={"points_applied": True, "previous_points": previous_points, "new_points": new_points}
+        )
+
+    latest = tasks[-1].payload
+    badge_result = award_badges_for_points(user_id, new_points, latest["lat"], latest["lon"])
+    invalidate("table:profiles", "table:user_badges", f"user-badges:{user_id}")
+    return {
+        "user_id": user_id,
+        "previous_points": previous_points,
+        "new_points": new_points,
+        "points_added": points,
+        **badge_result
+    }
+
+
+def process_batch(token: str, tasks: list) -> dict:
+    """
+    Process claimed tasks, grouped by user
+
+    Returns:
+        dict: {"done": n, "failed": n, "saved_queries": n} task counts and
+            Supabase round trips saved by batching the lookups
+    """
+    by_user = {}
+    for task in tasks:
+        by_user.setdefault(task.user_id, []).append(task)
+
+    counts = {"done": 0, "failed": 0}
+    with loader_scope() as loaders:
+        loaders.profiles.prefetch(by_user)
+        loaders.user_badges.prefetch(by_user)
+        for user_id, user_tasks in by_user.items():
+            try:
+                result = _process_user(token, user_id, user_tasks)
+            except Exception as e:
+                print(f"ERROR: Gamification failed for {user_id}: {e}")
+                _fail(token, user_tasks, str(e))
+                counts["failed"] += len(user_tasks)
+                continue
+            _complete(token, user_tasks, result)
+            counts["done"] += len(user_tasks)
+    counts["saved_queries"] = loaders.saved()
+    return counts
+
+
+def run_worker(batch_size: int = 50, poll_interval: float = 1.0, once: bool = False, log=print):
+    """Claim and process tasks until interrupted (or until the queue is empty with once=True)"""
+    while True:
+        token, tasks = claim(batch_size)
+        if tasks:
+            counts = process_batch(token, tasks)
+            log(f"Processed {len(tasks)} tasks: {counts['done']} done, {counts['failed']} failed, "
+                f"{counts['saved_queries']} Supabase queries saved")
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,197 @@
+import math
+import pygeohash as pgh
+
+# Geohash precision used to track which map regions have changed.
+# Precision 6 cells are roughly 1.2km x 0.6km.
+REGION_PRECISION = 6
+
+EARTH_RADIUS_M = 6371000
+
+# Precision of the integer Z-order key (geokey) stored on Location, Report and
+# UserLocation. Precision 9 cells are roughly 5m x 5m.
+GEOKEY_PRECISION = 9
+
+
+def geohash_cell_size(precision: int) -> tuple[float, float]:
+    """
+    Get the size of a geohash cell in degrees
+
+    Args:
+        precision: Geohash length
+
+    Returns:
+        tuple: (lat_height, lon_width) in degrees
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def geohashes_in_bbox(south: float, west: float, north: float, east: float, precision: int) -> list[str]:
+    """
+    Get every geohash cell of the given precision that overlaps a bounding box
+
+    Args:
+        south, west, north, east: Bounding box in degrees
+        precision: Geohash length (0 returns the single empty prefix)
+
+    Returns:
+        list: Geohash strings covering the box
+    """
+    if precision <= 0:
+        return [""]
+
+    south, north = max(south, -90.0), min(north, 90.0)
+    west, east = max(west, -180.0), min(east, 180.0)
+    cell_lat, cell_lon = geohash_cell_size(precision)
+
+    # Snap to the cell grid so each step lands on a new cell
+    lat = -90.0 + math.floor((south + 90.0) / cell_lat) * cell_lat
+    cells = []
+    while lat < north or (lat == south == north):
+        lon = -180.0 + math.floor((west + 180.0) / cell_lon) * cell_lon
+        while lon < east or (lon == west == east):
+            center_lat = min(lat + cell_lat / 2, 90.0)
+            center_lon = min(lon + cell_lon / 2, 180.0)
+            cells.append(pgh.encode(center_lat, center_lon, precision=precision))
+            lon += cell_lon
+        lat += cell_lat
+    return cells
+
+
+def region_prefixes(lat: float, lon: float) -> list[str]:
+    """Get the region keys (every geohash prefix up to REGION_PRECISION) containing a point"""
+    geohash = pgh.encode(float(lat), float(lon), precision=REGION_PRECISION)
+    return [geohash[:i] for i in range(REGION_PRECISION + 1)]
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """
+    Get the lat/lon bounds of a Web Mercator (slippy map) tile
+
+    Returns:
+        tuple: (south, west, north, east) in degrees
+    """
+    n = 1 << z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def lonlat_to_world(lat: float, lon: float) -> tuple[float, float]:
+    """Project a point to Web Mercator world coordinates in the range [0, 1)"""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def region_precision_for_zoom(z: int) -> int:
+    """
+    Get the coarsest geohash precision whose cells are no smaller than a tile at zoom z
+
+    A tile then overlaps at most a 2x2 block of region cells.
+    """
+    precision = 0
+    while precision < REGION_PRECISION and (5 * (precision + 1) + 1) // 2 <= z:
+        precision += 1
+    return precision
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in meters"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {c: i for i, c in enumerate(GEOHASH_BASE32)}
+
+
+def geohash_to_int(geohash: str) -> int:
+    """Pack a geohash into an integer (5 bits per character, first character most significant)"""
+    value = 0
+    for c in geohash:
+        value = (value << 5) | _BASE32_INDEX[c]
+    return value
+
+
+def int_to_geohash(value: int, precision: int) -> str:
+    """Unpack an integer produced by geohash_to_int"""
+    chars = []
+    for _ in range(precision):
+        chars.append(GEOHASH_BASE32[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def covering_prefixes(south: float, west: float, north: float, east: float, max_precision: int,
+                      max_cells: int = 64) -> list[str]:
+    """
+    Cover a bounding box with as few geohash prefixes as practical
+
+    Picks the finest precision (up to max_precision) that needs at most
+    max_cells cells. Every finer cell inside the box starts with one of the
+    returned prefixes, so a sorted integer key column can be scanned with
+    one range per prefix.
+    """
+    precision = max_precision
+    while precision > 1:
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        estimate = (math.ceil((north - south) / cell_lat) + 1) * (math.ceil((east - west) / cell_lon) + 1)
+        if estimate <= max_cells:
+            break
+        precision -= 1
+    return geohashes_in_bbox(south, west, north, east, precision)
+
+
+def geokey(lat: float, lon: float) -> int:
+    """Get the integer Z-order key for a point (its precision-9 geohash packed by geohash_to_int)"""
+    return geohash_to_int(pgh.encode(float(lat), float(lon), precision=GEOKEY_PRECISION))
+
+
+def radius_bbox(lat: float, lon: float, radius_m: float) -> tuple[float, float, float, float]:
+    """
+    Get a bounding box that contains every point within radius_m of a point
+
+    Returns:
+        tuple: (south, west, north, east) in degrees
+    """
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+    dlon = min(math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)), 180.0)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def prefix_key_range(prefix: str) -> tuple[int, int]:
+    """Get the half-open range of geokeys whose geohash starts with prefix"""
+    shift = 5 * (GEOKEY_PRECISION - len(prefix))
+    low = geohash_to_int(prefix) << shift
+    return low, low + (1 << shift)
+
+
+def bbox_key_ranges(south: float, west: float, north: float, east: float,
+                    max_cells: int = 16) -> list[tuple[int, int]]:
+    """
+    Turn a bounding box into geokey ranges
+
+    Each covering prefix becomes the half-open range of geokeys that start
+    with it; ranges that touch are merged. Every point inside the box falls
+    in one of the ranges, so `geokey >= low AND geokey < high` per range is
+    a set of index seeks (plus a few points just outside the box).
+
+    Returns:
+        list: Sorted (low, high) pairs
+    """
+    ranges = []
+    for prefix in sorted(set(covering_prefixes(south, west, north, east, GEOKEY_PRECISION, max_cells))):
+        low, high = prefix_key_range(prefix)
+        if ranges and ranges[-1][1] >= low:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], high))
+        else:
+            ranges.append((low, high))
+    return ranges
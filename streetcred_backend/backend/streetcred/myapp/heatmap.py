@@ -0,0 +1,364 @@
+"""
+Multi-resolution report density (heatmap) aggregates
+
+Counts are kept per geohash cell at several precisions, split into a ring
+of time buckets (daily by default) plus an all-time total. Each precision
+level is three flat arrays: sorted cell keys (geohash packed as an
+integer), a row-major uint16 bucket matrix (saturating) and uint32 totals,
+so an occupied cell costs 12 + 2 * buckets bytes. A bounding-box query
+turns into one binary-searched key range per covering prefix.
+
+The pyramid is rebuilt from the reports table by ``rebuild_heatmap`` and
+saved to HEATMAP_SNAPSHOT_PATH together with the id of the newest report it
+counts. A worker that loads a snapshot (on first use, or when a newer one
+is written) first replays the reports added since that id, so counts
+survive restarts and include other processes' reports; after that it
+updates its copy in place on each report insert. Run ``rebuild_heatmap
+--interval`` to keep the replayed tail short.
+
+Loading and replaying never happens inside a request: get_pyramid() starts
+it in a background thread and keeps answering from the copy already loaded
+(the heatmap answers 503 until the first one is). Reports recorded while a
+load runs are kept and added to the new copy if the replay didn't see them.
+Without any snapshot the first request starts the build the same way.
+"""
+import bisect
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+import pygeohash as pgh
+from django.conf import settings
+from .auth import iter_table_rows
+from .geo import covering_prefixes, geohash_to_int, int_to_geohash
+
+SNAPSHOT_MAGIC = b"SCHEAT02"
+BUCKET_MAX = 0xFFFF  # per-bucket counts saturate rather than wrap
+
+
+class DensityPyramid:
+    """Per-cell report counts at several geohash precisions with time buckets"""
+
+    def __init__(self, precisions=(4, 5, 6, 7, 8), bucket_seconds: int = 86400, bucket_count: int = 14):
+        self.precisions = tuple(sorted(precisions))
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = bucket_count
+        self.bucket_epochs = array("q", [-1] * bucket_count)
+        self.keys = {p: array("Q") for p in self.precisions}
+        self.buckets = {p: array("H") for p in self.precisions}
+        self.totals = {p: array("I") for p in self.precisions}
+        self.last_report_id = None  # newest report counted, for replaying the rest after a load
+        self._lock = threading.Lock()
+
+    def _slot(self, timestamp: float):
+        """Get the ring slot for a timestamp, recycling it if it holds an older bucket"""
+        epoch = int(timestamp // self.bucket_seconds)
+        slot = epoch % self.bucket_count
+        held = self.bucket_epochs[slot]
+        if held == epoch:
+            return slot
+        if held > epoch:
+            return None  # older than the retained window
+        for p in self.precisions:
+            self.buckets[p][slot::self.bucket_count] = array("H", bytes(2 * len(self.keys[p])))
+        self.bucket_epochs[slot] = epoch
+        return slot
+
+    def add(self, lat: float, lon: float, timestamp: float = None, count: int = 1):
+        """Record a report at a point"""
+        geohash = pgh.encode(float(lat), float(lon), precision=self.precisions[-1])
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            slot = self._slot(timestamp)
+            for p in self.precisions:
+                key = geohash_to_int(geohash[:p])
+                keys, buckets = self.keys[p], self.buckets[p]
+                i = bisect.bisect_left(keys, key)
+                if i == len(keys) or keys[i] != key:
+                    keys.insert(i, key)
+                    self.totals[p].insert(i, 0)
+                    buckets[i * self.bucket_count:i * self.bucket_count] = array("H", bytes(2 * self.bucket_count))
+                self.totals[p][i] += count
+                if slot is not None:
+                    index = i * self.bucket_count + slot
+                    buckets[index] = min(buckets[index] + count, BUCKET_MAX)
+
+    @classmethod
+    def build(cls, rows, **kwargs) -> "DensityPyramid":
+        """
+        Build a pyramid in one pass from (lat, lon, timestamp) rows
+
+        Much faster than repeated add(): cells are accumulated in dicts and
+        packed into sorted arrays once at the end.
+        """
+        pyramid = cls(**kwargs)
+        rows = list(rows)
+        if not rows:
+            return pyramid
+
+        newest = max(ts for _, _, ts in rows)
+        newest_epoch = int(newest // pyramid.bucket_seconds)
+        for epoch in range(newest_epoch - pyramid.bucket_count + 1, newest_epoch + 1):
+            pyramid.bucket_epochs[epoch % pyramid.bucket_count] = epoch
+
+        accumulators = {p: {} for p in pyramid.precisions}
+        finest = pyramid.precisions[-1]
+        for lat, lon, ts in rows:
+            geohash = pgh.encode(float(lat), float(lon), precision=finest)
+            epoch = int(ts // pyramid.bucket_seconds)
+            slot = epoch % pyramid.bucket_count if epoch > newest_epoch - pyramid.bucket_count else None
+            for p in pyramid.precisions:
+                cell = accumulators[p].get(geohash[:p])
+                if cell is None:
+                    cell = accumulators[p][geohash[:p]] = [0] * (pyramid.bucket_count + 1)
+                cell[pyramid.bucket_count] += 1
+                if slot is not None:
+                    cell[slot] += 1
+
+        for p, cells in accumulators.items():
+            packed = sorted((geohash_to_int(g), c) for g, c in cells.items())
+            pyramid.keys[p] = array("Q", (key for key, _ in packed))
+            pyramid.totals[p] = array("I", (c[-1] for _, c in packed))
+            pyramid.buckets[p] = array("H", (min(n, BUCKET_MAX) for _, c in packed for n in c[:-1]))
+        return pyramid
+
+    def query(self, south: float, west: float, north: float, east: float, precision: int,
+              since: float = None) -> list[dict]:
+        """
+        Get non-empty cells overlapping a bounding box
+
+        Args:
+            south, west, north, east: Bounding box in degrees
+            precision: One of self.precisions
+            since: Only count reports at or after this unix time (bucket resolution);
+                None counts all time
+
+        Returns:
+            list: [{"geohash", "lat", "lon", "count"}]
+        """
+        if precision not in self.keys:
+            raise ValueError(f"Precision must be one of {self.precisions}")
+
+        with self._lock:
+            slots = None
+            if since is not None:
+                since_epoch = int(since // self.bucket_seconds)
+                slots = [s for s, epoch in enumerate(self.bucket_epochs) if epoch >= since_epoch]
+
+            keys, buckets, totals = self.keys[precision], self.buckets[precision], self.totals[precision]
+            cells = []
+            for prefix in covering_prefixes(south, west, north, east, precision):
+                shift = 5 * (precision - len(prefix))
+                low = geohash_to_int(prefix) << shift
+                start = bisect.bisect_left(keys, low)
+                end = bisect.bisect_left(keys, low + (1 << shift), lo=start)
+                for i in range(start, end):
+                    if slots is None:
+                        total = totals[i]
+                    else:
+                        base = i * self.bucket_count
+                        total = sum(buckets[base + s] for s in slots)
+                    if not total:
+                        continue
+                    geohash = int_to_geohash(keys[i], precision)
+                    lat, lon, lat_err, lon_err = pgh.decode_exactly(geohash)
+                    if lat + lat_err >= south and lat - lat_err <= north and \
+                            lon + lon_err >= west and lon - lon_err <= east:
+                        cells.append({"geohash": geohash, "lat": lat, "lon": lon, "count": total})
+        return cells
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the arrays"""
+        arrays = [self.bucket_epochs, *self.keys.values(), *self.buckets.values(), *self.totals.values()]
+        return sum(a.itemsize * len(a) for a in arrays)
+
+    def cell_count(self) -> dict:
+        return {p: len(keys) for p, keys in self.keys.items()}
+
+    def save(self, path: str):
+        """Write the pyramid to disk atomically"""
+        with self._lock:
+            header = json.dumps({
+                "precisions": self.precisions,
+                "bucket_seconds": self.bucket_seconds,
+                "bucket_count": self.bucket_count,
+                "cells": [len(self.keys[p]) for p in self.precisions],
+                "last_report_id": self.last_report_id,
+            }).encode()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header)
+                self.bucket_epochs.tofile(f)
+                for p in self.precisions:
+                    self.keys[p].tofile(f)
+                    self.totals[p].tofile(f)
+                    self.buckets[p].tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DensityPyramid":
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a heatmap snapshot")
+            (header_size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size))
+            pyramid = cls(header["precisions"], header["bucket_seconds"], header["bucket_count"])
+            pyramid.last_report_id = header.get("last_report_id")
+            pyramid.bucket_epochs = array("q")
+            pyramid.bucket_epochs.fromfile(f, pyramid.bucket_count)
+            for p, cells in zip(pyramid.precisions, header["cells"]):
+                pyramid.keys[p] = array("Q")
+                pyramid.keys[p].fromfile(f, cells)
+                pyramid.totals[p] = array("I")
+                pyramid.totals[p].fromfile(f, cells)
+                pyramid.buckets[p] = array("H")
+                pyramid.buckets[p].fromfile(f, cells * pyramid.bucket_count)
+        return pyramid
+
+
+def zoom_to_precision(zoom: int, precisions=(4, 5, 6, 7, 8)) -> int:
+    """Pick the precision whose cells are roughly 1/8 of a map tile wide at this zoom"""
+    chosen = precisions[0]
+    for p in precisions:
+        if (5 * p + 1) // 2 <= zoom + 3:
+            chosen = p
+    return chosen
+
+
+def _parse_timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def load_report_rows(after_id: int = None):
+    """Yield (id, lat, lon, timestamp) for every report in Supabase (or those after a report id), in id order"""
+    for report in iter_table_rows("reports", "id, lat, lon, created_at", after=after_id):
+        if report.get("lat") is None or report.get("lon") is None:
+            continue
+        yield report["id"], float(report["lat"]), float(report["lon"]), _parse_timestamp(report["created_at"])
+
+
+def rebuild_pyramid() -> DensityPyramid:
+    """Rebuild the pyramid from every report and save it as the shared snapshot"""
+    newest = {"id": None}
+
+    def rows():
+        for report_id, lat, lon, timestamp in load_report_rows():
+            newest["id"] = report_id
+            yield lat, lon, timestamp
+
+    pyramid = DensityPyramid.build(
+        rows(),
+        bucket_seconds=settings.HEATMAP_BUCKET_SECONDS,
+        bucket_count=settings.HEATMAP_BUCKET_COUNT,
+    )
+    pyramid.last_report_id = newest["id"] or 0
+    pyramid.save(str(settings.HEATMAP_SNAPSHOT_PATH))
+    return pyramid
+
+
+def load_snapshot(path: str) -> DensityPyramid:
+    """Load a snapshot and count the reports added after it was built"""
+    pyramid = DensityPyramid.load(path)
+    if pyramid.last_report_id is None:
+        return pyramid  # written before snapshots recorded their newest report
+    try:
+        for report_id, lat, lon, timestamp in load_report_rows(after_id=pyramid.last_report_id):
+            pyramid.add(lat, lon, timestamp)
+            pyramid.last_report_id = report_id
+    except Exception as e:
+        print(f"ERROR: Could not replay reports newer than the heatmap snapshot: {e}")
+    return pyramid
+
+
+_pyramid = None
+_pyramid_mtime = None  # mtime of the snapshot last loaded (or tried)
+_pyramid_lock = threading.Lock()
+_building = False
+_loading = False
+_recorded = None  # (report_id, lat, lon, timestamp) counted while a load runs
+
+
+def _build_snapshot():
+    global _building
+    try:
+        rebuild_pyramid()
+    except Exception as e:
+        print(f"ERROR: Could not build heatmap snapshot: {e}")
+    finally:
+        _building = False
+
+
+def _load_snapshot(path: str, mtime: float):
+    """Load a snapshot in the background and swap it in with the reports recorded meanwhile"""
+    global _pyramid, _pyramid_mtime, _loading, _recorded
+    try:
+        pyramid = load_snapshot(path)
+    except Exception as e:
+        print(f"ERROR: Could not load heatmap snapshot {path}: {e}")
+        pyramid = None
+    with _pyramid_lock:
+        if pyramid is not None:
+            replayed = pyramid.last_report_id
+            for report_id, lat, lon, timestamp in _recorded:
+                if replayed is None or report_id is None or report_id > replayed:
+                    pyramid.add(lat, lon, timestamp)
+            _pyramid = pyramid
+        _pyramid_mtime = mtime  # a broken snapshot isn't retried until a new one is written
+        _recorded = None
+        _loading = False
+
+
+def get_pyramid():
+    """
+    Get the process-wide pyramid, loading the snapshot in the background on first use and when a newer one is written
+
+    Returns:
+        DensityPyramid: or None until the first snapshot is built and loaded
+    """
+    global _building, _loading, _recorded
+    path = str(settings.HEATMAP_SNAPSHOT_PATH)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        mtime = None
+
+    if mtime is None:
+        if _pyramid is None and not _building:
+            with _pyramid_lock:
+                if not _building:
+                    _building = True
+                    threading.Thread(target=_build_snapshot, name="heatmap-build", daemon=True).start()
+        return _pyramid
+    if mtime == _pyramid_mtime or _loading:
+        return _pyramid
+
+    with _pyramid_lock:
+        if mtime != _pyramid_mtime and not _loading:
+            _loading = True
+            _recorded = []
+            threading.Thread(target=_load_snapshot, args=(path, mtime), name="heatmap-load", daemon=True).start()
+    return _pyramid
+
+
+def record_report(lat: float, lon: float, created_at=None, report_id: int = None):
+    """Count a newly inserted report in the loaded pyramid, never failing the caller"""
+    try:
+        timestamp = _parse_timestamp(created_at) if created_at else time.time()
+        with _pyramid_lock:
+            if _recorded is not None:
+                _recorded.append((report_id, lat, lon, timestamp))  # for the copy being loaded
+            pyramid = _pyramid
+        # Nothing loaded yet and no load running: the first load replays
+        # reports from the table, this one included
+        if pyramid is not None:
+            pyramid.add(lat, lon, timestamp)
+    except Exception as e:
+        print(f"ERROR: Could not update heatmap: {e}")
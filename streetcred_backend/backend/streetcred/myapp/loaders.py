@@ -0,0 +1,215 @@
+"""
+Request-scoped batching loaders for Supabase lookups (DataLoader style)
+
+A LoaderScope holds one Loader per lookup (profiles by user_id, user_badges
+by user_id, badges by location_name). Keys can be queued with prefetch()
+ahead of time; the next load() sends every queued key and the requested
+one as a single `in_()` query, and the rows are memoized for the rest of
+the scope, so a profile or badge list read twice in one request (or for
+every user of a batch) costs one round trip.
+
+LoaderScopeMiddleware opens a scope per request; batch code (the
+gamification worker, batch report submission) opens its own with
+loader_scope(). Outside any scope get_loaders() hands out a fresh,
+unshared scope, so every call queries Supabase as before. Writers keep the
+memo honest with prime() (new value known) or clear() (refetch next time).
+
+Keys of user_id loaders are canonicalized (lowercase, hyphenated UUID, as
+Supabase returns them), so an upper-case or unhyphenated id finds its row;
+keys that aren't UUIDs have no row and are never sent to Supabase.
+
+Each scope counts the loads it served and the queries it sent; the totals
+are at GET /api/debug/loader-metrics.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+IN_CHUNK_SIZE = 200  # keys per in_() query, keeps the request URL short
+
+_current = ContextVar("loader_scope", default=None)
+
+_INVALID = object()  # key of a UUID loader that isn't a UUID
+
+
+def canonical_uuid(key):
+    """Canonical string form of a UUID key, or _INVALID"""
+    try:
+        return str(uuid.UUID(str(key)))
+    except ValueError:
+        return _INVALID
+
+
+class Loader:
+    """Batches and memoizes lookups of one table by one column"""
+
+    def __init__(self, table: str, key: str, columns: str = "*", many: bool = False, order: str = None,
+                 uuid_keys: bool = False):
+        """
+        Args:
+            table: Supabase table
+            key: Column the lookups are keyed by
+            columns: Select clause (must include the key column)
+            many: Whether a key maps to a list of rows rather than one row
+            order: Column to order each key's rows by
+            uuid_keys: Whether the key column is a UUID (keys are canonicalized)
+        """
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.many = many
+        self.order = order
+        self.uuid_keys = uuid_keys
+        self.loads = 0  # load()/load_many() calls; each used to be its own query
+        self.queries = 0
+        self._rows = {}  # key -> row, None, or list of rows when many
+        self._pending = {}  # keys queued for the next fetch (dict as an ordered set)
+
+    def _normalize(self, key):
+        return canonical_uuid(key) if self.uuid_keys else key
+
+    def prefetch(self, keys):
+        """Queue keys to be fetched together with the next load"""
+        for key in keys:
+            key = self._normalize(key)
+            if key is not _INVALID and key not in self._rows:
+                self._pending[key] = None
+
+    def load(self, key):
+        """Get the row (or list of rows) for a key; None (or []) if there is none"""
+        return self.load_many([key])[0]
+
+    def load_many(self, keys) -> list:
+        keys = [self._normalize(key) for key in keys]
+        self.loads += 1
+        self.prefetch(key for key in keys if key is not _INVALID)
+        if self._pending:
+            self._fetch()
+        missing = [] if self.many else None
+        return [missing if key is _INVALID else self._rows[key] for key in keys]
+
+    def prime(self, key, value):
+        """Set the memoized value for a key (e.g. after writing it)"""
+        key = self._normalize(key)
+        if key is not _INVALID:
+            self._rows[key] = value
+            self._pending.pop(key, None)
+
+    def clear(self, key):
+        """Forget a key so the next load fetches it again"""
+        self._rows.pop(self._normalize(key), None)
+
+    def _fetch(self):
+        from .badge_rewards import _get_supabase
+
+        keys = list(self._pending)
+        self._pending.clear()
+        supabase = _get_supabase()
+        for i in range(0, len(keys), IN_CHUNK_SIZE):
+            chunk = keys[i:i + IN_CHUNK_SIZE]
+            query = supabase.table(self.table).select(self.columns).in_(self.key, chunk)
+            if self.order:
+                query = query.order(self.order)
+            rows = query.execute().data or []
+            self.queries += 1
+
+            for key in chunk:
+                self._rows[key] = [] if self.many else None
+            for row in rows:
+                key = self._normalize(row[self.key])
+                if key not in self._rows:
+                    continue  # not one of the keys asked for
+                if self.many:
+                    self._rows[key].append(row)
+                else:
+                    self._rows[key] = row
+
+    def stats(self) -> dict:
+        return {"loads": self.loads, "queries": self.queries, "saved": max(0, self.loads - self.queries)}
+
+
+class LoaderScope:
+    def __init__(self):
+        self.profiles = Loader("profiles", "user_id", uuid_keys=True)
+        self.user_badges = Loader("user_badges", "user_id", "*, badges(*)", many=True, order="milestone",
+                                  uuid_keys=True)
+        self.badges = Loader("badges", "location_name", many=True)
+
+    def loaders(self) -> dict:
+        return {"profiles": self.profiles, "user_badges": self.user_badges, "badges": self.badges}
+
+    def stats(self) -> dict:
+        return {name: loader.stats() for name, loader in self.loaders().items()}
+
+    def saved(self) -> int:
+        """Round trips saved in this scope"""
+        return sum(loader.stats()["saved"] for loader in self.loaders().values())
+
+
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def _record(scope: LoaderScope):
+    with _totals_lock:
+        _totals["scopes"] = _totals.get("scopes", 0) + 1
+        for name, stats in scope.stats().items():
+            totals = _totals.setdefault(name, {"loads": 0, "queries": 0, "saved": 0})
+            for field, value in stats.items():
+                totals[field] += value
+
+
+def get_loader_metrics() -> dict:
+    """Loads, queries and saved round trips per loader, summed over finished scopes"""
+    with _totals_lock:
+        metrics = {name: dict(value) if isinstance(value, dict) else value for name, value in _totals.items()}
+    metrics.setdefault("scopes", 0)
+    metrics["saved"] = sum(value["saved"] for value in metrics.values() if isinstance(value, dict))
+    return metrics
+
+
+@contextmanager
+def loader_scope():
+    """Open a scope, or join the one already open (e.g. the request's)"""
+    scope = _current.get()
+    if scope is not None:
+        yield scope
+        return
+    scope = LoaderScope()
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+        _record(scope)
+
+
+def get_loaders() -> LoaderScope:
+    """Get the current scope's loaders (a fresh, unshared scope outside any)"""
+    return _current.get() or LoaderScope()
+
+
+class LoaderScopeMiddleware:
+    """Open a loader scope for each request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with loader_scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Sync views run via sync_to_async, which copies the context, so they see the scope
+        with loader_scope():
+            return await self.get_response(request)
@@ -0,0 +1,264 @@
+"""
+Retention for user_locations: simplified, compressed per-day archives
+
+`manage.py archive_user_locations` moves every whole UTC day older than
+LOCATION_RETENTION_DAYS out of the table. A day's rows are grouped into
+tracks (one per user and session), each track is simplified with
+Douglas-Peucker so it never strays more than LOCATION_SIMPLIFY_TOLERANCE_M
+from the original, and the tracks are written to
+LOCATION_ARCHIVE_DIR/<YYYY-MM-DD>.jsonl.gz, one JSON track per line.
+Only once that file is on disk are the day's rows deleted, a
+LOCATION_ARCHIVE_DELETE_BATCH at a time so ping inserts are never held up
+for long.
+
+Archived points keep their row id. If a run stops between writing a day
+and deleting all of its rows, the next run merges the leftover rows into
+the existing file instead of archiving them twice, and readers drop
+points they see both in the table and in the archive.
+
+load_history() merges recent rows and archived tracks for the
+/api/tracking/history endpoint.
+"""
+import gzip
+import json
+import math
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from itertools import groupby
+from django.conf import settings
+from django.utils import timezone
+from .geo import EARTH_RADIUS_M
+
+# Archived point: (row id, lat, lon, accuracy, created_at as epoch seconds)
+ID, LAT, LON, ACCURACY, TIMESTAMP = range(5)
+
+
+def _segment_distance_m(point, start, end) -> float:
+    """Distance from a projected point to the segment start-end, in meters"""
+    (px, py), (ax, ay), (bx, by) = point, start, end
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def simplify_track(points: list, tolerance_m: float) -> list:
+    """
+    Douglas-Peucker simplification of a track
+
+    Args:
+        points: Archived point tuples in time order
+        tolerance_m: Largest distance a dropped point may be from the simplified track
+
+    Returns:
+        list: The points kept (always the first and last), in order
+    """
+    if len(points) < 3:
+        return list(points)
+
+    # Local equirectangular projection, accurate to well under a meter over a city
+    lat0, lon0 = points[0][LAT], points[0][LON]
+    scale = math.cos(math.radians(lat0))
+    xy = [
+        (math.radians(p[LON] - lon0) * scale * EARTH_RADIUS_M, math.radians(p[LAT] - lat0) * EARTH_RADIUS_M)
+        for p in points
+    ]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _segment_distance_m(xy[i], xy[first], xy[last])
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def day_path(day: date) -> str:
+    return os.path.join(str(settings.LOCATION_ARCHIVE_DIR), f"{day.isoformat()}.jsonl.gz")
+
+
+def _user_prefix(user_id: str) -> str:
+    return json.dumps({"user_id": user_id}, separators=(",", ":"))[:-1]
+
+
+def read_day(day: date, user_id: str = None) -> list:
+    """
+    Get a day's archived tracks (only one user's with user_id)
+
+    Returns:
+        list: Track dicts with user_id, session_id, points and raw_points
+    """
+    try:
+        f = gzip.open(day_path(day), "rt", encoding="utf-8")
+    except FileNotFoundError:
+        return []
+    prefix = _user_prefix(user_id) if user_id else None
+    with f:
+        # Lines start with the user id, so other users' tracks aren't parsed
+        return [json.loads(line) for line in f if prefix is None or line.startswith(prefix)]
+
+
+def _write_day(day: date, tracks: list):
+    """Atomically replace a day's archive file, synced to disk before returning"""
+    path = day_path(day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                for track in sorted(tracks, key=lambda t: (t["user_id"], t["session_id"] or "")):
+                    f.write(json.dumps(track, separators=(",", ":")).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _day_bounds(day: date) -> tuple:
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def archive_day(day: date, tolerance_m: float = None) -> dict:
+    """
+    Archive one UTC day of user_locations and delete its rows
+
+    Returns:
+        dict: Counts of rows archived, points kept, tracks and rows deleted
+    """
+    from .models import UserLocation
+
+    tolerance_m = settings.LOCATION_SIMPLIFY_TOLERANCE_M if tolerance_m is None else tolerance_m
+    start, end = _day_bounds(day)
+    rows = UserLocation.objects.filter(created_at__gte=start, created_at__lt=end)\
+        .order_by("user_id", "session_id", "created_at", "id")\
+        .values_list("id", "user_id", "session_id", "lat", "lon", "accuracy", "created_at")\
+        .iterator(chunk_size=2000)
+
+    tracks = {(t["user_id"], t["session_id"]): t for t in read_day(day)}
+    ids = []
+    for (user_id, session_id), group in groupby(rows, key=lambda row: (str(row[1]), row[2])):
+        points = [(row_id, lat, lon, accuracy, created_at.timestamp())
+                  for row_id, _, _, lat, lon, accuracy, created_at in group]
+        ids.extend(point[ID] for point in points)
+
+        track = tracks.get((user_id, session_id))
+        raw_points = len(points)
+        if track is not None:  # leftovers of an interrupted run: merge, don't duplicate
+            archived = {point[ID] for point in track["points"]}
+            new_points = [point for point in points if point[ID] not in archived]
+            raw_points = track["raw_points"] + len(new_points)
+            points = sorted([tuple(point) for point in track["points"]] + new_points,
+                            key=lambda point: (point[TIMESTAMP], point[ID]))
+        tracks[(user_id, session_id)] = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "points": simplify_track(points, tolerance_m),
+            "raw_points": raw_points,
+        }
+
+    result = {"day": day.isoformat(), "rows": len(ids), "tracks": len(tracks), "deleted": 0,
+              "points": sum(len(t["points"]) for t in tracks.values())}
+    if not ids:
+        return result
+
+    _write_day(day, list(tracks.values()))
+
+    batch_size = settings.LOCATION_ARCHIVE_DELETE_BATCH
+    for i in range(0, len(ids), batch_size):
+        deleted, _ = UserLocation.objects.filter(id__in=ids[i:i + batch_size]).delete()
+        result["deleted"] += deleted
+    return result
+
+
+def days_to_archive(now: datetime = None) -> list:
+    """UTC days with rows older than LOCATION_RETENTION_DAYS whole days, oldest first"""
+    from .models import UserLocation
+
+    now = now or timezone.now()
+    cutoff, _ = _day_bounds(now.astimezone(dt_timezone.utc).date() - timedelta(days=settings.LOCATION_RETENTION_DAYS))
+    return [
+        moment.date() for moment in
+        UserLocation.objects.filter(created_at__lt=cutoff).datetimes("created_at", "day", tzinfo=dt_timezone.utc)
+    ]
+
+
+def run_retention(now: datetime = None, log=print) -> list:
+    """Archive every day past retention; returns archive_day() results"""
+    results = []
+    for day in days_to_archive(now):
+        result = archive_day(day)
+        log(f"Archived {day}: {result['rows']} rows -> {result['points']} points in "
+            f"{result['tracks']} tracks, deleted {result['deleted']}")
+        results.append(result)
+    return results
+
+
+def _point_out(point, archived: bool) -> dict:
+    return {
+        "lat": point[LAT],
+        "lon": point[LON],
+        "accuracy": point[ACCURACY],
+        "created_at": datetime.fromtimestamp(point[TIMESTAMP], dt_timezone.utc).isoformat(),
+        "archived": archived,
+    }
+
+
+def load_history(user_id: str, start: datetime, end: datetime, session_id: str = None) -> list:
+    """
+    Get a user's locations in [start, end), from the table and the archive
+
+    Args:
+        user_id: User's profile ID (canonical UUID string)
+        start, end: Aware datetimes
+        session_id: Only this session
+
+    Returns:
+        list: {"session_id", "points"} per session, ordered by first point;
+            archived points are the simplified track
+    """
+    from .models import UserLocation
+
+    hot = UserLocation.objects.filter(user_id=user_id, created_at__gte=start, created_at__lt=end)
+    if session_id is not None:
+        hot = hot.filter(session_id=session_id)
+
+    sessions = {}  # session_id -> {row id: (timestamp, point dict)}
+    for row_id, row_session, lat, lon, accuracy, created_at in hot.values_list(
+        "id", "session_id", "lat", "lon", "accuracy", "created_at"
+    ).iterator(chunk_size=2000):
+        point = (row_id, lat, lon, accuracy, created_at.timestamp())
+        sessions.setdefault(row_session, {})[row_id] = (point[TIMESTAMP], _point_out(point, False))
+
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    day = start.astimezone(dt_timezone.utc).date()
+    while day <= end.astimezone(dt_timezone.utc).date():
+        for track in read_day(day, user_id):
+            if session_id is not None and track["session_id"] != session_id:
+                continue
+            points = sessions.setdefault(track["session_id"], {})
+            for point in track["points"]:
+                if start_ts <= point[TIMESTAMP] < end_ts and point[ID] not in points:
+                    points[point[ID]] = (point[TIMESTAMP], _point_out(point, True))
+        day += timedelta(days=1)
+
+    result = []
+    for session, points in sessions.items():
+        if points:
+            ordered = sorted(points.values(), key=lambda item: item[0])
+            result.append((ordered[0][0], {"session_id": session, "points": [point for _, point in ordered]}))
+    result.sort(key=lambda item: item[0])
+    return [session for _, session in result]
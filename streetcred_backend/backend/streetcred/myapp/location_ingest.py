@@ -0,0 +1,222 @@
+"""
+Buffered ingestion of device location pings into user_locations
+
+Pings are held in memory and written with one bulk_create when the buffer
+fills up or the oldest pending ping reaches the flush interval. Pings that
+have not moved at least LOCATION_MIN_DISTANCE_M from the last kept ping of
+the same session are dropped before they reach the buffer.
+"""
+import atexit
+import threading
+import time
+import uuid
+import pygeohash as pgh
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, close_old_connections
+from django.utils import timezone
+from .geo import geohash_to_int, haversine_m
+
+# Forget a session's last position after this long without pings
+SESSION_IDLE_SECONDS = 3600
+
+
+class LocationPingBuffer:
+    """Thread-safe write buffer for UserLocation rows"""
+
+    def __init__(self, max_size: int, flush_interval: float, min_distance_m: float):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.min_distance_m = min_distance_m
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._oldest_pending = None
+        self._last_kept = {}  # (user_id, session_id) -> (lat, lon, monotonic time)
+        self._new_sessions = {}  # user_id -> latest session started since last flush
+        self._flusher = None
+
+        self.stats = {"received": 0, "dropped": 0, "written": 0, "flushes": 0}
+
+    def add(self, user_id: str, lat: float, lon: float, accuracy: float = None, session_id: str = None) -> bool:
+        """
+        Queue a location ping
+
+        Args:
+            user_id: User's profile ID
+            lat, lon: Device coordinates
+            accuracy: Reported accuracy in meters
+            session_id: Tracking session the ping belongs to
+
+        Returns:
+            bool: False if the ping was dropped because the device has not moved
+
+        Raises:
+            ValueError: user_id is not a UUID (it would fail the whole flush)
+        """
+        from .models import UserLocation
+
+        user_id = str(uuid.UUID(str(user_id)))
+        key = (user_id, session_id)
+        now = time.monotonic()
+
+        with self._lock:
+            self.stats["received"] += 1
+            last = self._last_kept.get(key)
+            if last and haversine_m(last[0], last[1], lat, lon) < self.min_distance_m:
+                self.stats["dropped"] += 1
+                self._last_kept[key] = (last[0], last[1], now)
+                return False
+            if last is None:
+                self._new_sessions[key[0]] = session_id
+
+            self._last_kept[key] = (lat, lon, now)
+            geohash = pgh.encode(lat, lon, precision=9)
+            self._pending.append(UserLocation(
+                user_id=user_id,
+                lat=lat,
+                lon=lon,
+                geohash=geohash,
+                geokey=geohash_to_int(geohash),
+                accuracy=accuracy,
+                session_id=session_id,
+                created_at=timezone.now(),
+            ))
+            if self._oldest_pending is None:
+                self._oldest_pending = now
+            should_flush = len(self._pending) >= self.max_size
+
+        self._ensure_flusher()
+        if should_flush:
+            self.flush()
+        return True
+
+    def flush(self) -> int:
+        """
+        Write all pending pings with a single bulk insert
+
+        Returns:
+            int: Number of rows written
+        """
+        from .models import UserLocation
+
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                new_sessions, self._new_sessions = self._new_sessions, {}
+                self._oldest_pending = None
+                self._evict_idle_sessions()
+
+            if not rows:
+                return 0
+
+            try:
+                UserLocation.objects.bulk_create(rows, batch_size=500)
+            except Exception as e:
+                print(f"ERROR: Bulk insert of {len(rows)} pings failed, inserting them one by one: {e}")
+                rows = self._insert_each(rows, new_sessions)
+
+            # A new session supersedes whatever the user was tracking before
+            for user_id, session_id in new_sessions.items():
+                UserLocation.objects.filter(user_id=user_id, is_active=True)\
+                    .exclude(session_id=session_id)\
+                    .update(is_active=False)
+
+            with self._lock:
+                self.stats["written"] += len(rows)
+                self.stats["flushes"] += 1
+            return len(rows)
+
+    def _insert_each(self, rows: list, new_sessions: dict) -> list:
+        """
+        Insert rows one at a time after a failed bulk insert
+
+        Rows the database rejects are dropped. Any other error (e.g. the
+        database is unavailable) puts the unwritten rows back in the buffer
+        for the next flush and is re-raised.
+
+        Returns:
+            list: The rows written
+        """
+        written = []
+        for i, row in enumerate(rows):
+            row.pk = None  # bulk_create may have assigned ids before rolling back
+            try:
+                row.save(force_insert=True)
+            except (ValidationError, ValueError, TypeError, DataError, IntegrityError) as e:
+                print(f"ERROR: Dropping location ping for user {row.user_id!r}: {e}")
+                with self._lock:
+                    self.stats["dropped"] += 1
+                continue
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = rows[i:]
+                    self._new_sessions = {**new_sessions, **self._new_sessions}
+                    if self._oldest_pending is None:
+                        self._oldest_pending = time.monotonic()
+                raise
+            written.append(row)
+        return written
+
+    def end_session(self, user_id: str, session_id: str = None) -> int:
+        """
+        Flush pending pings and mark a session's rows inactive
+
+        Returns:
+            int: Number of rows deactivated
+        """
+        from .models import UserLocation
+
+        self.flush()
+        with self._lock:
+            self._last_kept.pop((str(user_id), session_id), None)
+        return UserLocation.objects.filter(user_id=user_id, session_id=session_id, is_active=True)\
+            .update(is_active=False)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _evict_idle_sessions(self):
+        cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+        for key in [k for k, (_, _, seen) in self._last_kept.items() if seen < cutoff]:
+            del self._last_kept[key]
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="location-flusher", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval / 2)
+            with self._lock:
+                due = self._oldest_pending is not None and \
+                    time.monotonic() - self._oldest_pending >= self.flush_interval
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"ERROR: Location flush failed: {e}")
+                finally:
+                    close_old_connections()
+
+
+_buffer = None
+
+
+def get_location_buffer() -> LocationPingBuffer:
+    """Get or create the process-wide ping buffer"""
+    global _buffer
+    if _buffer is None:
+        _buffer = LocationPingBuffer(
+            max_size=settings.LOCATION_BUFFER_SIZE,
+            flush_interval=settings.LOCATION_FLUSH_INTERVAL,
+            min_distance_m=settings.LOCATION_MIN_DISTANCE_M,
+        )
+    return _buffer
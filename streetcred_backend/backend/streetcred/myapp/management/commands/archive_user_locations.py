@@ -0,0 +1,35 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from myapp.location_archive import run_retention
+
+
+class Command(BaseCommand):
+    help = "Move user_locations older than LOCATION_RETENTION_DAYS into simplified, compressed per-day archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Keep running, checking for days to archive every this many seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            try:
+                results = run_retention(log=self.stdout.write)
+            except Exception as e:
+                if options["interval"] is None:
+                    raise CommandError(f"Location archiving failed: {e}")
+                print(f"ERROR: Location archiving failed: {e}")
+            else:
+                rows = sum(r["rows"] for r in results)
+                points = sum(r["points"] for r in results)
+                self.stdout.write(f"Archived {len(results)} days ({rows} rows -> {points} points) to "
+                                  f"{settings.LOCATION_ARCHIVE_DIR} in {time.monotonic() - started:.1f}s")
+            if options["interval"] is None:
+                break
+            try:
+                time.sleep(max(0.0, options["interval"] - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                break
+
+        self.stdout.write(self.style.SUCCESS("Done"))
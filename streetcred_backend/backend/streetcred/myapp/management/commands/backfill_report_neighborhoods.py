@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from myapp.auth import get_supabase_client
+from myapp.geohash_codec import encode_batch
+from myapp.models import Report
+from myapp.report_rollups import rebuild_rollups, resolve_neighborhoods, tag_reports
+
+
+class Command(BaseCommand):
+    help = "Tag existing reports with their neighborhood and geohash (local resolver) and rebuild the rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Reports read and written per request")
+        parser.add_argument("--retag", action="store_true", help="Re-resolve reports that are already tagged")
+        parser.add_argument("--skip-rollups", action="store_true", help="Don't rebuild the neighborhood rollups")
+
+    def handle(self, *args, **options):
+        self.tagged = 0
+        rows = self._backfill_supabase(options)
+        if options["skip_rollups"]:
+            for _ in rows:
+                pass
+        else:
+            total = rebuild_rollups(rows)
+            self.stdout.write(f"Rebuilt rollups from {total} reports")
+        self.stdout.write(f"Tagged {self.tagged} Supabase reports")
+
+        local = self._backfill_local(options)
+        self.stdout.write(f"Tagged {local} local reports")
+        self.stdout.write(self.style.SUCCESS("Backfill complete"))
+
+    def _backfill_supabase(self, options):
+        """Page through reports by id, tagging untagged rows with one upsert per page; yields every row"""
+        supabase = get_supabase_client()
+        last_id = 0
+        while True:
+            rows = supabase.table("reports").select("*")\
+                .gt("id", last_id)\
+                .order("id")\
+                .limit(options["batch_size"])\
+                .execute().data or []
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            pending = rows if options["retag"] else [r for r in rows if not r.get("neighborhood") or not r.get("geohash")]
+            if pending:
+                tag_reports(pending)
+                supabase.table("reports").upsert(pending, on_conflict="id").execute()
+                self.tagged += len(pending)
+                self.stdout.write(f"  ...through report {last_id}")
+            yield from rows
+
+    def _backfill_local(self, options) -> int:
+        reports = Report.objects.all() if options["retag"] else Report.objects.filter(neighborhood__isnull=True)
+        ids = list(reports.order_by("id").values_list("id", flat=True))  # don't update rows under an open cursor
+        size = options["batch_size"]
+        for start in range(0, len(ids), size):
+            self._update_local(list(Report.objects.filter(id__in=ids[start:start + size]).only("id", "lat", "lon")))
+        return len(ids)
+
+    def _update_local(self, reports: list):
+        lats = [r.lat for r in reports]
+        lons = [r.lon for r in reports]
+        for report, name, geohash in zip(reports, resolve_neighborhoods(lats, lons), encode_batch(lats, lons, 9)):
+            report.neighborhood = name
+            report.geohash = geohash
+        Report.objects.bulk_update(reports, ["neighborhood", "geohash"])
@@ -0,0 +1,67 @@
+import gc
+import random
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from myapp.columnar import PointColumns
+from myapp.geohash_codec import encode_batch
+
+# Rough NYC bounding box
+NYC_BOUNDS = (40.4774, -74.2591, 40.9176, -73.7004)
+
+
+def _measure(build):
+    """Run build() and return (result, bytes still allocated by it, seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+class Command(BaseCommand):
+    help = "Compare the memory used by map points as row dicts and as a PointColumns store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points", type=int, default=1000000, help="Number of points")
+        parser.add_argument("--named", type=float, default=0.0, help="Fraction of points that have a name")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        count = options["points"]
+        rng = random.Random(options["seed"])
+        south, west, north, east = NYC_BOUNDS
+        lats = [rng.uniform(south, north) for _ in range(count)]
+        lons = [rng.uniform(west, east) for _ in range(count)]
+        names = [f"Hydrant {i}" if rng.random() < options["named"] else None for i in range(count)]
+        geohashes = encode_batch(lats, lons, 9)
+        self.stdout.write(f"{count} points, {options['named']:.0%} named")
+
+        def build_dicts():
+            # The shape map_view used to build per point
+            return [
+                {"id": i + 1, "lat": lats[i], "lon": lons[i], "name": names[i],
+                 "geohash": geohashes[i], "type": "hydrant"}
+                for i in range(count)
+            ]
+
+        def build_columns():
+            return PointColumns.from_rows(zip(range(1, count + 1), lats, lons, names), "hydrant")
+
+        # The dicts keep references to the shared inputs (floats, names, geohash
+        # strings) that a real load would allocate per row, so add those back
+        dicts, dict_bytes, dict_seconds = _measure(build_dicts)
+        dict_bytes += count * (2 * 24 + 28) + sum(len(g) + 49 for g in geohashes)
+        dict_bytes += sum(len(n) + 49 for n in names if n)
+        del dicts
+        columns, column_bytes, column_seconds = _measure(build_columns)
+
+        self.stdout.write(f"  dicts:   {dict_bytes / 2**20:8.1f} MiB  {dict_bytes / count:6.1f} B/point  "
+                          f"built in {dict_seconds:.2f}s")
+        self.stdout.write(f"  columns: {column_bytes / 2**20:8.1f} MiB  {column_bytes / count:6.1f} B/point  "
+                          f"built in {column_seconds:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Columnar store is {dict_bytes / max(column_bytes, 1):.1f}x smaller "
+                                             f"({columns.nbytes() / 2**20:.1f} MiB in arrays/names)"))
@@ -0,0 +1,100 @@
+import asyncio
+import random
+import threading
+import time
+import tracemalloc
+import pygeohash as pgh
+from django.core.management.base import BaseCommand
+from myapp.report_feed import ReportBroker
+
+# Rough NYC bounding box
+NYC_BOUNDS = (40.4774, -74.2591, 40.9176, -73.7004)
+
+
+def _random_point():
+    south, west, north, east = NYC_BOUNDS
+    return random.uniform(south, north), random.uniform(west, east)
+
+
+class Command(BaseCommand):
+    help = "Benchmark live report fan-out: subscribers per process, publish cost and delivery latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, default=10000)
+        parser.add_argument("--publishes", type=int, default=2000)
+        parser.add_argument("--rate", type=float, default=500, help="Reports published per second")
+        parser.add_argument("--precision", type=int, default=5, help="Geohash precision subscribers watch")
+        parser.add_argument("--slow-fraction", type=float, default=0.05, help="Share of consumers that stall")
+        parser.add_argument("--queue-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options))
+
+    async def _run(self, options):
+        broker = ReportBroker(max_queue=options["queue_size"], max_dropped=options["queue_size"] * 5)
+        latencies = []
+        received = [0]
+
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        subscriptions = []
+        for _ in range(options["subscribers"]):
+            lat, lon = _random_point()
+            subscriptions.append(broker.subscribe(pgh.encode(lat, lon, precision=options["precision"])))
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        async def consume(subscription, slow):
+            async for event in subscription.events(keepalive=60):
+                if b"event: report" in event:
+                    sent_at = float(event.split(b'"sent_at": ')[1].split(b",")[0].rstrip(b"}"))
+                    latencies.append(time.perf_counter() - sent_at)
+                    received[0] += 1
+                if slow:
+                    await asyncio.sleep(0.5)
+
+        tasks = [
+            asyncio.create_task(consume(s, random.random() < options["slow_fraction"]))
+            for s in subscriptions
+        ]
+
+        publish_times = []
+        matched = [0]
+
+        def publisher():
+            interval = 1.0 / options["rate"]
+            for i in range(options["publishes"]):
+                lat, lon = _random_point()
+                started = time.perf_counter()
+                matched[0] += broker.publish({"id": i, "lat": lat, "lon": lon, "sent_at": started})
+                publish_times.append(time.perf_counter() - started)
+                time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+        started = time.perf_counter()
+        thread = threading.Thread(target=publisher)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)  # let consumers drain
+        elapsed = time.perf_counter() - started
+
+        dropped = sum(s.dropped for s in subscriptions)
+        overflowed = sum(1 for s in subscriptions if s.closed)
+        for s in subscriptions:
+            if not s.closed:
+                s.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        def pct(values, p):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+        self.stdout.write(f"Subscribers:        {options['subscribers']} (precision {options['precision']})")
+        self.stdout.write(f"Memory/subscriber:  {(after - before) / max(options['subscribers'], 1):.0f} bytes")
+        self.stdout.write(f"Published:          {options['publishes']} in {elapsed:.2f}s")
+        self.stdout.write(f"Fan-out:            {matched[0]} queued, {received[0]} delivered, {dropped} dropped")
+        self.stdout.write(f"Overflow closes:    {overflowed}")
+        self.stdout.write(f"Publish cost:       p50 {pct(publish_times, 0.5):.3f}ms  p99 {pct(publish_times, 0.99):.3f}ms")
+        self.stdout.write(f"Delivery latency:   p50 {pct(latencies, 0.5):.2f}ms  p99 {pct(latencies, 0.99):.2f}ms")
@@ -0,0 +1,181 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.geo import bbox_key_ranges, geokey
+
+# Rough NYC bounding box
+NYC_BOUNDS = (40.4774, -74.2591, 40.9176, -73.7004)
+
+SCHEMA = """
+CREATE TABLE user_locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    geokey INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX user_locations_geokey ON user_locations (geokey);
+CREATE INDEX user_locations_user_created ON user_locations (user_id, created_at DESC);
+"""
+
+
+def _random_point():
+    south, west, north, east = NYC_BOUNDS
+    return random.uniform(south, north), random.uniform(west, east)
+
+
+class Profile:
+    """How a worker thread gets its connection: the stock settings or the performance profile"""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.performance = name == "performance"
+
+    def _connect(self, read_only: bool):
+        if not self.performance:
+            # Django's defaults: rollback journal, 5s busy timeout, deferred transactions
+            return sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        uri = Path(self.path).as_uri() + ("?mode=ro" if read_only else "")
+        conn = sqlite3.connect(uri, uri=True, timeout=5, isolation_level=None, check_same_thread=False)
+        pragmas = settings.SQLITE_READ_PRAGMAS + "PRAGMA query_only=ON;" if read_only else settings.SQLITE_WRITE_PRAGMAS
+        for pragma in pragmas.split(";"):
+            if pragma.strip():
+                conn.execute(pragma)
+        return conn
+
+    def connection(self, local: threading.local, read_only: bool):
+        """Persistent per-thread connection under the performance profile, a new one per request otherwise"""
+        if not self.performance:
+            return self._connect(read_only)
+        if getattr(local, "conn", None) is None:
+            local.conn = self._connect(read_only)
+        return local.conn
+
+    def release(self, conn):
+        if not self.performance:
+            conn.close()
+
+
+class Command(BaseCommand):
+    help = "Benchmark mixed read/write SQLite throughput with and without the performance profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8, help="Concurrent reading threads")
+        parser.add_argument("--writers", type=int, default=2, help="Concurrent writing threads")
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per profile")
+        parser.add_argument("--rows", type=int, default=100000, help="Rows seeded before the run")
+        parser.add_argument("--radius", type=float, default=500, help="Read query radius in meters")
+        parser.add_argument("--profile", choices=["default", "performance", "both"], default="both")
+
+    def handle(self, *args, **options):
+        profiles = ["default", "performance"] if options["profile"] == "both" else [options["profile"]]
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in profiles:
+                path = os.path.join(tmp, f"{name}.sqlite3")
+                self._seed(path, options["rows"])
+                self._report(name, self._run(Profile(name, path), options))
+
+    def _seed(self, path: str, rows: int):
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        batch = []
+        for i in range(rows):
+            lat, lon = _random_point()
+            batch.append((f"user-{i % 1000}", lat, lon, geokey(lat, lon), "2025-01-01T00:00:00"))
+        conn.executemany(
+            "INSERT INTO user_locations (user_id, lat, lon, geokey, created_at) VALUES (?, ?, ?, ?, ?)", batch
+        )
+        conn.commit()
+        conn.close()
+
+    def _run(self, profile: Profile, options) -> dict:
+        stop = time.perf_counter() + options["duration"]
+        results = {"read": [], "write": [], "errors": 0}
+        lock = threading.Lock()
+
+        def reader():
+            local = threading.local()
+            latencies = []
+            errors = 0
+            while time.perf_counter() < stop:
+                lat, lon = _random_point()
+                d = options["radius"] / 111000
+                ranges = bbox_key_ranges(lat - d, lon - d, lat + d, lon + d)
+                where = " OR ".join("(geokey >= ? AND geokey < ?)" for _ in ranges)
+                params = [v for r in ranges for v in r]
+                started = time.perf_counter()
+                conn = None
+                try:
+                    conn = profile.connection(local, read_only=True)
+                    conn.execute(f"SELECT id, lat, lon FROM user_locations WHERE {where}", params).fetchall()
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    errors += 1
+                finally:
+                    if conn is not None:
+                        profile.release(conn)
+            with lock:
+                results["read"].extend(latencies)
+                results["errors"] += errors
+
+        def writer():
+            local = threading.local()
+            latencies = []
+            errors = 0
+            while time.perf_counter() < stop:
+                lat, lon = _random_point()
+                started = time.perf_counter()
+                conn = None
+                try:
+                    conn = profile.connection(local, read_only=False)
+                    conn.execute("BEGIN IMMEDIATE" if profile.performance else "BEGIN")
+                    conn.execute(
+                        "INSERT INTO user_locations (user_id, lat, lon, geokey, created_at) VALUES (?, ?, ?, ?, ?)",
+                        ("user-bench", lat, lon, geokey(lat, lon), time.strftime("%Y-%m-%dT%H:%M:%S")),
+                    )
+                    conn.execute("COMMIT")
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    errors += 1
+                    if conn is not None and conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                finally:
+                    if conn is not None:
+                        profile.release(conn)
+            with lock:
+                results["write"].extend(latencies)
+                results["errors"] += errors
+
+        threads = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        threads += [threading.Thread(target=writer) for _ in range(options["writers"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results["duration"] = options["duration"]
+        return results
+
+    def _report(self, name: str, results: dict):
+        def pct(values, p):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+        duration = results["duration"]
+        self.stdout.write(f"Profile: {name}")
+        for kind in ("read", "write"):
+            values = results[kind]
+            self.stdout.write(
+                f"  {kind + 's':7} {len(values) / duration:8.0f}/s   "
+                f"p50 {pct(values, 0.5):7.2f}ms   p99 {pct(values, 0.99):7.2f}ms"
+            )
+        self.stdout.write(f"  errors  {results['errors']} (database is locked)")
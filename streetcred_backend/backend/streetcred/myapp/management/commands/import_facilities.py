@@ -0,0 +1,215 @@
+import csv
+import json
+import math
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from myapp.geo import REGION_PRECISION, geohash_to_int
+from myapp.geohash_codec import encode_batch
+from myapp.models import Location
+from myapp.response_cache import invalidate
+from myapp.tiles import invalidate_regions
+
+
+def _iter_csv(path, lat_field, lon_field, name_field):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield row.get(name_field), row.get(lat_field), row.get(lon_field)
+
+
+def _feature_row(feature, name_field):
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") != "Point":
+        return None, None, None
+    lon, lat = geometry["coordinates"][:2]
+    return (feature.get("properties") or {}).get(name_field), lat, lon
+
+
+class _JSONScanner:
+    """Decodes a JSON document one value at a time from a file, reading it in chunks"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self):
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or "" at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._read()
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def skip(self, char: str) -> bool:
+        """Consume char if it comes next"""
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        """Decode the next value, reading more of the file until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut off by the end of the buffer still decodes, so wait for what follows it
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+
+def _iter_geojson(path, name_field, chunk_size=1 << 16):
+    """FeatureCollection, streamed: only the current feature is decoded and held in memory"""
+    with open(path, encoding="utf-8") as f:
+        scanner = _JSONScanner(f, chunk_size)
+        scanner.expect("{")
+        while not scanner.skip("}"):
+            key = scanner.value()
+            scanner.expect(":")
+            if key == "features":
+                scanner.expect("[")
+                while not scanner.skip("]"):
+                    yield _feature_row(scanner.value(), name_field)
+                    scanner.skip(",")
+            else:
+                scanner.value()  # type, crs, bbox, ...
+            scanner.skip(",")
+
+
+def _iter_geojsonl(path, name_field):
+    """Newline-delimited GeoJSON: one Feature per line, streamed"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield _feature_row(json.loads(line), name_field)
+
+
+class Command(BaseCommand):
+    help = ("Bulk import facilities (hydrants etc.) from CSV or GeoJSON into the locations table. "
+            "Every format is streamed, so files larger than memory can be imported; a GeoJSON "
+            "FeatureCollection is decoded one feature at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "geojson", "geojsonl"], default=None,
+                            help="Input format (default: from the file extension)")
+        parser.add_argument("--lat-field", default="lat", help="CSV latitude column")
+        parser.add_argument("--lon-field", default="lon", help="CSV longitude column")
+        parser.add_argument("--name-field", default="name", help="CSV column / GeoJSON property for the name")
+        parser.add_argument("--default-name", default="Fire Hydrant", help="Name for rows without one")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Rows geohashed and inserted at a time")
+        parser.add_argument("--transaction-size", type=int, default=50000, help="Rows per committed transaction")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        fmt = options["format"]
+        if fmt is None:
+            ext = os.path.splitext(path)[1].lower()
+            fmt = {".csv": "csv", ".geojson": "geojson", ".json": "geojson",
+                   ".geojsonl": "geojsonl", ".ndjson": "geojsonl"}.get(ext)
+            if fmt is None:
+                raise CommandError("Could not tell the format from the extension; pass --format")
+
+        if fmt == "csv":
+            rows = _iter_csv(path, options["lat_field"], options["lon_field"], options["name_field"])
+        elif fmt == "geojson":
+            rows = _iter_geojson(path, options["name_field"])
+        else:
+            rows = _iter_geojsonl(path, options["name_field"])
+
+        chunk_size = max(options["chunk_size"], 1)
+        per_transaction = max(options["transaction_size"] // chunk_size, 1)
+        default_name = options["default_name"]
+
+        started = time.perf_counter()
+        imported = skipped = 0
+        regions = set()
+        chunks = self._chunks(rows, chunk_size, default_name)
+
+        while True:
+            # Several chunks per transaction: one commit per --transaction-size rows
+            with transaction.atomic():
+                done = True
+                for names, lats, lons, invalid in _take(chunks, per_transaction):
+                    done = False
+                    skipped += invalid
+                    if not lats:
+                        continue
+                    geohashes = encode_batch(lats, lons, precision=9)
+                    # bulk_create skips Location.save(), so geohash/geokey and tile invalidation happen here
+                    Location.objects.bulk_create(
+                        [Location(name=n, lat=la, lon=lo, geohash=g, geokey=geohash_to_int(g))
+                         for n, la, lo, g in zip(names, lats, lons, geohashes)],
+                        batch_size=chunk_size,
+                    )
+                    regions.update(g[:i] for g in geohashes for i in range(REGION_PRECISION + 1))
+                    imported += len(lats)
+            if done:
+                break
+            self.stdout.write(f"{imported} imported, {skipped} skipped ({time.perf_counter() - started:.1f}s)")
+
+        if regions:
+            invalidate_regions(regions)
+            invalidate("locations")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} facilities in {elapsed:.1f}s "
+            f"({imported / max(elapsed, 1e-9):.0f} rows/s), skipped {skipped} invalid rows"
+        ))
+
+    @staticmethod
+    def _chunks(rows, chunk_size, default_name):
+        """Group rows into column lists, dropping rows without usable coordinates"""
+        names, lats, lons, invalid = [], [], [], 0
+        for name, lat, lon in rows:
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                invalid += 1
+                continue
+            if not (math.isfinite(lat) and math.isfinite(lon)) or abs(lat) > 90 or abs(lon) > 180:
+                invalid += 1
+                continue
+            names.append((name or "").strip()[:255] or default_name)
+            lats.append(lat)
+            lons.append(lon)
+            if len(lats) >= chunk_size:
+                yield names, lats, lons, invalid
+                names, lats, lons, invalid = [], [], [], 0
+        if lats or invalid:
+            yield names, lats, lons, invalid
+
+
+def _take(iterator, count):
+    for _ in range(count):
+        try:
+            yield next(iterator)
+        except StopIteration:
+            return
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from myapp.tiles import EXTERNAL_LAYERS, MAX_ZOOM, invalidate_layer, parse_layers, pregenerate_zoom
+
+
+class Command(BaseCommand):
+    help = "Render and cache map vector tiles for a range of zoom levels"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-zoom", type=int, default=10)
+        parser.add_argument("--max-zoom", type=int, default=16)
+        parser.add_argument("--layers", default=None, help="Comma-separated layers (default: all)")
+        parser.add_argument(
+            "--bbox",
+            default=None,
+            help="Restrict to south,west,north,east (e.g. 40.4774,-74.2591,40.9176,-73.7004)"
+        )
+        parser.add_argument(
+            "--invalidate",
+            action="store_true",
+            help="First mark the hydrants layer as changed, e.g. after moving a hydrant in Supabase"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            layers = parse_layers(options["layers"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        bounds = None
+        if options["bbox"]:
+            try:
+                bounds = tuple(float(v) for v in options["bbox"].split(","))
+            except ValueError:
+                raise CommandError("--bbox must be four comma-separated numbers")
+            if len(bounds) != 4:
+                raise CommandError("--bbox must be four comma-separated numbers")
+
+        if not 0 <= options["min_zoom"] <= options["max_zoom"] <= MAX_ZOOM:
+            raise CommandError(f"Zoom range must be within 0-{MAX_ZOOM}")
+
+        if options["invalidate"]:
+            for name in layers:
+                if name in EXTERNAL_LAYERS:
+                    invalidate_layer(name)
+
+        for z in range(options["min_zoom"], options["max_zoom"] + 1):
+            count = pregenerate_zoom(z, layers, bounds)
+            self.stdout.write(f"z{z}: wrote {count} tiles")
+
+        self.stdout.write(self.style.SUCCESS("Done"))
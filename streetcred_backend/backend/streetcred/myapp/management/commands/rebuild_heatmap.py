@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from myapp.heatmap import rebuild_pyramid
+
+
+class Command(BaseCommand):
+    help = "Rebuild the report density heatmap from the reports table and save the shared snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Keep running, rebuilding every this many seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            try:
+                pyramid = rebuild_pyramid()
+            except Exception as e:
+                if options["interval"] is None:
+                    raise CommandError(f"Heatmap rebuild failed: {e}")
+                print(f"ERROR: Heatmap rebuild failed: {e}")
+            else:
+                cells = ", ".join(f"p{p}: {n}" for p, n in pyramid.cell_count().items())
+                self.stdout.write(f"Cells per precision: {cells}")
+                self.stdout.write(self.style.SUCCESS(f"Heatmap rebuilt ({pyramid.nbytes() / 1024:.0f} KB, "
+                                                     f"up to report {pyramid.last_report_id})"))
+            if options["interval"] is None:
+                break
+            try:
+                time.sleep(max(0.0, options["interval"] - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                break
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from myapp.auth import iter_table_rows
+from myapp.report_search import clear_index, index_reports, optimize_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the report full-text search index from the Supabase reports table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Reports indexed per transaction")
+        parser.add_argument("--keep", action="store_true", help="Add to the existing index instead of clearing it")
+
+    def handle(self, *args, **options):
+        if not options["keep"]:
+            clear_index()
+
+        total = 0
+        batch = []
+        columns = "id,user_id,lat,lon,description,image_url,created_at"
+        for report in iter_table_rows("reports", columns=columns):
+            batch.append(report)
+            if len(batch) >= options["batch_size"]:
+                total += index_reports(batch)
+                batch = []
+                self.stdout.write(f"Indexed {total} reports")
+        if batch:
+            total += index_reports(batch)
+
+        optimize_index()
+        self.stdout.write(self.style.SUCCESS(f"Report search index rebuilt ({total} reports)"))
@@ -0,0 +1,40 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from myapp.point_snapshot import refresh_snapshot
+from myapp.tiles import parse_layers
+
+
+class Command(BaseCommand):
+    help = "Write a new memory-mapped point snapshot (hydrants, locations, reports) for the server workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layers", default=None, help="Comma-separated layers (default: all)")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Keep running, writing a new version every this many seconds")
+
+    def handle(self, *args, **options):
+        try:
+            layers = parse_layers(options["layers"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        while True:
+            started = time.monotonic()
+            try:
+                version = refresh_snapshot(layers)
+            except Exception as e:
+                if options["interval"] is None:
+                    raise CommandError(f"Snapshot refresh failed: {e}")
+                print(f"ERROR: Snapshot refresh failed: {e}")
+            else:
+                self.stdout.write(f"Wrote snapshot version {version} of {', '.join(layers)} to "
+                                  f"{settings.POINT_SNAPSHOT_PATH} in {time.monotonic() - started:.1f}s")
+            if options["interval"] is None:
+                break
+            try:
+                time.sleep(max(0.0, options["interval"] - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                break
+
+        self.stdout.write(self.style.SUCCESS("Done"))
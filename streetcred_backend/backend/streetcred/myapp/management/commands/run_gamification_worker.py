@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from myapp.gamification_queue import run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued points and badge awards for accepted reports (run as many workers as needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Tasks claimed per round")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Gamification worker started")
+        try:
+            run_worker(
+                batch_size=options["batch_size"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+                log=self.stdout.write,
+            )
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Gamification worker stopped"))
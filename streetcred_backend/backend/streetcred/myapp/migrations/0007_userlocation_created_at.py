@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_tileregion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userlocation',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
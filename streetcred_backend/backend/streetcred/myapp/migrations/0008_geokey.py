@@ -0,0 +1,51 @@
+from django.db import migrations, models
+import pygeohash as pgh
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def _geokey(lat, lon):
+    value = 0
+    for c in pgh.encode(lat, lon, precision=9):
+        value = (value << 5) | GEOHASH_BASE32.index(c)
+    return value
+
+
+def backfill_geokeys(apps, schema_editor):
+    for model_name in ("Location", "Report", "UserLocation"):
+        model = apps.get_model("myapp", model_name)
+        batch = []
+        for obj in model.objects.filter(geokey__isnull=True).only("id", "lat", "lon").iterator(chunk_size=2000):
+            obj.geokey = _geokey(obj.lat, obj.lon)
+            batch.append(obj)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ["geokey"])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ["geokey"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_userlocation_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geokey',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='geokey',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='geokey',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_geokeys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+CREATE = [
+    """
+    CREATE TABLE IF NOT EXISTS report_search_docs (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        geokey INTEGER NOT NULL,
+        created_ts REAL NOT NULL,
+        created_at TEXT NOT NULL,
+        image_url TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS report_search_docs_geokey ON report_search_docs (geokey)",
+    "CREATE INDEX IF NOT EXISTS report_search_docs_created ON report_search_docs (created_ts)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS report_search USING fts5(description, tokenize='porter unicode61 remove_diacritics 2')",
+]
+
+DROP = [
+    "DROP TABLE IF EXISTS report_search",
+    "DROP TABLE IF EXISTS report_search_docs",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return  # FTS5 is SQLite only
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_gamificationtask'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE), _run(DROP)),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_report_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='neighborhood',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReportRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('neighborhood', models.CharField(max_length=100)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'report_rollups',
+                'indexes': [models.Index(fields=['granularity', 'bucket_start'], name='report_roll_granula_16de7e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'neighborhood', 'bucket_start'), name='report_rollups_bucket')],
+            },
+        ),
+    ]
@@ -1,17 +1,76 @@
 from django.db import models
+from django.utils import timezone
 import pygeohash as pgh
+from .geo import GEOKEY_PRECISION, bbox_key_ranges, geohash_to_int, haversine_m, radius_bbox
 
 # Create your models here.
 
+
+class GeoQuerySet(models.QuerySet):
+    """QuerySet for models with lat/lon and an indexed geokey (integer Z-order key)"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create skips save(), so fill in any missing geohash/geokey here
+        objs = list(objs)
+        field_names = {f.name for f in self.model._meta.fields}
+        has_geohash = "geohash" in field_names
+        for obj in objs:
+            if obj.geokey is None and obj.lat is not None and obj.lon is not None:
+                geohash = pgh.encode(obj.lat, obj.lon, precision=GEOKEY_PRECISION)
+                if has_geohash and not obj.geohash:
+                    obj.geohash = geohash
+                obj.geokey = geohash_to_int(geohash)
+        if "neighborhood" in field_names:
+            untagged = [obj for obj in objs if obj.neighborhood is None and obj.lat is not None and obj.lon is not None]
+            if untagged:
+                from .report_rollups import resolve_neighborhoods
+                names = resolve_neighborhoods([obj.lat for obj in untagged], [obj.lon for obj in untagged])
+                for obj, name in zip(untagged, names):
+                    obj.neighborhood = name
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def in_bbox(self, south: float, west: float, north: float, east: float):
+        """Filter to rows inside a bounding box using geokey range seeks"""
+        ranges = bbox_key_ranges(south, west, north, east)
+        if not ranges:
+            return self.none()
+        q = models.Q()
+        for low, high in ranges:
+            q |= models.Q(geokey__gte=low, geokey__lt=high)
+        return self.filter(q, lat__gte=south, lat__lte=north, lon__gte=west, lon__lte=east)
+
+    def near(self, lat: float, lon: float, radius_m: float):
+        """Filter to candidate rows within radius_m (bounding box of the circle)"""
+        return self.in_bbox(*radius_bbox(lat, lon, radius_m))
+
+    def within_radius(self, lat: float, lon: float, radius_m: float) -> list:
+        """
+        Get rows within radius_m of a point, nearest first
+
+        Returns:
+            list: (obj, distance_m) pairs
+        """
+        results = []
+        for obj in self.near(lat, lon, radius_m):
+            distance = haversine_m(lat, lon, obj.lat, obj.lon)
+            if distance <= radius_m:
+                results.append((obj, distance))
+        results.sort(key=lambda item: item[1])
+        return results
+
+
 class Location(models.Model):
     """Model for storing locations with geohash"""
     name = models.CharField(max_length=255)
     lat = models.FloatField()
     lon = models.FloatField()
     geohash = models.CharField(max_length=12, db_index=True)
+    geokey = models.BigIntegerField(null=True, blank=True, db_index=True)  # geohash packed as an integer
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = GeoQuerySet.as_manager()
+
     class Meta:
         db_table = 'locations'
         indexes = [
@@ -23,8 +82,24 @@ class Location(models.Model):
         # Auto-generate geohash on save
         if self.lat and self.lon:
             self.geohash = pgh.encode(self.lat, self.lon, precision=9)
+            self.geokey = geohash_to_int(self.geohash)
         super().save(*args, **kwargs)
 
+        from .tiles import invalidate_point
+        from .nearest import record_point
+        invalidate_point(self.lat, self.lon)
+        record_point("locations", self.id, self.lat, self.lon, self.name)
+
+    def delete(self, *args, **kwargs):
+        location_id = self.id
+        result = super().delete(*args, **kwargs)
+
+        from .tiles import invalidate_point
+        from .nearest import remove_point
+        invalidate_point(self.lat, self.lon)
+        remove_point("locations", location_id)
+        return result
+
     def __str__(self):
         return f"{self.name} ({self.geohash})"
 
@@ -36,8 +111,13 @@ class Report(models.Model):
     lon = models.FloatField()
     description = models.TextField()
     image_url = models.TextField(null=True, blank=True)  # Optional image from Supabase Storage
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True)
+    geokey = models.BigIntegerField(null=True, blank=True, db_index=True)  # precision-9 geohash as an integer
+    neighborhood = models.CharField(max_length=100, null=True, blank=True, db_index=True)  # resolved at write time
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = GeoQuerySet.as_manager()
+
     class Meta:
         db_table = 'reports'
         indexes = [
@@ -46,5 +126,121 @@ class Report(models.Model):
             models.Index(fields=['user_id', '-created_at']),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.lat is not None and self.lon is not None:
+            geohash = pgh.encode(self.lat, self.lon, precision=GEOKEY_PRECISION)
+            moved = self.geohash is not None and geohash != self.geohash  # stale neighborhood too
+            self.geohash = geohash
+            self.geokey = geohash_to_int(self.geohash)
+            if self.neighborhood is None or moved:
+                from .report_rollups import resolve_neighborhoods
+                self.neighborhood = resolve_neighborhoods([self.lat], [self.lon])[0]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Report by {self.user_id} at ({self.lat}, {self.lon}) - {self.created_at}"
+
+
+class UserLocation(models.Model):
+    """Model for device location pings from tracked users"""
+    user_id = models.UUIDField(db_index=True)  # References Supabase profiles table
+    lat = models.FloatField()
+    lon = models.FloatField()
+    geohash = models.CharField(max_length=12, db_index=True)
+    geokey = models.BigIntegerField(null=True, blank=True, db_index=True)  # geohash packed as an integer
+    accuracy = models.FloatField(null=True, blank=True)  # Reported accuracy in meters
+    session_id = models.CharField(max_length=100, null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    # Set when the ping is received, not when the buffered row is flushed
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = GeoQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'user_locations'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_id', '-created_at'], name='user_locati_user_id_03e796_idx'),
+            models.Index(fields=['geohash'], name='user_locati_geohash_98af21_idx'),
+            models.Index(fields=['user_id', 'is_active'], name='user_locati_user_id_5bfdd1_idx'),
+            models.Index(fields=['created_at'], name='user_locati_created_d3d1bf_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.lat is not None and self.lon is not None:
+            # Always re-encode: the point may have moved since the geohash was set
+            self.geohash = pgh.encode(self.lat, self.lon, precision=GEOKEY_PRECISION)
+            self.geokey = geohash_to_int(self.geohash)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.user_id} at ({self.lat}, {self.lon}) - {self.created_at}"
+
+
+class TileRegion(models.Model):
+    """Change counter for a geohash region, used to invalidate cached map tiles"""
+    prefix = models.CharField(max_length=12, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'tile_regions'
+
+    def __str__(self):
+        return f"{self.prefix or '*'} v{self.version}"
+
+
+class GamificationTask(models.Model):
+    """Queued points/badge work for accepted reports, processed by run_gamification_worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50, default='report_accepted')
+    user_id = models.CharField(max_length=255, db_index=True)  # Supabase profile id
+    payload = models.JSONField(default=dict)  # {"points", "lat", "lon", "report_ids"}
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # not claimed before this (retry backoff)
+    claim_token = models.CharField(max_length=64, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'gamification_tasks'
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+            models.Index(fields=['claim_token']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.user_id} ({self.status})"
+
+
+class ReportRollup(models.Model):
+    """Report count for one neighborhood in one hour or day, updated as reports are inserted"""
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    neighborhood = models.CharField(max_length=100)
+    bucket_start = models.DateTimeField()  # UTC start of the hour/day
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'report_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'neighborhood', 'bucket_start'], name='report_rollups_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.neighborhood} {self.granularity} {self.bucket_start}: {self.count}"
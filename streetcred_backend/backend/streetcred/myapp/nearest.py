@@ -0,0 +1,337 @@
+"""
+k-nearest-neighbour lookups over hydrants, locations and reports
+
+Each layer is indexed by a KD-tree over points on the unit sphere (x, y, z),
+so straight-line distance orders points exactly like great-circle distance
+and there are no problems at the antimeridian or near the poles. "Closest N"
+queries need no radius.
+
+A built tree is never modified. Points added since the build go to a small
+delta list that is scanned linearly, and removed points are tombstoned. The
+layer is rebuilt in a background thread when the delta grows past
+NEAREST_DELTA_MAX or the tree is older than NEAREST_REFRESH_SECONDS
+(hydrants and reports also change outside this process), and the new
+tree replaces the old one in a single assignment.
+
+When a point snapshot newer than the layer's data exists (see
+point_snapshot.py), "rebuilding" just maps the snapshot's prebuilt tree,
+shared with every other worker; otherwise the layer is loaded and built
+in this process.
+"""
+import heapq
+import math
+import threading
+import time
+from array import array
+from django.conf import settings
+from . import point_snapshot
+from .columnar import PointColumns
+from .geo import EARTH_RADIUS_M
+
+LEAF_SIZE = 16
+FACILITY_LAYERS = ("hydrants", "locations")
+
+
+def _xyz(lat: float, lon: float) -> tuple:
+    lat, lon = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def _chord2_to_m(chord2: float) -> float:
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(chord2) / 2))
+
+
+def _m_to_chord2(meters: float) -> float:
+    if meters >= math.pi * EARTH_RADIUS_M:
+        return 4.0
+    return (2 * math.sin(meters / (2 * EARTH_RADIUS_M))) ** 2
+
+
+class KDTree:
+    """
+    Static 3-d tree stored implicitly in one permutation
+
+    The node for a range [lo, hi) is the point at its median, mid = (lo + hi) // 2;
+    points before it lie on the low side of axes[mid], points after it on the
+    high side. Ranges of LEAF_SIZE points or fewer are scanned.
+    """
+
+    def __init__(self, points: list):
+        self.coords = tuple(array("d", (p[axis] for p in points)) for axis in range(3))
+        self.order = array("q", range(len(points)))
+        self.axes = bytearray(len(points))
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            indexes = self.order[lo:hi]
+            axis = max(range(3), key=lambda a: self._spread(indexes, a))
+            self.order[lo:hi] = array("q", sorted(indexes, key=self.coords[axis].__getitem__))
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    @classmethod
+    def from_arrays(cls, coords: tuple, order, axes) -> "KDTree":
+        """Wrap the arrays of an already built tree (e.g. from a mapped snapshot) without copying"""
+        tree = cls.__new__(cls)
+        tree.coords, tree.order, tree.axes = coords, order, axes
+        return tree
+
+    def _spread(self, indexes: list, axis: int) -> float:
+        values = self.coords[axis]
+        column = [values[i] for i in indexes]
+        return max(column) - min(column)
+
+    def __len__(self):
+        return len(self.order)
+
+    def query(self, q: tuple, k: int, max_chord2: float = 4.0) -> list:
+        """
+        Get the k points nearest to q within max_chord2
+
+        Returns:
+            list: (chord2, point index) pairs, nearest first
+        """
+        xs, ys, zs = self.coords
+        qx, qy, qz = q
+        best = []  # max-heap of (-chord2, index)
+
+        def consider(i):
+            d2 = (xs[i] - qx) ** 2 + (ys[i] - qy) ** 2 + (zs[i] - qz) ** 2
+            if len(best) < k:
+                if d2 <= max_chord2:
+                    heapq.heappush(best, (-d2, i))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, i))
+
+        stack = [(0, len(self.order), 0.0)]
+        while stack:
+            lo, hi, plane2 = stack.pop()
+            bound = -best[0][0] if len(best) == k else max_chord2
+            if plane2 > bound:
+                continue
+            if hi - lo <= LEAF_SIZE:
+                for i in self.order[lo:hi]:
+                    consider(i)
+                continue
+            mid = (lo + hi) // 2
+            axis = self.axes[mid]
+            point = self.order[mid]
+            consider(point)
+            diff = q[axis] - self.coords[axis][point]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            stack.append((far[0], far[1], diff * diff))
+            stack.append((near[0], near[1], 0.0))
+        return sorted((-d2, i) for d2, i in best)
+
+
+class LayerIndex:
+    """Nearest-neighbour index for one layer: a static tree plus recent changes"""
+
+    def __init__(self, name: str, loader):
+        self.name = name
+        self.loader = loader
+        self.tree = None
+        self.points = PointColumns()  # row i is tree point i
+        self.built_ids = set()  # ids in the tree
+        self.delta = {}  # id -> (xyz, item) added or moved since the build
+        self.removed = set()  # ids in the tree that no longer exist there (deleted or moved)
+        self.built_at = 0.0
+        self.data_time = 0.0  # wall-clock time the loaded points reflect
+        self.snapshot_version = None  # set while serving a mapped snapshot
+        self.stale = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.RLock()  # one load at a time
+        self._rebuilding = False
+
+    def rebuild(self):
+        """Load every point and swap in a new tree"""
+        with self._build_lock:
+            self._rebuild()
+
+    def _newer_snapshot(self):
+        layer = point_snapshot.get_layer(self.name)
+        return layer if layer is not None and layer.created_at > self.data_time else None
+
+    def _rebuild(self):
+        layer = None if self.stale else self._newer_snapshot()
+        if layer is not None:
+            points, tree, built_ids = layer.points, layer.tree, layer.ids
+            data_time, version = layer.created_at, layer.version
+        else:
+            data_time, version = time.time(), None
+            points = PointColumns.from_rows(
+                ((row_id, lat, lon, props.get("name")) for row_id, lat, lon, props in self.loader()), self.name
+            )
+            tree = KDTree([_xyz(lat, lon) for lat, lon in zip(points.lats, points.lons)])
+            built_ids = set(points.ids)
+
+        with self._lock:
+            # Keep changes the load didn't see (a moved point stays hidden and in delta)
+            self.delta = {i: entry for i, entry in self.delta.items() if i not in built_ids or i in self.removed}
+            self.removed = {i for i in self.removed if i in built_ids}
+            self.tree, self.points, self.built_ids = tree, points, built_ids
+            self.data_time, self.snapshot_version = data_time, version
+            self.built_at = time.monotonic()
+            self.stale = False
+
+    def rebuild_async(self):
+        """Rebuild in a background thread unless one is already running"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"ERROR: Could not rebuild nearest index for {self.name}: {e}")
+                with self._lock:
+                    # Keep serving the old tree; try again after the refresh interval
+                    self.built_at = time.monotonic()
+                    self.stale = False
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+
+        threading.Thread(target=run, name=f"nearest-{self.name}", daemon=True).start()
+
+    def _refresh_if_needed(self):
+        too_old = time.monotonic() - self.built_at > settings.NEAREST_REFRESH_SECONDS
+        if self.stale or too_old or len(self.delta) > settings.NEAREST_DELTA_MAX or self._newer_snapshot():
+            self.rebuild_async()
+
+    def add(self, row_id, lat: float, lon: float, name: str = None):
+        with self._lock:
+            if row_id in self.built_ids:
+                self.removed.add(row_id)  # moved: hide the tree's copy at the old position
+            self.delta[row_id] = (_xyz(lat, lon), {"id": row_id, "lat": lat, "lon": lon, "name": name})
+        self._refresh_if_needed()
+
+    def remove(self, row_id):
+        with self._lock:
+            self.delta.pop(row_id, None)
+            self.removed.add(row_id)
+
+    def query(self, lat: float, lon: float, k: int, max_distance_m: float = None) -> list:
+        """
+        Get the k nearest points
+
+        Returns:
+            list: (item, distance_m) pairs, nearest first
+        """
+        q = _xyz(lat, lon)
+        max_chord2 = _m_to_chord2(max_distance_m) if max_distance_m is not None else 4.0
+        with self._lock:
+            tree, points, removed = self.tree, self.points, set(self.removed)
+            delta = list(self.delta.values())
+
+        candidates = []
+        if tree is not None and len(tree):
+            for d2, i in tree.query(q, k + len(removed), max_chord2):
+                if points.ids[i] not in removed:
+                    row = points[i]
+                    candidates.append((d2, {"id": row.id, "lat": row.lat, "lon": row.lon, "name": row.name}))
+        for (x, y, z), item in delta:
+            d2 = (x - q[0]) ** 2 + (y - q[1]) ** 2 + (z - q[2]) ** 2
+            if d2 <= max_chord2:
+                candidates.append((d2, item))
+
+        candidates.sort(key=lambda c: c[0])
+        self._refresh_if_needed()
+        return [(item, _chord2_to_m(d2)) for d2, item in candidates[:k]]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_layer_index(layer: str, wait: bool = True):
+    """
+    Get a layer's index, building it on first use
+
+    Args:
+        wait: Build synchronously if needed; with False, start a background
+            build and return None until it is ready
+    """
+    from .tiles import LAYER_LOADERS
+
+    with _indexes_lock:
+        index = _indexes.get(layer)
+        if index is None:
+            index = _indexes[layer] = LayerIndex(layer, LAYER_LOADERS[layer])
+    if index.tree is None:
+        if not wait:
+            index.rebuild_async()
+            return None
+        with index._build_lock:
+            if index.tree is None:  # another request may have built it meanwhile
+                index.rebuild()
+    return index
+
+
+def record_point(layer: str, row_id, lat: float, lon: float, name: str = None):
+    """Add a new point to a layer that is already loaded, never failing the caller"""
+    index = _indexes.get(layer)
+    if index is not None:
+        try:
+            index.add(row_id, float(lat), float(lon), name)
+        except Exception as e:
+            print(f"ERROR: Could not update nearest index for {layer}: {e}")
+
+
+def remove_point(layer: str, row_id):
+    index = _indexes.get(layer)
+    if index is not None:
+        index.remove(row_id)
+
+
+def mark_stale(layer: str):
+    """Rebuild a loaded layer in the background (after a bulk import)"""
+    index = _indexes.get(layer)
+    if index is not None:
+        index.stale = True
+        index.rebuild_async()
+
+
+def nearest(lat: float, lon: float, k: int, layers=FACILITY_LAYERS, max_distance_m: float = None,
+            wait: bool = True) -> list:
+    """
+    Get the k nearest points across layers
+
+    Returns:
+        list: dicts with layer, id, name, lat, lon and distance (meters), nearest first
+    """
+    results = []
+    for layer in layers:
+        index = get_layer_index(layer, wait=wait)
+        if index is None:
+            continue
+        for item, distance in index.query(lat, lon, k, max_distance_m):
+            results.append({"layer": layer, **item, "distance": round(distance, 1)})
+    results.sort(key=lambda r: r["distance"])
+    return results[:k]
+
+
+def snap_facility(lat: float, lon: float):
+    """
+    Find the facility a report at this point most likely refers to
+
+    Only layers that are already loaded are searched, so a submission
+    never waits on loading the hydrants.
+
+    Returns:
+        dict: The nearest hydrant/location within FACILITY_SNAP_METERS, or None
+            (also when its id isn't an integer, as reports.facility_id is one)
+    """
+    try:
+        matches = nearest(lat, lon, 1, FACILITY_LAYERS, settings.FACILITY_SNAP_METERS, wait=False)
+    except Exception as e:
+        print(f"ERROR: Facility snapping failed: {e}")
+        return None
+    return matches[0] if matches and isinstance(matches[0]["id"], int) else None
@@ -0,0 +1,244 @@
+"""
+Local neighborhood lookup from boundary polygons
+
+Each city's polygons are loaded from its GeoJSON file (see cities.py; the
+bundled data/nyc_neighborhoods.geojson for NYC) and indexed three ways:
+
+- STRtree: a packed Sort-Tile-Recursive R-tree over polygon bounding boxes,
+  so only polygons whose box contains the point are tested.
+- PreparedPolygon: each polygon's edges are bucketed into horizontal bands,
+  so a point-in-polygon test only crosses the edges in the point's band.
+- A raster over the polygons' extent marking cells that lie entirely
+  inside one polygon (or outside all of them). Most lookups are answered by
+  one array read; only cells crossed by a boundary fall back to the exact
+  test. lookup_many() does both steps for a whole batch with NumPy.
+"""
+import json
+import math
+from array import array
+
+NODE_CAPACITY = 8
+BANDS_PER_POLYGON = 32
+RASTER_CELL_DEGREES = 0.002  # ~200m
+
+OUTSIDE = -1
+BOUNDARY = -2
+
+
+class PreparedPolygon:
+    """A polygon (with holes, or several parts) prepared for repeated point-in-polygon tests"""
+
+    __slots__ = ("name", "properties", "bbox", "_band_height", "_bands")
+
+    def __init__(self, name: str, rings: list, properties: dict = None):
+        self.name = name
+        self.properties = properties or {}
+        xs = [x for ring in rings for x, _ in ring]
+        ys = [y for ring in rings for _, y in ring]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        min_y, max_y = self.bbox[1], self.bbox[3]
+        self._band_height = (max_y - min_y) / BANDS_PER_POLYGON or 1.0
+        self._bands = [[] for _ in range(BANDS_PER_POLYGON)]
+        for ring in rings:
+            for i in range(len(ring)):
+                x1, y1 = ring[i - 1]
+                x2, y2 = ring[i]
+                # Horizontal edges never cross a horizontal ray, but the raster still needs them
+                edge = (x1, y1, x2, y2, (x2 - x1) / (y2 - y1) if y1 != y2 else 0.0)
+                for band in range(self._band(min(y1, y2)), self._band(max(y1, y2)) + 1):
+                    self._bands[band].append(edge)
+
+    def _band(self, y: float) -> int:
+        return min(max(int((y - self.bbox[1]) / self._band_height), 0), BANDS_PER_POLYGON - 1)
+
+    def edges(self):
+        """Every edge once, as (x1, y1, x2, y2, dx/dy)"""
+        seen = set()
+        for band in self._bands:
+            for edge in band:
+                if id(edge) not in seen:
+                    seen.add(id(edge))
+                    yield edge
+
+    def contains(self, x: float, y: float) -> bool:
+        """Even-odd ray casting over the edges in the point's band (x = lon, y = lat)"""
+        min_x, min_y, max_x, max_y = self.bbox
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return False
+        inside = False
+        for x1, y1, x2, y2, slope in self._bands[self._band(y)]:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * slope:
+                inside = not inside
+        return inside
+
+
+class STRtree:
+    """Static R-tree over bounding boxes, bulk-loaded with Sort-Tile-Recursive packing"""
+
+    def __init__(self, boxes: list, capacity: int = NODE_CAPACITY):
+        self.capacity = capacity
+        # Each level is a list of (bbox, children); leaves hold item indexes
+        level = [(box, [i]) for i, box in enumerate(boxes)]
+        self.levels = [level]
+        while len(level) > 1:
+            level = self._pack(level)
+            self.levels.append(level)
+
+    def _pack(self, nodes: list) -> list:
+        leaves_per_slice = self.capacity * math.ceil(math.sqrt(math.ceil(len(nodes) / self.capacity)))
+        by_x = sorted(nodes, key=lambda n: n[0][0] + n[0][2])
+        parents = []
+        for s in range(0, len(by_x), leaves_per_slice):
+            vertical = sorted(by_x[s:s + leaves_per_slice], key=lambda n: n[0][1] + n[0][3])
+            for g in range(0, len(vertical), self.capacity):
+                group = vertical[g:g + self.capacity]
+                box = (
+                    min(n[0][0] for n in group), min(n[0][1] for n in group),
+                    max(n[0][2] for n in group), max(n[0][3] for n in group),
+                )
+                parents.append((box, group))
+        return parents
+
+    def query_point(self, x: float, y: float) -> list:
+        """Get the indexes of every box containing the point"""
+        if not self.levels[0]:
+            return []
+        results = []
+        stack = [self.levels[-1][0]] if len(self.levels) > 1 else list(self.levels[0])
+        while stack:
+            box, children = stack.pop()
+            if not (box[0] <= x <= box[2] and box[1] <= y <= box[3]):
+                continue
+            if isinstance(children[0], int):
+                results.extend(children)
+            else:
+                stack.extend(children)
+        return results
+
+
+class NeighborhoodIndex:
+    def __init__(self, polygons: list, cell_degrees: float = RASTER_CELL_DEGREES):
+        self.polygons = polygons
+        self.tree = STRtree([p.bbox for p in polygons])
+        self._build_raster(cell_degrees)
+
+    @classmethod
+    def from_geojson(cls, path: str, name_property: str = "name") -> "NeighborhoodIndex":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        polygons = []
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") == "Polygon":
+                parts = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                parts = geometry["coordinates"]
+            else:
+                continue
+            rings = [[(float(x), float(y)) for x, y, *_ in ring] for part in parts for ring in part]
+            polygons.append(PreparedPolygon(str(properties.get(name_property, "")), rings, properties))
+        return cls(polygons)
+
+    def _exact(self, lon: float, lat: float) -> int:
+        # Smallest containing polygon wins if the file has overlaps
+        best, best_area = OUTSIDE, None
+        for i in self.tree.query_point(lon, lat):
+            polygon = self.polygons[i]
+            if polygon.contains(lon, lat):
+                min_x, min_y, max_x, max_y = polygon.bbox
+                area = (max_x - min_x) * (max_y - min_y)
+                if best_area is None or area < best_area:
+                    best, best_area = i, area
+        return best
+
+    def _exact_many(self, np, xs, ys):
+        """Vectorized _exact(): ray casting per polygon over the points inside its bounding box"""
+        labels = np.full(xs.shape, OUTSIDE, dtype=np.int64)
+        best_area = np.full(xs.shape, np.inf)
+        for i, polygon in enumerate(self.polygons):
+            min_x, min_y, max_x, max_y = polygon.bbox
+            candidates = np.flatnonzero((xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y))
+            if not len(candidates):
+                continue
+            x, y = xs[candidates], ys[candidates]
+            inside = np.zeros(len(candidates), dtype=bool)
+            for x1, y1, x2, y2, slope in polygon.edges():
+                inside ^= ((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * slope)
+            area = (max_x - min_x) * (max_y - min_y)
+            hits = candidates[inside & (area < best_area[candidates])]
+            labels[hits] = i
+            best_area[hits] = area
+        return labels
+
+    def _build_raster(self, cell: float):
+        """Label raster cells with the polygon covering them entirely, OUTSIDE or BOUNDARY"""
+        self.cell = cell
+        if not self.polygons:
+            self.origin, self.cols, self.rows, self.raster = (0.0, 0.0), 0, 0, array("h")
+            return
+        min_x = min(p.bbox[0] for p in self.polygons)
+        min_y = min(p.bbox[1] for p in self.polygons)
+        max_x = max(p.bbox[2] for p in self.polygons)
+        max_y = max(p.bbox[3] for p in self.polygons)
+        self.origin = (min_x, min_y)
+        self.cols = int((max_x - min_x) / cell) + 1
+        self.rows = int((max_y - min_y) / cell) + 1
+
+        # Mark every cell an edge passes through (sampled finer than the cell size, plus neighbours)
+        boundary = bytearray(self.cols * self.rows)
+        for polygon in self.polygons:
+            for x1, y1, x2, y2, _ in polygon.edges():
+                steps = int(max(abs(x2 - x1), abs(y2 - y1)) / (cell / 4)) + 1
+                for s in range(steps + 1):
+                    col = int((x1 + (x2 - x1) * s / steps - min_x) / cell)
+                    row = int((y1 + (y2 - y1) * s / steps - min_y) / cell)
+                    for r in range(max(row - 1, 0), min(row + 2, self.rows)):
+                        for c in range(max(col - 1, 0), min(col + 2, self.cols)):
+                            boundary[r * self.cols + c] = 1
+
+        self.raster = array("h", [BOUNDARY]) * (self.cols * self.rows)
+        for r in range(self.rows):
+            y = min_y + (r + 0.5) * cell
+            for c in range(self.cols):
+                if not boundary[r * self.cols + c]:
+                    self.raster[r * self.cols + c] = self._exact(min_x + (c + 0.5) * cell, y)
+
+    def lookup_index(self, lat: float, lon: float) -> int:
+        col = math.floor((lon - self.origin[0]) / self.cell)  # not int(): just below the origin is outside
+        row = math.floor((lat - self.origin[1]) / self.cell)
+        if not (0 <= col < self.cols and 0 <= row < self.rows):
+            return OUTSIDE
+        label = self.raster[row * self.cols + col]
+        return self._exact(lon, lat) if label == BOUNDARY else label
+
+    def lookup(self, lat: float, lon: float):
+        """Get the name of the neighborhood containing a point, or None"""
+        i = self.lookup_index(float(lat), float(lon))
+        return self.polygons[i].name if i >= 0 else None
+
+    def lookup_many(self, lats, lons) -> list:
+        """Look up many points at once (names, None where no polygon contains the point)"""
+        try:
+            import numpy as np
+        except ImportError:
+            return [self.lookup(lat, lon) for lat, lon in zip(lats, lons)]
+
+        lat = np.asarray(lats, dtype=np.float64)
+        lon = np.asarray(lons, dtype=np.float64)
+        cols = np.floor((lon - self.origin[0]) / self.cell).astype(np.int64)
+        rows = np.floor((lat - self.origin[1]) / self.cell).astype(np.int64)
+        inside = (cols >= 0) & (cols < self.cols) & (rows >= 0) & (rows < self.rows)
+
+        raster = np.frombuffer(self.raster, dtype=np.int16)
+        labels = np.full(lat.shape, OUTSIDE, dtype=np.int64)
+        labels[inside] = raster[rows[inside] * self.cols + cols[inside]]
+
+        pending = np.flatnonzero(labels == BOUNDARY)
+        if len(pending):
+            labels[pending] = self._exact_many(np, lon[pending], lat[pending])
+
+        names = [p.name for p in self.polygons] + [None]  # index -1 -> None
+        return [names[label] for label in labels.tolist()]
+
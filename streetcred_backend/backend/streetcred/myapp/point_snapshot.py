@@ -0,0 +1,299 @@
+"""
+Versioned on-disk snapshot of map points, memory-mapped by every worker
+
+`manage.py refresh_point_snapshot` loads each layer (hydrants, locations,
+reports) once, sorts it by id, builds its KD-tree and writes everything to
+POINT_SNAPSHOT_PATH as flat little-endian arrays. Each write goes to a
+temporary file that is then renamed over the old one, so readers see either
+the old version or the new one, never a partial file.
+
+Workers mmap the file read-only and wrap the arrays in memoryviews (no
+parsing, no copies), so every worker on the host shares the same pages
+through the OS page cache and start-up is just open + mmap. get_snapshot()
+checks the file at most every POINT_SNAPSHOT_CHECK_SECONDS and maps the new
+version when it changes. An old mapping stays valid until the last view
+into it is dropped, so in-flight requests finish on the version they
+started with.
+
+Layout (all offsets from the start of the file, arrays 8-byte aligned):
+
+    header    magic "SCPTS\\x00\\x00\\x01", version u64, created_at f64, layer count u32
+    layers    name (16 bytes, NUL padded), row count u64, then (offset, length)
+              u64 pairs for each entry of COLUMNS
+    data      the arrays
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from .columnar import PointColumns
+
+MAGIC = b"SCPTS\x00\x00\x02"
+HEADER = struct.Struct("<8sQdI4x")
+LAYER = struct.Struct("<16sQ")
+COLUMN = struct.Struct("<QQ")  # offset, length in items
+
+# Per-layer arrays: rows are sorted by id; tree_* is the layer's KDTree
+COLUMNS = (
+    ("ids", "q"), ("lats", "d"), ("lons", "d"), ("kinds", "B"), ("geohashes", "q"),
+    ("named_rows", "q"), ("name_offsets", "q"), ("names", "B"),
+    ("external_rows", "q"), ("external_offsets", "q"), ("external_ids", "B"),  # JSON-encoded original ids
+    ("tree_x", "d"), ("tree_y", "d"), ("tree_z", "d"), ("tree_order", "q"), ("tree_axes", "B"),
+)
+
+
+class MappedNames:
+    """Read-only row -> name mapping stored as sorted row numbers, offsets and one UTF-8 blob"""
+
+    def __init__(self, rows, offsets, blob):
+        self.rows = rows
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, index: int, default=None):
+        i = bisect_left(self.rows, index)
+        if i == len(self.rows) or self.rows[i] != index:
+            return default
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def items(self):
+        for i in range(len(self.rows)):
+            yield self.rows[i], bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def values(self):
+        for _, name in self.items():
+            yield name
+
+
+class MappedExternalIds(MappedNames):
+    """Read-only row -> original id mapping; ids are stored JSON-encoded"""
+
+    def get(self, index: int, default=None):
+        value = super().get(index, default)
+        return default if value is default else json.loads(value)
+
+    def items(self):
+        for row, value in super().items():
+            yield row, json.loads(value)
+
+
+class SortedIds:
+    """Membership test over an id column sorted ascending"""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __contains__(self, row_id) -> bool:
+        i = bisect_left(self.ids, row_id)
+        return i < len(self.ids) and self.ids[i] == row_id
+
+
+class SnapshotLayer:
+    def __init__(self, name: str, version: int, created_at: float, columns: dict):
+        from .nearest import KDTree
+
+        self.name = name
+        self.version = version
+        self.created_at = created_at
+        self.points = PointColumns.from_buffers(
+            columns["ids"], columns["lats"], columns["lons"], columns["kinds"], columns["geohashes"],
+            MappedNames(columns["named_rows"], columns["name_offsets"], columns["names"]), [name],
+            MappedExternalIds(columns["external_rows"], columns["external_offsets"], columns["external_ids"]),
+        )
+        self.tree = KDTree.from_arrays(
+            (columns["tree_x"], columns["tree_y"], columns["tree_z"]), columns["tree_order"], columns["tree_axes"]
+        )
+        self.ids = SortedIds(columns["ids"])
+
+
+class PointSnapshot:
+    """One mapped snapshot version"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        view = memoryview(self._mmap)
+        magic, self.version, self.created_at, layer_count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a point snapshot")
+
+        self.layers = {}
+        position = HEADER.size
+        for _ in range(layer_count):
+            raw_name, _count = LAYER.unpack_from(view, position)
+            position += LAYER.size
+            columns = {}
+            for column, typecode in COLUMNS:
+                offset, length = COLUMN.unpack_from(view, position)
+                position += COLUMN.size
+                size = struct.calcsize(typecode)
+                columns[column] = view[offset:offset + length * size].cast(typecode)
+            name = raw_name.rstrip(b"\x00").decode()
+            self.layers[name] = SnapshotLayer(name, self.version, self.created_at, columns)
+
+    def layer(self, name: str):
+        return self.layers.get(name)
+
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+def _string_table(values: dict) -> list:
+    """row -> str mapping as sorted rows, offsets and one UTF-8 blob (read back by MappedNames)"""
+    from array import array
+
+    items = sorted(values.items())
+    offsets = array("q", [0])
+    blob = bytearray()
+    for _, value in items:
+        blob += value.encode()
+        offsets.append(len(blob))
+    return [array("q", [row for row, _ in items]), offsets, blob]
+
+
+def _layer_arrays(points: PointColumns, tree) -> list:
+    """The arrays of one layer, in COLUMNS order"""
+    external = {row: json.dumps(row_id) for row, row_id in points.external_ids.items()}
+    return [
+        points.ids, points.lats, points.lons, points.kinds, points.geohashes,
+        *_string_table(dict(points.names.items())), *_string_table(external),
+        tree.coords[0], tree.coords[1], tree.coords[2], tree.order, tree.axes,
+    ]
+
+
+def write_snapshot(layers: dict, path: str = None) -> int:
+    """
+    Atomically write a new snapshot version
+
+    Args:
+        layers: Layer name -> (PointColumns sorted by id, KDTree over its rows)
+        path: Target file (POINT_SNAPSHOT_PATH by default)
+
+    Returns:
+        int: The version written
+    """
+    if sys.byteorder != "little":
+        raise RuntimeError("point snapshots are written little-endian only")
+    path = str(path or settings.POINT_SNAPSHOT_PATH)
+    try:
+        with open(path, "rb") as f:
+            version = HEADER.unpack(f.read(HEADER.size))[1] + 1
+    except (FileNotFoundError, struct.error):
+        version = 1
+
+    arrays = {name: _layer_arrays(points, tree) for name, (points, tree) in layers.items()}
+    position = HEADER.size + len(layers) * (LAYER.size + len(COLUMNS) * COLUMN.size)
+    table = b""
+    blocks = []
+    for name, columns in arrays.items():
+        table += LAYER.pack(name.encode()[:16], len(layers[name][0]))
+        for data in columns:
+            position += -position % 8
+            itemsize = getattr(data, "itemsize", 1)
+            table += COLUMN.pack(position, len(data))
+            blocks.append((position, data))
+            position += len(data) * itemsize
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, version, time.time(), len(layers)))
+            f.write(table)
+            for offset, data in blocks:
+                f.write(b"\x00" * (offset - f.tell()))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600; workers may run as another user
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return version
+
+
+def build_layer(name: str) -> tuple:
+    """
+    Load one layer (see tiles.LAYER_LOADERS) into id-sorted columns and build its tree
+
+    Returns:
+        tuple: (PointColumns, KDTree)
+    """
+    from .nearest import KDTree, _xyz
+    from .tiles import LAYER_LOADERS
+
+    points = PointColumns.from_rows(
+        ((row_id, lat, lon, props.get("name")) for row_id, lat, lon, props in LAYER_LOADERS[name]()), name
+    ).sorted_by_id()
+    return points, KDTree([_xyz(lat, lon) for lat, lon in zip(points.lats, points.lons)])
+
+
+def refresh_snapshot(layers: tuple, path: str = None) -> int:
+    """Load the layers and write them as a new snapshot version (other layers are copied from the current one)"""
+    path = str(path or settings.POINT_SNAPSHOT_PATH)
+    contents = {}
+    try:
+        current = PointSnapshot(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        current = None
+    if current is not None:
+        for name, layer in current.layers.items():
+            if name not in layers:
+                contents[name] = (layer.points, layer.tree)
+    for name in layers:
+        contents[name] = build_layer(name)
+    return write_snapshot(contents, path)
+
+
+_snapshot = None
+_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Get the current snapshot, mapping a newer version if the file has changed
+
+    Returns:
+        PointSnapshot: or None if there is no (readable) snapshot file
+    """
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.POINT_SNAPSHOT_CHECK_SECONDS:
+        return _snapshot
+    with _snapshot_lock:
+        if now - _checked_at < settings.POINT_SNAPSHOT_CHECK_SECONDS:
+            return _snapshot
+        _checked_at = now
+        path = str(settings.POINT_SNAPSHOT_PATH)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _snapshot = None
+            return None
+        if _snapshot is None or _snapshot.file_id != (stat.st_dev, stat.st_ino, stat.st_mtime_ns):
+            try:
+                _snapshot = PointSnapshot(path)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"ERROR: Could not map point snapshot {path}: {e}")
+        return _snapshot
+
+
+def get_layer(name: str):
+    """Get a layer of the current snapshot, or None if missing or older than POINT_SNAPSHOT_MAX_AGE"""
+    snapshot = get_snapshot()
+    if snapshot is None or snapshot.age() > settings.POINT_SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot.layer(name)
@@ -0,0 +1,242 @@
+"""
+Opt-in per-request profiling
+
+With PROFILING_ENABLED on, ProfilingMiddleware profiles a request when it
+carries `X-Profile: <PROFILING_TOKEN>`, or at random for a
+PROFILING_SAMPLE_RATE fraction of requests. With it off the middleware
+raises MiddlewareNotUsed, so Django drops it at start-up and requests pay
+nothing.
+
+A profiled request gets a sampling thread that reads the request thread's
+stack every PROFILING_INTERVAL_MS and counts each distinct call stack.
+Unlike cProfile this keeps whole stacks (so time spent in folium, Supabase
+calls or waiting on Gemini shows up under the view that caused it) and
+doesn't slow the profiled code down. Profiles are written to PROFILING_DIR,
+keeping the newest PROFILING_MAX_PROFILES, and served by the
+/api/debug/profiles endpoints as folded stacks ("frame;frame;frame count"
+per line), which flamegraph.pl and speedscope read directly.
+
+Under ASGI the request thread isn't known until the view runs: Django runs
+sync views and process_view() in the request's thread-sensitive executor,
+so process_view() points the sampler at that thread, and only the view is
+sampled (not the middleware before it). For streamed responses only the
+work done before the body starts streaming is captured.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for root in (str(settings.BASE_DIR), *sorted(sys.path, key=len, reverse=True)):
+        if root and filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Counts the call stacks of one thread, sampled from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id  # may be set later; nothing is sampled while None
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        labels = {}  # code object -> label, computed once per function
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+
+def should_profile(request) -> str:
+    """
+    Decide whether to profile a request
+
+    Returns:
+        str: "header", "sampled" or None
+    """
+    token = settings.PROFILING_TOKEN
+    header = request.META.get(PROFILE_HEADER)
+    if header and token and hmac.compare_digest(header, token):
+        return "header"
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        reason = should_profile(request)
+        if reason is None:
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL_MS / 1000)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        return self.finish(request, response, reason, started, sampler)
+
+    async def __acall__(self, request):
+        reason = should_profile(request)
+        if reason is None:
+            return await self.get_response(request)
+
+        sampler = StackSampler(None, settings.PROFILING_INTERVAL_MS / 1000)  # thread set by process_view
+        request.profile_sampler = sampler
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sampler.stop()
+        return self.finish(request, response, reason, started, sampler)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Runs in the view's thread (the request thread under WSGI, the executor under ASGI)
+        sampler = getattr(request, "profile_sampler", None)
+        if sampler is not None:
+            sampler.thread_id = threading.get_ident()
+        return None
+
+    def finish(self, request, response, reason: str, started: float, sampler: StackSampler):
+        duration_ms = (time.perf_counter() - started) * 1000
+        try:
+            profile_id = save_profile(request, response, reason, duration_ms, sampler)
+            response["X-Profile-Id"] = profile_id
+        except Exception as e:
+            print(f"ERROR: Could not save profile for {request.path}: {e}")
+        return response
+
+
+# On-disk ring buffer
+
+def save_profile(request, response, reason: str, duration_ms: float, sampler: StackSampler) -> str:
+    """Write a profile and drop the oldest beyond PROFILING_MAX_PROFILES"""
+    profile_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    profile = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.get_full_path(),
+        "status": response.status_code,
+        "reason": reason,
+        "duration_ms": round(duration_ms, 1),
+        "interval_ms": settings.PROFILING_INTERVAL_MS,
+        "samples": sampler.samples,
+        "created_at": time.time(),
+        "stacks": dict(sampler.stacks),
+    }
+
+    directory = str(settings.PROFILING_DIR)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, os.path.join(directory, f"{profile_id}.json"))
+
+    # Ids start with a timestamp, so name order is age order
+    names = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+    for name in names[:max(0, len(names) - settings.PROFILING_MAX_PROFILES)]:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # another worker removed it first
+    return profile_id
+
+
+def load_profile(profile_id: str):
+    """Get a stored profile, or None"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(str(settings.PROFILING_DIR), f"{profile_id}.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def list_profiles() -> list:
+    """Stored profiles without their stacks, newest first"""
+    directory = str(settings.PROFILING_DIR)
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith(".json")), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        profile = load_profile(name[:-len(".json")])
+        if profile is not None:
+            profile.pop("stacks")
+            profiles.append(profile)
+    return profiles
+
+
+def folded(profile: dict) -> str:
+    """Folded stacks ("frame;frame count" per line) for flamegraph.pl / speedscope"""
+    stacks = sorted(profile["stacks"].items(), key=lambda item: item[1], reverse=True)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+def is_authorized(request) -> bool:
+    """Admin access: staff session or the profiling token"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    token = settings.PROFILING_TOKEN
+    header = request.META.get(PROFILE_HEADER)
+    return bool(header and token and hmac.compare_digest(header, token))
@@ -0,0 +1,169 @@
+"""
+Live fan-out of newly submitted reports to Server-Sent Events subscribers
+
+Subscribers are indexed by the geohash prefix they watch. Publishing a
+report looks up each prefix of the report's geohash (at most 10 dict
+lookups), so the cost of a publish depends on the number of interested
+subscribers, not on the total number connected.
+
+Each subscriber has a bounded queue. When a slow consumer's queue is full
+the oldest event is dropped; after too many drops the subscription is
+closed with an ``overflow`` event so the client can reconnect and
+re-sync from /reports/recent.
+
+Subscriptions are per process: under several ASGI workers a client only
+receives reports submitted through the worker it is connected to.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+import pygeohash as pgh
+from django.conf import settings
+
+MAX_PRECISION = 9
+GEOHASH_CHARS = set("0123456789bcdefghjkmnpqrstuvwxyz")
+
+_CLOSE = object()
+
+
+class Subscription:
+    """One connected client watching a geohash area"""
+
+    def __init__(self, broker, prefix: str, loop, max_queue: int):
+        self.broker = broker
+        self.prefix = prefix
+        self.loop = loop
+        self.queue = asyncio.Queue(max(max_queue, 2))  # room for a final event + close marker
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, event: bytes):
+        """Queue an event, shedding the oldest one if the client is falling behind (runs on self.loop)"""
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped > self.broker.max_dropped:
+                self.close(b"event: overflow\ndata: {}\n\n")
+                return
+        self.queue.put_nowait(event)
+
+    def close(self, final_event: bytes = None):
+        """Stop the subscription, optionally sending one last event (runs on self.loop)"""
+        self.closed = True
+        self.broker.unsubscribe(self)
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        if final_event:
+            self.queue.put_nowait(final_event)
+        self.queue.put_nowait(_CLOSE)
+
+    async def events(self, keepalive: float):
+        """Yield SSE frames until the subscription is closed"""
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is _CLOSE:
+                    break
+                yield event
+                if self.closed and self.queue.empty():
+                    break
+        finally:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+class ReportBroker:
+    """Geohash-prefix indexed publish/subscribe hub"""
+
+    def __init__(self, max_queue: int = 100, max_dropped: int = 500):
+        self.max_queue = max_queue
+        self.max_dropped = max_dropped
+        self._lock = threading.Lock()
+        self._by_prefix = defaultdict(set)
+        self.stats = {"published": 0, "delivered": 0}
+
+    def subscribe(self, prefix: str, loop=None) -> Subscription:
+        """Register a subscriber for every report whose geohash starts with prefix"""
+        subscription = Subscription(self, prefix, loop or asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            self._by_prefix[prefix].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._by_prefix.get(subscription.prefix)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_prefix[subscription.prefix]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._by_prefix.values())
+
+    def publish(self, report: dict) -> int:
+        """
+        Push a report to every subscriber whose area contains it
+
+        Safe to call from any thread.
+
+        Args:
+            report: Report row with at least lat and lon
+
+        Returns:
+            int: Number of subscribers the report was queued for
+        """
+        geohash = pgh.encode(float(report["lat"]), float(report["lon"]), precision=MAX_PRECISION)
+        event = f"event: report\ndata: {json.dumps({**report, 'geohash': geohash}, default=str)}\n\n".encode()
+
+        with self._lock:
+            targets = []
+            for i in range(MAX_PRECISION + 1):
+                subscribers = self._by_prefix.get(geohash[:i])
+                if subscribers:
+                    targets.extend(subscribers)
+
+        # One wakeup per event loop rather than per subscriber
+        by_loop = defaultdict(list)
+        for subscription in targets:
+            by_loop[subscription.loop].append(subscription)
+        for loop, subscriptions in by_loop.items():
+            loop.call_soon_threadsafe(_offer_all, subscriptions, event)
+
+        self.stats["published"] += 1
+        self.stats["delivered"] += len(targets)
+        return len(targets)
+
+
+def _offer_all(subscriptions: list, event: bytes):
+    for subscription in subscriptions:
+        subscription.offer(event)
+
+
+_broker = None
+
+
+def get_report_broker() -> ReportBroker:
+    """Get or create the process-wide report broker"""
+    global _broker
+    if _broker is None:
+        _broker = ReportBroker(
+            max_queue=settings.REPORT_FEED_QUEUE_SIZE,
+            max_dropped=settings.REPORT_FEED_MAX_DROPPED,
+        )
+    return _broker
+
+
+def publish_report(report: dict):
+    """Publish a newly created report to live subscribers, never failing the caller"""
+    try:
+        get_report_broker().publish(report)
+    except Exception as e:
+        print(f"ERROR: Could not publish report to live feed: {e}")
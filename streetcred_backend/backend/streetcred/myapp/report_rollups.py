@@ -0,0 +1,171 @@
+"""
+Neighborhood tagging and per-neighborhood report rollups
+
+Reports are tagged with their neighborhood and precision-9 geohash when
+they are written, using each city's polygon index (cities.py), so
+analytics never have to re-geocode rows. Points outside every polygon are
+tagged UNMAPPED.
+
+ReportRollup holds the number of reports per neighborhood per UTC hour and
+day. record_reports() adds new reports to it with one upsert per bucket, and
+dashboard queries read only the rollups. `manage.py
+backfill_report_neighborhoods` tags existing rows in batches and can
+rebuild the rollups from scratch.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Sum
+from .geohash_codec import encode_batch
+from .models import ReportRollup
+from . import cities
+
+UNMAPPED = "Unmapped"
+
+
+def resolve_neighborhoods(lats, lons) -> list:
+    """Get the neighborhood name for each point (UNMAPPED outside every boundary)"""
+    names = cities.lookup_many(lats, lons)
+    return [name or UNMAPPED for name in names]
+
+
+def tag_reports(reports: list) -> list:
+    """
+    Set "neighborhood" and "geohash" on report rows in place
+
+    Args:
+        reports: Report dicts with lat/lon
+
+    Returns:
+        list: The same rows
+    """
+    if not reports:
+        return reports
+    lats = [float(r["lat"]) for r in reports]
+    lons = [float(r["lon"]) for r in reports]
+    for report, name, geohash in zip(reports, resolve_neighborhoods(lats, lons), encode_batch(lats, lons, 9)):
+        report["neighborhood"] = name
+        report["geohash"] = geohash
+    return reports
+
+
+def _created_at(report: dict) -> datetime:
+    value = report.get("created_at")
+    if value is None:
+        return datetime.now(dt_timezone.utc)
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)  # Supabase timestamps without a zone are UTC
+    return value.astimezone(dt_timezone.utc)
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if granularity == ReportRollup.DAY else value
+
+
+def _bucket_counts(reports) -> Counter:
+    counts = Counter()
+    for report in reports:
+        created = _created_at(report)
+        neighborhood = report.get("neighborhood") or UNMAPPED
+        for granularity in (ReportRollup.HOUR, ReportRollup.DAY):
+            counts[(granularity, neighborhood, bucket_start(created, granularity))] += 1
+    return counts
+
+
+def _upsert(counts: Counter):
+    if not counts:
+        return
+    adapt = connection.ops.adapt_datetimefield_value
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {ReportRollup._meta.db_table} (granularity, neighborhood, bucket_start, count) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (granularity, neighborhood, bucket_start) DO UPDATE SET count = count + excluded.count",
+                [(g, n, adapt(b), c) for (g, n, b), c in counts.items()],
+            )
+
+
+def record_reports(reports: list):
+    """Add newly inserted (tagged) reports to the hourly and daily rollups, never failing the caller"""
+    try:
+        _upsert(_bucket_counts(reports))
+    except Exception as e:
+        print(f"ERROR: Could not update report rollups: {e}")
+
+
+def rebuild_rollups(reports, chunk_size: int = 10000) -> int:
+    """
+    Replace the rollups with counts over the given reports
+
+    Args:
+        reports: Iterable of tagged report rows (created_at, neighborhood)
+
+    Returns:
+        int: Number of reports counted
+    """
+    counts = Counter()
+    total = 0
+    chunk = []
+    for report in reports:
+        chunk.append(report)
+        if len(chunk) >= chunk_size:
+            counts.update(_bucket_counts(chunk))
+            total += len(chunk)
+            chunk = []
+    counts.update(_bucket_counts(chunk))
+    total += len(chunk)
+
+    with transaction.atomic():
+        ReportRollup.objects.all().delete()
+        _upsert(counts)
+    return total
+
+
+def activity(granularity: str, since: datetime, until: datetime, neighborhood: str = None, limit: int = 10) -> dict:
+    """
+    Read report activity per neighborhood from the rollups
+
+    Args:
+        granularity: "hour" or "day"
+        since: Start of the window (rounded down to a bucket)
+        until: End of the window (exclusive)
+        neighborhood: Only this neighborhood
+        limit: Number of busiest neighborhoods returned
+
+    Returns:
+        dict: Window, overall total and per-neighborhood totals with their time series
+    """
+    since = bucket_start(since.astimezone(dt_timezone.utc), granularity)
+    rollups = ReportRollup.objects.filter(granularity=granularity, bucket_start__gte=since, bucket_start__lt=until)
+    if neighborhood:
+        rollups = rollups.filter(neighborhood=neighborhood)
+
+    totals = list(
+        rollups.values("neighborhood").annotate(total=Sum("count")).order_by("-total", "neighborhood")[:limit]
+    )
+    series = {row["neighborhood"]: [] for row in totals}
+    for name, start, count in rollups.filter(neighborhood__in=list(series)).order_by("bucket_start").values_list(
+        "neighborhood", "bucket_start", "count"
+    ):
+        series[name].append({"bucket_start": start.isoformat(), "count": count})
+
+    return {
+        "granularity": granularity,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "total_reports": rollups.aggregate(total=Sum("count"))["total"] or 0,
+        "neighborhoods": [
+            {"neighborhood": row["neighborhood"], "total": row["total"], "series": series[row["neighborhood"]]}
+            for row in totals
+        ],
+    }
+
+
+def default_window(granularity: str) -> tuple:
+    """Last 48 hours for hourly data, last 30 days for daily data"""
+    until = datetime.now(dt_timezone.utc)
+    return until - (timedelta(hours=48) if granularity == ReportRollup.HOUR else timedelta(days=30)), until
@@ -0,0 +1,188 @@
+"""
+Full-text search over report descriptions
+
+Reports live in Supabase; this keeps a local SQLite FTS5 index of them
+(created by migration 0010):
+
+- report_search: FTS5 table of descriptions (porter stemming), rowid = report id
+- report_search_docs: the filterable columns, indexed by geokey and created_ts
+
+New reports are indexed when they are submitted; `manage.py
+rebuild_report_search` (re)loads everything from Supabase. Keyword queries
+are ranked by BM25; the bounding box becomes geokey range seeks (see
+geo.bbox_key_ranges) and the time range a created_ts range.
+"""
+import re
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from .geo import bbox_key_ranges, geokey, prefix_key_range
+
+TERM = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def index_reports(reports: list) -> int:
+    """
+    Add or replace reports in the search index
+
+    Args:
+        reports: Report rows as returned by Supabase (id, user_id, lat, lon,
+            description, created_at, image_url)
+
+    Returns:
+        int: Number of reports indexed
+    """
+    docs, ids, texts = [], [], []
+    for report in reports:
+        try:
+            created_at = report["created_at"]
+            docs.append((
+                report["id"], str(report["user_id"]), report["lat"], report["lon"],
+                geokey(report["lat"], report["lon"]), _timestamp(created_at), str(created_at),
+                report.get("image_url"),
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"ERROR: Could not index report {report.get('id')}: {e}")
+            continue
+        ids.append((report["id"],))
+        texts.append((report["id"], report.get("description") or ""))
+
+    if not docs:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO report_search_docs "
+                "(id, user_id, lat, lon, geokey, created_ts, created_at, image_url) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                docs,
+            )
+            cursor.executemany("DELETE FROM report_search WHERE rowid = %s", ids)
+            cursor.executemany("INSERT INTO report_search (rowid, description) VALUES (%s, %s)", texts)
+    return len(docs)
+
+
+def clear_index():
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM report_search_docs")
+            cursor.execute("DELETE FROM report_search")
+
+
+def optimize_index():
+    """Merge the FTS index segments (after a bulk load)"""
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO report_search (report_search) VALUES ('optimize')")
+
+
+def build_match(query: str):
+    """
+    Turn user input into an FTS5 query: every word must match, `word*` is a prefix search
+
+    Returns:
+        str: The MATCH expression, or None if the input has no words
+    """
+    terms = []
+    for term in TERM.findall(query or ""):
+        prefix = term.endswith("*")
+        word = term.rstrip("*")
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+
+def search(query: str = None, bounds=None, geohash: str = None, since=None, until=None,
+           page: int = 1, page_size: int = 20) -> dict:
+    """
+    Search reports by keywords, area and time
+
+    Args:
+        query: Keywords (all must match); without keywords results are newest first
+        bounds: Optional (south, west, north, east)
+        geohash: Optional geohash prefix the report must fall in
+        since: Optional datetime; only reports created at or after it
+        until: Optional datetime; only reports created before it
+        page: 1-based page number
+        page_size: Results per page
+
+    Returns:
+        dict: {"page", "page_size", "has_more", "results": [...]}; keyword
+        results carry a BM25 "score" (lower is a better match)
+    """
+    match = build_match(query)
+    where, params = [], []
+
+    if bounds:
+        south, west, north, east = bounds
+        ranges = bbox_key_ranges(south, west, north, east)
+        if not ranges:
+            return {"page": page, "page_size": page_size, "has_more": False, "results": []}
+        where.append("(" + " OR ".join("(d.geokey >= %s AND d.geokey < %s)" for _ in ranges) + ")")
+        params.extend(v for r in ranges for v in r)
+        where.append("d.lat BETWEEN %s AND %s AND d.lon BETWEEN %s AND %s")
+        params.extend([south, north, west, east])
+    if geohash:
+        where.append("d.geokey >= %s AND d.geokey < %s")
+        params.extend(prefix_key_range(geohash[:9]))
+    if since is not None:
+        where.append("d.created_ts >= %s")
+        params.append(_timestamp(since))
+    if until is not None:
+        where.append("d.created_ts < %s")
+        params.append(_timestamp(until))
+
+    # Page first, then fetch descriptions/columns for just that page
+    # (CROSS JOIN keeps SQLite from scanning the FTS table for the join)
+    columns = "d.id, d.user_id, d.lat, d.lon, f.description, d.image_url, d.created_at"
+    if match and not where:
+        sql = (
+            f"SELECT {columns}, f.score FROM "
+            "(SELECT rowid, description, rank AS score FROM report_search WHERE report_search MATCH %s "
+            "ORDER BY rank LIMIT %s OFFSET %s) f "
+            "CROSS JOIN report_search_docs d ON d.id = f.rowid ORDER BY f.score"
+        )
+        params.insert(0, match)
+    elif match:
+        sql = (
+            f"SELECT {columns}, bm25(report_search) AS score "
+            "FROM report_search f JOIN report_search_docs d ON d.id = f.rowid "
+            "WHERE report_search MATCH %s" + "".join(f" AND {w}" for w in where) +
+            " ORDER BY score LIMIT %s OFFSET %s"
+        )
+        params.insert(0, match)
+    else:
+        sql = (
+            f"SELECT {columns}, NULL FROM "
+            "(SELECT * FROM report_search_docs d" + (" WHERE " + " AND ".join(where) if where else "") +
+            " ORDER BY d.created_ts DESC LIMIT %s OFFSET %s) d "
+            "CROSS JOIN report_search f ON f.rowid = d.id ORDER BY d.created_ts DESC"
+        )
+
+    page_size = max(1, min(page_size, settings.REPORT_SEARCH_MAX_PAGE_SIZE))
+    offset = (max(page, 1) - 1) * page_size
+    params.extend([page_size + 1, offset])  # one extra row tells us whether there is a next page
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    results = [
+        {
+            "id": row[0],
+            "user_id": row[1],
+            "lat": row[2],
+            "lon": row[3],
+            "description": row[4],
+            "image_url": row[5],
+            "created_at": row[6],
+            "score": round(row[7], 4) + 0.0 if row[7] is not None else None,  # + 0.0 turns -0.0 into 0.0
+        }
+        for row in rows[:page_size]
+    ]
+    return {"page": max(page, 1), "page_size": page_size, "has_more": len(rows) > page_size, "results": results}
@@ -1,12 +1,26 @@
 from ninja import NinjaAPI, Schema
 from typing import List, Optional
 from datetime import datetime
-from .badge_rewards import update_user_points, supabase
+import math
+from collections import Counter
+from .admission import admission_control
+from .badge_rewards import update_user_points, _get_supabase
 from .models import Report
 from .report_image_upload import upload_report_image_base64
+from . import heatmap, nearest, report_rollups, report_search, trending
+from .report_feed import publish_report
+from .response_cache import cached_route, conditional_route, invalidate
+from .geo import region_prefixes
+from .tiles import invalidate_point, invalidate_regions
+from .gamification_queue import enqueue_report_accepted, task_status
+from .loaders import loader_scope
 
 api = NinjaAPI(urls_namespace='reports')
 
+# Columns added by the ALTERs in reports_setup.sql
+TAG_COLUMNS = ("neighborhood", "geohash", "facility_type", "facility_id")
+_tag_columns_missing = False
+
 
 # Request/Response Schemas
 class CreateReportRequest(Schema):
@@ -25,17 +39,31 @@ class ReportResponse(Schema):
     lon: float
     description: str
     image_url: Optional[str] = None
+    facility_type: Optional[str] = None  # "hydrants" or "locations" when snapped to a facility
+    facility_id: Optional[int] = None
     created_at: str
 
 
 class CreateReportResponse(Schema):
     report: ReportResponse
     points_awarded: int
-    new_points: int
-    previous_points: int
-    new_badges: List[dict]
-    total_badges: int
-    next_milestone: int
+    # "pending" while a worker applies the points/badges (poll /gamification/{task_id});
+    # the fields below are only filled in when awarded inline ("done")
+    gamification_status: str = "done"
+    task_id: Optional[int] = None
+    new_points: Optional[int] = None
+    previous_points: Optional[int] = None
+    new_badges: List[dict] = []
+    total_badges: Optional[int] = None
+    next_milestone: Optional[int] = None
+
+
+class BatchReportItem(CreateReportRequest):
+    client_ref: Optional[str] = None  # Echoed back so the client can match results to its queue
+
+
+class BatchReportRequest(Schema):
+    reports: List[BatchReportItem]
 
 
 class GetReportsResponse(Schema):
@@ -45,6 +73,7 @@ class GetReportsResponse(Schema):
 
 
 @api.post("/submit", response=CreateReportResponse)
+@admission_control("report-submit", users=lambda payload, **_: {payload.user_id: 1})
 def submit_report(request, payload: CreateReportRequest):
     """
     Submit a new report and automatically award 1 point to the user
@@ -52,10 +81,11 @@ def submit_report(request, payload: CreateReportRequest):
     Process:
     1. Uploads image to Supabase Storage (if provided)
     2. Creates report in reports table
-    3. Awards 1 point to user
-    4. Checks for badge milestones
-    5. Returns report + points/badge info
+    3. Queues the point/badge award (GAMIFICATION_ASYNC) and returns the
+       report with a task_id to poll, or awards 1 point and checks badge
+       milestones inline and returns report + points/badge info
     """
+    from django.conf import settings
 
     # Upload image if provided
     image_url = None
@@ -71,6 +101,7 @@ def submit_report(request, payload: CreateReportRequest):
             # Continue without image rather than failing entire request
 
     # Create report in Supabase
+    supabase = _get_supabase()
     report_data = {
         "user_id": payload.user_id,
         "lat": payload.lat,
@@ -78,27 +109,38 @@ def submit_report(request, payload: CreateReportRequest):
         "description": payload.description,
         "image_url": image_url
     }
+    report_rollups.tag_reports([report_data])  # neighborhood + geohash
+    _snap_to_facility(report_data)
 
-    result = supabase.table("reports").insert(report_data).execute()
+    created = _insert_reports(supabase, [report_data])
 
-    if not result.data:
+    if not created:
         raise Exception("Failed to create report")
 
-    created_report = result.data[0]
+    created_report = created[0]
+
+    # Rebuild map tiles covering the new report on next request
+    invalidate_point(payload.lat, payload.lon)
+    _record_created_report(created_report)
+    _index_reports([created_report])
+    report_rollups.record_reports([created_report])
+
+    if settings.GAMIFICATION_ASYNC:
+        task = enqueue_report_accepted(payload.user_id, payload.lat, payload.lon, [created_report["id"]])
+        invalidate("reports", "table:reports")
+        return {
+            "report": _report_out(created_report),
+            "points_awarded": 1,
+            "gamification_status": task.status,
+            "task_id": task.id
+        }
 
     # Award 1 point and check for badges
-    points_result = update_user_points(payload.user_id, 1)
+    points_result = update_user_points(payload.user_id, 1, payload.lat, payload.lon)
+    invalidate("reports", "table:reports", "table:profiles", "table:user_badges", f"user-badges:{payload.user_id}")
 
     return {
-        "report": {
-            "id": created_report["id"],
-            "user_id": created_report["user_id"],
-            "lat": created_report["lat"],
-            "lon": created_report["lon"],
-            "description": created_report["description"],
-            "image_url": created_report.get("image_url"),
-            "created_at": created_report["created_at"]
-        },
+        "report": _report_out(created_report),
         "points_awarded": 1,
         "new_points": points_result["new_points"],
         "previous_points": points_result["previous_points"],
@@ -108,12 +150,287 @@ def submit_report(request, payload: CreateReportRequest):
     }
 
 
+def _record_created_report(report: dict):
+    """Push a new report to live subscribers and the in-memory aggregates"""
+    publish_report(report)
+    heatmap.record_report(report["lat"], report["lon"], report.get("created_at"), report.get("id"))
+    trending.record_report(report["lat"], report["lon"], report.get("user_id"), report.get("id"))
+    nearest.record_point("reports", report["id"], report["lat"], report["lon"])
+
+
+def _snap_to_facility(report_data: dict):
+    """Link a report to the hydrant/location within FACILITY_SNAP_METERS of it, if any"""
+    match = nearest.snap_facility(report_data["lat"], report_data["lon"])
+    if match:
+        report_data["facility_type"] = match["layer"]
+        report_data["facility_id"] = match["id"]
+
+
+def _insert_reports(supabase, rows: list) -> list:
+    """
+    Insert report rows, leaving out the tag columns if the table doesn't have them yet
+
+    The tags are still set on the returned rows, so the feed, rollups and
+    search index get them either way.
+
+    Returns:
+        list: The created rows
+    """
+    global _tag_columns_missing
+    from django.conf import settings
+
+    if settings.REPORT_TAG_COLUMNS and not _tag_columns_missing:
+        try:
+            return supabase.table("reports").insert(rows).execute().data or []
+        except Exception as e:
+            # PostgREST: "Could not find the 'neighborhood' column of 'reports' in the schema cache"
+            if not any(f"'{column}' column" in str(e) for column in TAG_COLUMNS):
+                raise
+            _tag_columns_missing = True
+            print(f"ERROR: The reports table has no tag columns, run the ALTERs in myapp/reports_setup.sql. "
+                  f"Writing reports without them: {e}")
+
+    untagged = [{k: v for k, v in row.items() if k not in TAG_COLUMNS} for row in rows]
+    created = supabase.table("reports").insert(untagged).execute().data or []
+    return [{**report, **{k: row[k] for k in TAG_COLUMNS if k in row}} for report, row in zip(created, rows)]
+
+
+def _index_reports(reports: list):
+    """Add new reports to the local search index (a failure here doesn't fail the submission)"""
+    try:
+        report_search.index_reports(reports)
+    except Exception as e:
+        print(f"ERROR: Could not update report search index: {e}")
+
+
+def _report_out(report: dict) -> dict:
+    return {
+        "id": report["id"],
+        "user_id": report["user_id"],
+        "lat": report["lat"],
+        "lon": report["lon"],
+        "description": report["description"],
+        "image_url": report.get("image_url"),
+        "facility_type": report.get("facility_type"),
+        "facility_id": report.get("facility_id"),
+        "created_at": report["created_at"]
+    }
+
+
+@api.post("/submit-batch")
+@admission_control("report-batch", users=lambda payload, **_: Counter(r.user_id for r in payload.reports))
+def submit_reports_batch(request, payload: BatchReportRequest):
+    """
+    Submit many reports at once (e.g. reports collected offline)
+
+    Process:
+    1. Validates each report and uploads its image (if provided)
+    2. Creates all valid reports with one multi-row insert
+    3. Awards points once per user (1 per report) and checks milestones
+       once on each user's final total, queued per user when
+       GAMIFICATION_ASYNC is on (poll each user's task_id)
+    4. Returns a result per submitted report, in order, plus per-user points
+    """
+    from django.conf import settings
+    from ninja.errors import HttpError
+
+    if not payload.reports:
+        raise HttpError(400, "No reports provided")
+    if len(payload.reports) > settings.REPORT_BATCH_MAX:
+        raise HttpError(400, f"At most {settings.REPORT_BATCH_MAX} reports per batch")
+
+    results = [None] * len(payload.reports)
+    rows, row_indexes = [], []
+    for index, item in enumerate(payload.reports):
+        if not (-90 <= item.lat <= 90 and -180 <= item.lon <= 180):
+            results[index] = {"index": index, "client_ref": item.client_ref,
+                              "status": "error", "error": "Invalid coordinates"}
+            continue
+
+        image_url = None
+        if item.image_base64:
+            try:
+                image_url = upload_report_image_base64(item.image_base64, item.user_id, item.image_extension)
+            except Exception as e:
+                print(f"Image upload failed: {e}")
+                # Continue without image rather than failing the report
+
+        rows.append({
+            "user_id": item.user_id,
+            "lat": item.lat,
+            "lon": item.lon,
+            "description": item.description,
+            "image_url": image_url
+        })
+        row_indexes.append(index)
+
+    created = []
+    if rows:
+        report_rollups.tag_reports(rows)
+        for row in rows:
+            _snap_to_facility(row)
+        created = _insert_reports(_get_supabase(), rows)
+        if len(created) != len(rows):
+            raise Exception("Failed to create reports")
+
+    regions = set()
+    points_by_user = {}
+    for index, report in zip(row_indexes, created):
+        results[index] = {"index": index, "client_ref": payload.reports[index].client_ref,
+                          "status": "created", "report": _report_out(report)}
+        regions.update(region_prefixes(report["lat"], report["lon"]))
+        _record_created_report(report)
+        entry = points_by_user.setdefault(report["user_id"], {"count": 0, "report_ids": []})
+        entry["count"] += 1
+        entry["report_ids"].append(report["id"])
+        entry["lat"], entry["lon"] = report["lat"], report["lon"]  # badges use the latest location
+
+    if regions:
+        invalidate_regions(regions)
+    if created:
+        _index_reports(created)
+        report_rollups.record_reports(created)
+
+    users = []
+    with loader_scope() as loaders:
+        if not settings.GAMIFICATION_ASYNC:
+            # One profiles and one user_badges query for every user in the batch
+            loaders.profiles.prefetch(points_by_user)
+            loaders.user_badges.prefetch(points_by_user)
+        for user_id, entry in points_by_user.items():
+            if settings.GAMIFICATION_ASYNC:
+                task = enqueue_report_accepted(user_id, entry["lat"], entry["lon"], entry["report_ids"], entry["count"])
+                users.append({"user_id": user_id, "points_awarded": entry["count"],
+                              "gamification_status": task.status, "task_id": task.id})
+                continue
+            try:
+                points_result = update_user_points(user_id, entry["count"], entry["lat"], entry["lon"])
+                users.append({"user_id": user_id, "points_awarded": entry["count"], **points_result})
+            except Exception as e:
+                print(f"ERROR: Could not award points to {user_id}: {e}")
+                users.append({"user_id": user_id, "points_awarded": 0, "error": str(e)})
+
+    if created and settings.GAMIFICATION_ASYNC:
+        invalidate("reports", "table:reports")
+    elif created:
+        invalidate("reports", "table:reports", "table:profiles", "table:user_badges",
+                   *(f"user-badges:{user_id}" for user_id in points_by_user))
+
+    return {
+        "total": len(payload.reports),
+        "created": len(created),
+        "failed": len(payload.reports) - len(created),
+        "results": results,
+        "users": users
+    }
+
+
+@api.get("/gamification/{task_id}")
+def get_gamification_status(request, task_id: int):
+    """
+    Poll the point/badge award for a submitted report
+
+    status is "pending" or "running" until a worker has applied it, then
+    "done" (result holds new_points, new_badges, ...) or "failed" after
+    GAMIFICATION_MAX_ATTEMPTS attempts (see error).
+    """
+    from ninja.errors import HttpError
+    from .models import GamificationTask
+
+    try:
+        task = GamificationTask.objects.get(id=task_id)
+    except GamificationTask.DoesNotExist:
+        raise HttpError(404, "Task not found")
+    return task_status(task)
+
+
+@api.get("/search")
+def search_reports(request, q: Optional[str] = None, geohash: Optional[str] = None,
+                   south: Optional[float] = None, west: Optional[float] = None,
+                   north: Optional[float] = None, east: Optional[float] = None,
+                   since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   page: int = 1, page_size: int = 20):
+    """
+    Search report descriptions
+
+    Keywords in `q` must all match (`word*` for a prefix) and results are
+    ranked by BM25; without `q` the newest reports come first. Narrow by
+    area with a `geohash` prefix or a south/west/north/east box, and by
+    time with `since`/`until` (ISO datetimes). `has_more` says whether
+    another page exists.
+    """
+    from django.conf import settings
+    from ninja.errors import HttpError
+    from .report_feed import GEOHASH_CHARS
+
+    box = (south, west, north, east)
+    if any(v is not None for v in box) and (any(v is None for v in box) or south > north or west > east):
+        raise HttpError(400, "Invalid bounding box")
+    if geohash is not None and (not geohash or not set(geohash.lower()) <= GEOHASH_CHARS):
+        raise HttpError(400, "Invalid geohash")
+    page_size = max(1, min(page_size, settings.REPORT_SEARCH_MAX_PAGE_SIZE))  # as search() clamps it
+    if page < 1 or (page - 1) * page_size >= settings.REPORT_SEARCH_MAX_RESULTS:
+        raise HttpError(400, f"Only the first {settings.REPORT_SEARCH_MAX_RESULTS} results can be paged through")
+
+    return report_search.search(
+        q,
+        bounds=box if south is not None else None,
+        geohash=geohash.lower() if geohash else None,
+        since=since,
+        until=until,
+        page=page,
+        page_size=page_size,
+    )
+
+
+@api.get("/neighborhoods/activity")
+def get_neighborhood_activity(request, granularity: str = "day", since: Optional[datetime] = None,
+                              until: Optional[datetime] = None, neighborhood: Optional[str] = None,
+                              limit: int = 10):
+    """
+    Reports per neighborhood over time (dashboard)
+
+    Reads only the hourly/daily rollups. Defaults to the last 48 hours for
+    `granularity=hour` and the last 30 days for `granularity=day`; returns
+    the `limit` busiest neighborhoods with their per-bucket counts.
+    """
+    from datetime import timezone as dt_timezone
+    from ninja.errors import HttpError
+
+    if granularity not in ("hour", "day"):
+        raise HttpError(400, "granularity must be 'hour' or 'day'")
+    default_since, default_until = report_rollups.default_window(granularity)
+    since = since or default_since
+    until = until or default_until
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=dt_timezone.utc)
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=dt_timezone.utc)
+    if since >= until:
+        raise HttpError(400, "since must be before until")
+
+    return report_rollups.activity(granularity, since, until, neighborhood, max(1, min(limit, 200)))
+
+
+def _user_reports_watermark(request, user_id: str):
+    """(report count, latest created_at) for a user"""
+    result = _get_supabase().table("reports")\
+        .select("created_at", count="exact")\
+        .eq("user_id", user_id)\
+        .order("created_at", desc=True)\
+        .limit(1)\
+        .execute()
+    return result.count, result.data[0]["created_at"] if result.data else None
+
+
 @api.get("/user/{user_id}", response=GetReportsResponse)
+@conditional_route(_user_reports_watermark)
 def get_user_reports(request, user_id: str):
     """
     Get all reports submitted by a specific user
     """
 
+    supabase = _get_supabase()
     result = supabase.table("reports")\
         .select("*")\
         .eq("user_id", user_id)\
@@ -130,11 +447,13 @@ def get_user_reports(request, user_id: str):
 
 
 @api.get("/recent", response=List[ReportResponse])
+@cached_route(ttl=15, tags=("reports",))
 def get_recent_reports(request, limit: int = 20):
     """
     Get recent reports from all users
     """
 
+    supabase = _get_supabase()
     result = supabase.table("reports")\
         .select("*")\
         .order("created_at", desc=True)\
@@ -149,38 +468,33 @@ def get_nearby_reports(request, lat: float, lon: float, radius_km: float = 1.0):
     """
     Get reports near a specific location
 
-    Note: This is a simple implementation. For production, consider using PostGIS.
+    Only id/lat/lon inside the radius' bounding box are loaded (into a
+    columnar store, see columnar.py); full rows are fetched for the matches.
     """
-    import math
-
-    # Get all reports (in production, you'd want to add spatial indexing)
-    result = supabase.table("reports")\
-        .select("*")\
-        .execute()
+    from .auth import iter_table_rows
+    from .columnar import PointColumns
+    from .geo import radius_bbox
+
+    radius_m = radius_km * 1000
+    points = PointColumns.from_rows(
+        ((r["id"], r["lat"], r["lon"], None)
+         for r in iter_table_rows("reports", "id, lat, lon", radius_bbox(lat, lon, radius_m))),
+        "report"
+    )
+    matches = points.within(lat, lon, radius_m)
 
     nearby_reports = []
-
-    if result.data:
-        for report in result.data:
-            # Calculate distance using Haversine formula
-            lat1, lon1 = math.radians(lat), math.radians(lon)
-            lat2, lon2 = math.radians(report["lat"]), math.radians(report["lon"])
-
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            distance_km = 6371 * c  # Earth's radius in km
-
-            if distance_km <= radius_km:
-                nearby_reports.append({
-                    **report,
-                    "distance_km": round(distance_km, 2)
-                })
-
-    # Sort by distance
-    nearby_reports.sort(key=lambda x: x["distance_km"])
+    if matches:
+        supabase = _get_supabase()
+        ids = [points.ids[index] for index, _ in matches]
+        rows = {}
+        for start in range(0, len(ids), 500):
+            result = supabase.table("reports").select("*").in_("id", ids[start:start + 500]).execute()
+            rows.update((row["id"], row) for row in result.data or [])
+        # Matches are already sorted by distance
+        for report_id, (_, distance_m) in zip(ids, matches):
+            if report_id in rows:
+                nearby_reports.append({**rows[report_id], "distance_km": round(distance_m / 1000, 2)})
 
     return {
         "lat": lat,
@@ -189,3 +503,64 @@ def get_nearby_reports(request, lat: float, lon: float, radius_km: float = 1.0):
         "total_reports": len(nearby_reports),
         "reports": nearby_reports
     }
+
+
+@api.get("/heatmap")
+def get_report_heatmap(request, south: float, west: float, north: float, east: float,
+                       zoom: int = 12, days: Optional[int] = None):
+    """
+    Get report counts per geohash cell inside a bounding box
+
+    Cell size follows the map zoom level (geohash precision 4-8).
+    Pass `days` to only count recent reports (daily resolution).
+    """
+    import time
+    from ninja.errors import HttpError
+
+    if south > north or west > east:
+        raise HttpError(400, "Invalid bounding box")
+
+    pyramid = heatmap.get_pyramid()
+    if pyramid is None:
+        raise HttpError(503, "The heatmap is being loaded, retry shortly")
+    precision = heatmap.zoom_to_precision(zoom, pyramid.precisions)
+    since = time.time() - days * 86400 if days is not None else None
+    cells = pyramid.query(south, west, north, east, precision, since)
+
+    return {
+        "precision": precision,
+        "days": days,
+        "total_cells": len(cells),
+        "cells": cells
+    }
+
+
+@api.get("/trending")
+def get_trending_areas(request, kind: str = "neighborhoods", limit: int = 10):
+    """
+    Rank areas by recent reporting activity ("hot spots right now")
+
+    Args:
+        kind: "neighborhoods" or "cells" (geohash cells)
+        limit: Number of areas to return
+
+    Scores decay exponentially (TRENDING_HALF_LIFE); distinct_reporters is
+    a HyperLogLog estimate. warming_up is true while a new server process is
+    still replaying recent reports, so scores may be low.
+    """
+    from ninja.errors import HttpError
+
+    tracker = trending.get_trending_tracker()
+    if kind == "neighborhoods":
+        areas = tracker.top_neighborhoods(limit)
+    elif kind == "cells":
+        areas = tracker.top_cells(limit)
+    else:
+        raise HttpError(400, "kind must be 'neighborhoods' or 'cells'")
+
+    return {
+        "kind": kind,
+        "half_life_seconds": tracker.cells.tau * math.log(2),
+        "warming_up": trending.is_warming_up(),
+        "areas": areas
+    }
@@ -6,12 +6,26 @@ CREATE TABLE IF NOT EXISTS reports (
     lon DOUBLE PRECISION NOT NULL,
     description TEXT NOT NULL,
     image_url TEXT,  -- Optional image URL from Supabase Storage
+    neighborhood TEXT,  -- Resolved from lat/lon when the report is written
+    geohash TEXT,  -- Precision-9 geohash of lat/lon
+    facility_type TEXT,  -- 'hydrants' or 'locations' when the report was snapped to a facility
+    facility_id BIGINT,  -- id of that hydrant/location
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Existing tables: add the tag columns, then run
+-- `python manage.py backfill_report_neighborhoods` to fill them
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS neighborhood TEXT;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS geohash TEXT;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS facility_type TEXT;
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS facility_id BIGINT;
+
 -- Indexes for efficient queries
 CREATE INDEX idx_reports_user_id ON reports(user_id);
 CREATE INDEX idx_reports_created_at ON reports(created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_neighborhood_created ON reports(neighborhood, created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_geohash ON reports(geohash);
+CREATE INDEX IF NOT EXISTS idx_reports_facility ON reports(facility_type, facility_id);
 
 -- Composite index for user's recent reports
 CREATE INDEX idx_reports_user_created ON reports(user_id, created_at DESC);
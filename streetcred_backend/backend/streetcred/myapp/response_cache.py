@@ -0,0 +1,350 @@
+"""
+Per-route response caching for the Ninja APIs
+
+@cached_route stores an endpoint's return value in the Django cache under
+a key built from the request path and sorted query string. Each route
+declares tags (e.g. "reports", "user-badges:{user_id}"); the key also
+includes the current version of every tag, so invalidate("reports") makes
+all keys tagged "reports" unreachable without having to find them. Tag
+versions live in the "route-tags" cache (the database), not in process
+memory, so an invalidation from the gamification worker or another web
+worker reaches every process's cached responses. A version is a random
+token rather than a counter: concurrent invalidations can't lose an update.
+
+A cold key is filled by one request per process: concurrent requests for
+the same key wait for that request's result instead of each hitting
+Supabase (single-flight). A waiter gives up after ROUTE_CACHE_FLIGHT_WAIT
+seconds and runs the view itself, so one hung backend call can't stall
+every request for the key, and each waiter gets its own copy of an
+HttpResponse result (responses are mutated on the way out).
+
+Streamed responses (StreamingHttpResponse) are cached as they are sent:
+the body is copied while it streams and stored once the client has read
+all of it, unless it grows past ROUTE_CACHE_MAX_BYTES. Later hits are
+served from that copy as a plain response. The single flight stays open
+until the stream ends, so concurrent requests wait for the copy (up to
+ROUTE_CACHE_STREAM_WAIT seconds) rather than running the view again.
+
+    @api.get("/recent")
+    @cached_route(ttl=15, tags=("reports",))
+    def get_recent_reports(request, limit: int = 20):
+        ...
+
+@conditional_route answers polling clients' conditional GETs. The route
+supplies a watermark function returning a few cheap values that change
+whenever the body would (latest earned_at / created_at, row count); those
+and the request path/query/Accept hash into a weak ETag (tag versions are
+left out, the watermark alone decides whether the data changed). A request whose If-None-Match carries it
+gets 304 Not Modified without the body being fetched or serialized;
+otherwise the view runs and ConditionalRouteMiddleware adds the ETag to its
+response. The watermark is read before the body, so a write landing in
+between only costs the client one extra full response, never a stale 304.
+Put it above @cached_route: the response cache key includes the ETag, so a
+cached body is never served under a newer watermark.
+
+A watermark that costs a Supabase query can be cached too (ttl=, same tags
+and TTL as the route's @cached_route); a 304 is then never staler than the
+cached body would have been.
+"""
+import copy
+import functools
+import hashlib
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import cache, caches
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+KEY_PREFIX = "route"
+TAG_PREFIX = "route-tag"
+WATERMARK_PREFIX = "route-watermark"
+TAG_CACHE = "route-tags"  # CACHES alias shared by every process
+
+stats = {"hits": 0, "misses": 0, "coalesced": 0, "flight_timeouts": 0, "not_modified": 0}
+
+
+class _Flight:
+    """One in-progress computation that other requests can wait on"""
+
+    __slots__ = ("event", "result", "error", "sent")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.sent = None  # set once a streamed result has been sent; the flight stays open until then
+
+
+class _CachedBody:
+    """A fully streamed response body kept in the cache"""
+
+    __slots__ = ("body", "content_type")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _end_flight(key: str, flight: _Flight):
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+
+def _single_flight(key: str, compute):
+    """
+    Run compute(flight) once per key at a time; concurrent callers share its result
+
+    compute may set flight.sent to an Event to keep the flight open after it
+    returns (a body still streaming); it must then set the event and call
+    _end_flight() once done. A caller that waits longer than
+    ROUTE_CACHE_FLIGHT_WAIT runs compute() itself with a flight of its own.
+
+    Returns:
+        tuple: (result, flight, leader) where leader is True for the caller that ran compute()
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        stats["coalesced"] += 1
+        if flight.event.wait(settings.ROUTE_CACHE_FLIGHT_WAIT):
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, flight, False
+        stats["flight_timeouts"] += 1
+        own = _Flight()  # not registered: nobody waits on it
+        return compute(own), own, True
+
+    try:
+        flight.result = compute(flight)
+        return flight.result, flight, True
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        if flight.sent is None or flight.error is not None:
+            _end_flight(key, flight)
+        flight.event.set()
+
+
+def _tag_key(tag: str) -> str:
+    return f"{TAG_PREFIX}:{tag}"
+
+
+def _tag_versions(tags: list) -> list:
+    if not tags:
+        return []
+    versions = caches[TAG_CACHE].get_many([_tag_key(tag) for tag in tags])
+    return [versions.get(_tag_key(tag), 0) for tag in tags]
+
+
+def invalidate(*tags: str):
+    """Drop every cached response carrying any of these tags, in every process"""
+    if tags:
+        caches[TAG_CACHE].set_many({_tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def _cache_key(request, tags: list) -> str:
+    query = "&".join(f"{k}={v}" for k, values in sorted(request.GET.lists()) for v in values)
+    versions = ",".join(str(v) for v in _tag_versions(tags))
+    accept = request.headers.get("Accept", "")  # JSON and NDJSON bodies share a path
+    etag = getattr(request, "route_etag", "")  # set by @conditional_route
+    raw = f"{request.path}?{query}|{accept}|{versions}|{etag}"
+    return f"{KEY_PREFIX}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def _copy_response(response: HttpResponse) -> HttpResponse:
+    """A response of its own for a request that shares another request's result"""
+    copied = HttpResponse(response.content, status=response.status_code, headers=dict(response.items()))
+    copied.cookies = copy.deepcopy(response.cookies)
+    return copied
+
+
+def _tee(response: StreamingHttpResponse, key: str, timeout: int, done) -> StreamingHttpResponse:
+    """
+    Copy a streamed body while it is sent and cache it once complete
+
+    done() is called once the body has been cached, or when the response is
+    closed without that happening (too large, client gone, error).
+    """
+    chunks = response.streaming_content
+    content_type = response["Content-Type"]
+    limit = settings.ROUTE_CACHE_MAX_BYTES
+
+    def copying():
+        buffer, size = [], 0
+        try:
+            for chunk in chunks:
+                if buffer is not None:
+                    size += len(chunk)
+                    if size > limit:
+                        buffer = None  # too big to cache, keep streaming
+                        done()
+                    else:
+                        buffer.append(chunk)
+                yield chunk
+            if buffer is not None:
+                cache.set(key, _CachedBody(b"".join(buffer), content_type), timeout)
+        finally:
+            done()
+
+    response.streaming_content = copying()
+    response._resource_closers.append(done)  # closed before it was iterated
+    return response
+
+
+def cached_route(ttl: int = None, tags=()):
+    """
+    Cache an endpoint's return value
+
+    Args:
+        ttl: Seconds to keep a response (default ROUTE_CACHE_TTL)
+        tags: Invalidation tags; may reference path parameters, e.g. "user-badges:{user_id}"
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.ROUTE_CACHE_ENABLED or request.method != "GET":
+                return view(request, *args, **kwargs)
+
+            route_tags = [tag.format(**kwargs) for tag in tags]
+            key = _cache_key(request, route_tags)
+            timeout = settings.ROUTE_CACHE_TTL if ttl is None else ttl
+            cached = cache.get(key)
+            if cached is not None:
+                stats["hits"] += 1
+                if isinstance(cached, _CachedBody):
+                    return HttpResponse(cached.body, content_type=cached.content_type)
+                return cached
+
+            def compute(flight):
+                stats["misses"] += 1
+                result = view(request, *args, **kwargs)
+                if isinstance(result, StreamingHttpResponse):
+                    flight.sent = threading.Event()
+
+                    def done():
+                        if not flight.sent.is_set():
+                            _end_flight(key, flight)
+                            flight.sent.set()
+                    return _tee(result, key, timeout, done)
+                if not isinstance(result, HttpResponseBase):
+                    cache.set(key, result, timeout)
+                return result
+
+            result, flight, leader = _single_flight(key, compute)
+            if not leader and isinstance(result, StreamingHttpResponse):
+                # A stream can only be read once: serve the leader's copy once it is cached
+                if flight.sent.wait(settings.ROUTE_CACHE_STREAM_WAIT):
+                    cached = cache.get(key)
+                    if isinstance(cached, _CachedBody):
+                        return HttpResponse(cached.body, content_type=cached.content_type)
+                return view(request, *args, **kwargs)  # too large to cache, or still sending
+            if not leader and isinstance(result, HttpResponse):
+                return _copy_response(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _etag(request, watermark) -> str:
+    query = "&".join(f"{k}={v}" for k, values in sorted(request.GET.lists()) for v in values)
+    accept = request.headers.get("Accept", "")
+    raw = f"{request.path}?{query}|{accept}|{watermark!r}"
+    return f'W/"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+def _etag_matches(request, etag: str) -> bool:
+    """Weak comparison against If-None-Match"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(tag == "*" or tag.removeprefix("W/") == opaque for tag in parse_etags(header))
+
+
+def _watermark_key(request, tags: list) -> str:
+    query = "&".join(f"{k}={v}" for k, values in sorted(request.GET.lists()) for v in values)
+    versions = ",".join(str(v) for v in _tag_versions(tags))
+    raw = f"{request.path}?{query}|{versions}"
+    return f"{WATERMARK_PREFIX}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def conditional_route(watermark, tags=(), ttl: int = None):
+    """
+    Answer If-None-Match from a cheap watermark instead of the full body
+
+    Args:
+        watermark: Called with the view's arguments; returns values (e.g. latest
+            timestamp and row count) that change whenever the body would
+        tags: Invalidation tags that drop a cached watermark
+        ttl: Seconds to cache the watermark (default: read it on every request)
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+            key = None
+            if ttl and settings.ROUTE_CACHE_ENABLED:
+                key = _watermark_key(request, [tag.format(**kwargs) for tag in tags])
+            marks = cache.get(key) if key else None
+            if marks is None:
+                try:
+                    marks = watermark(request, *args, **kwargs)
+                except Exception as e:
+                    print(f"ERROR: Could not read watermark for {request.path}: {e}")
+                    return view(request, *args, **kwargs)
+                if key:
+                    cache.set(key, marks, ttl)
+
+            etag = _etag(request, marks)
+            if _etag_matches(request, etag):
+                stats["not_modified"] += 1
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                return response
+            request.route_etag = etag
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ConditionalRouteMiddleware:
+    """Add the ETag computed by @conditional_route to the rendered response"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.add_etag(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_etag(request, await self.get_response(request))
+
+    def add_etag(self, request, response):
+        etag = getattr(request, "route_etag", None)
+        if etag and response.status_code == 200 and not response.has_header("ETag"):
+            response["ETag"] = etag
+            patch_cache_control(response, private=True, no_cache=True)  # always revalidate
+        return response
@@ -0,0 +1,82 @@
+"""
+Streaming JSON responses for large collections
+
+Rows are pulled from an iterator (a queryset .iterator() or a paged
+Supabase read) and written out in ~64KB chunks, so time to first byte and
+peak memory don't grow with the table. Two formats:
+
+- JSON: the same document shape as the non-streaming endpoints, with the
+  collection written as a chunked array.
+- NDJSON: one JSON object per line (?format=ndjson or
+  Accept: application/x-ndjson).
+
+orjson is used for encoding when it is installed, json otherwise.
+"""
+import json
+from django.http import StreamingHttpResponse
+
+CHUNK_BYTES = 64 * 1024
+
+try:
+    import orjson
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def dumps(value) -> bytes:
+        return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+
+def wants_ndjson(request) -> bool:
+    return request.GET.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", "")
+
+
+def _buffered(pieces):
+    """Join small pieces into chunks of about CHUNK_BYTES"""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _json_document(rows, key: str, head: dict, tail):
+    counter = {"count": 0}
+
+    def pieces():
+        prefix = dumps(head)[:-1] if head else b"{"
+        yield prefix + (b"," if head else b"") + dumps(key) + b":["
+        for i, row in enumerate(rows):
+            yield (b"," if i else b"") + dumps(row)
+            counter["count"] = i + 1
+        trailer = tail(counter["count"]) if tail else {}
+        yield b"]" + b"".join(b"," + dumps(k) + b":" + dumps(v) for k, v in trailer.items()) + b"}"
+
+    return pieces()
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield dumps(row) + b"\n"
+
+
+def stream_collection(request, rows, key: str, head: dict = None, tail=None) -> StreamingHttpResponse:
+    """
+    Stream rows as {**head, key: [rows...], **tail(count)} or as NDJSON
+
+    Args:
+        rows: Iterator of JSON-serializable rows
+        key: Name of the array in the JSON document
+        head: Fields written before the array (known up front)
+        tail: Optional function of the row count returning fields written after the array
+    """
+    if wants_ndjson(request):
+        return StreamingHttpResponse(_buffered(_ndjson_lines(rows)), content_type="application/x-ndjson")
+    return StreamingHttpResponse(
+        _buffered(_json_document(rows, key, head or {}, tail)),
+        content_type="application/json",
+    )
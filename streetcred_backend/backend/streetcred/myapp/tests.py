@@ -1,3 +1,1744 @@
-from django.test import TestCase
+import random
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
-# Create your tests here.
+USER = "30c9d0b1-d84d-43ad-aa72-006cdda9c500"
+OTHER_USER = "8f14e45f-ceea-4e67-a0b5-8f1a2c3d4e5f"
+
+
+class FakeQuery:
+    """The subset of the supabase-py query builder the app uses, over in-memory rows"""
+
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.values = None
+        self.filters = []
+        self.count = None
+        self.ordering = []
+        self.limit_to = None
+        self.window = None
+
+    def select(self, columns="*", count=None):
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.operation, self.values = "insert", rows
+        return self
+
+    def update(self, values):
+        self.operation, self.values = "update", values
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def is_(self, column, value):
+        self.filters.append(lambda row: row.get(column) is None)
+        return self
+
+    def in_(self, column, values):
+        values = {str(v) for v in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] <= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_to = count
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    def execute(self):
+        self.client.calls.append((self.table, self.operation))
+        rows = self.client.tables.setdefault(self.table, [])
+        if self.operation == "insert":
+            created = []
+            for values in self.values if isinstance(self.values, list) else [self.values]:
+                row = {"id": len(rows) + 1, "created_at": timezone.now().isoformat(),
+                       "earned_at": timezone.now().isoformat(), **values}
+                rows.append(row)
+                created.append(row)
+            return SimpleNamespace(data=created, count=None)
+
+        matches = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.operation == "update":
+            for row in matches:
+                row.update(self.values)
+            return SimpleNamespace(data=matches, count=None)
+        count = len(matches) if self.count else None
+        for column, desc in reversed(self.ordering):
+            matches.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self.window:
+            matches = matches[self.window[0]:self.window[1]]
+        if self.limit_to is not None:
+            matches = matches[:self.limit_to]
+        return SimpleNamespace(data=[dict(row) for row in matches], count=count)
+
+
+class FakeSupabase:
+    def __init__(self, **tables):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in tables.items()}
+        self.calls = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+
+def patch_supabase(client: FakeSupabase):
+    return mock.patch("myapp.badge_rewards._get_supabase", return_value=client)
+
+
+class LocationPingBufferTests(TransactionTestCase):
+    """Buffered ping ingestion (myapp.location_ingest)"""
+
+    def make_buffer(self):
+        from myapp.location_ingest import LocationPingBuffer
+
+        return LocationPingBuffer(max_size=100, flush_interval=3600, min_distance_m=0)
+
+    def test_rejects_non_uuid_user_id(self):
+        buffer = self.make_buffer()
+        with self.assertRaises(ValueError):
+            buffer.add("not-a-uuid", 40.7, -74.0)
+        self.assertEqual(buffer.pending_count(), 0)
+
+    def test_bad_row_is_dropped_and_the_rest_written(self):
+        from myapp.models import UserLocation
+
+        buffer = self.make_buffer()
+        buffer.add(USER, 40.70, -74.00, session_id="a")
+        buffer.add(OTHER_USER, 40.71, -74.01, session_id="b")
+        buffer._pending[0].lat = None  # NOT NULL: fails the bulk insert and its own row insert
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(list(UserLocation.objects.values_list("session_id", flat=True)), ["b"])
+        self.assertEqual(buffer.pending_count(), 0)
+        self.assertEqual(buffer.stats["dropped"], 1)
+
+    def test_database_outage_keeps_pings_for_the_next_flush(self):
+        from myapp.models import UserLocation
+
+        buffer = self.make_buffer()
+        buffer.add(USER, 40.70, -74.00, session_id="a")
+        buffer.add(USER, 40.72, -74.02, session_id="a")
+
+        with mock.patch.object(UserLocation.objects, "bulk_create", side_effect=OperationalError("down")), \
+                mock.patch.object(UserLocation, "save", side_effect=OperationalError("down")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.pending_count(), 2)
+        self.assertEqual(UserLocation.objects.count(), 0)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(UserLocation.objects.count(), 2)
+
+    def test_out_of_range_pings_are_rejected(self):
+        ping = {"user_id": USER, "lat": 40.7, "lon": -74.0}
+        with mock.patch("myapp.location_ingest.LocationPingBuffer.add", return_value=True) as add:
+            for bad in ({"lat": 91}, {"lat": -90.5}, {"lon": 180.1}, {"lon": -200}):
+                response = self.client.post("/api/tracking/ping", {**ping, **bad}, content_type="application/json")
+                self.assertEqual(response.status_code, 400, bad)
+
+            batch = {"pings": [ping, {**ping, "lat": 123}]}
+            response = self.client.post("/api/tracking/pings", batch, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            add.assert_not_called()
+
+            response = self.client.post("/api/tracking/ping", {**ping, "lat": 90}, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+
+    def test_moved_location_gets_a_new_geohash(self):
+        import pygeohash as pgh
+        from myapp.geo import geohash_to_int
+        from myapp.models import UserLocation
+
+        location = UserLocation.objects.create(user_id=USER, lat=40.70, lon=-74.00)
+        location.lat, location.lon = 34.05, -118.25
+        location.save()
+        location.refresh_from_db()
+        self.assertEqual(location.geohash, pgh.encode(34.05, -118.25, precision=9))
+        self.assertEqual(location.geokey, geohash_to_int(location.geohash))
+
+
+class GamificationQueueTests(TestCase):
+    """Claiming, retrying and applying queued awards (myapp.gamification_queue)"""
+
+    def setUp(self):
+        cache.clear()
+        self.supabase = FakeSupabase(profiles=[{"user_id": USER, "points": 3}], user_badges=[])
+
+    def test_claimed_tasks_are_not_handed_out_twice_until_the_lease_expires(self):
+        from myapp.gamification_queue import claim, enqueue_report_accepted
+
+        first = enqueue_report_accepted(USER, 40.7, -74.0, [1])
+        second = enqueue_report_accepted(USER, 40.7, -74.0, [2])
+
+        token, tasks = claim(10)
+        self.assertEqual([t.id for t in tasks], [first.id, second.id])
+        self.assertEqual(claim(10), (None, []))
+
+        new_token, reclaimed = claim(10, lease_seconds=-1)  # the first worker died
+        self.assertNotEqual(new_token, token)
+        self.assertEqual([t.attempts for t in reclaimed], [2, 2])
+
+    @override_settings(GAMIFICATION_MAX_ATTEMPTS=3, GAMIFICATION_RETRY_SECONDS=60)
+    def test_retry_after_a_badge_failure_does_not_add_points_twice(self):
+        from myapp.gamification_queue import claim, enqueue_report_accepted, process_batch
+        from myapp.models import GamificationTask
+
+        task = enqueue_report_accepted(USER, 40.7, -74.0, [1], points=2)
+        with patch_supabase(self.supabase), \
+                mock.patch("myapp.badge_rewards.award_badges_for_points", side_effect=Exception("badges down")):
+            counts = process_batch(*claim(10))
+        self.assertEqual(counts["failed"], 1)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, GamificationTask.PENDING)
+        self.assertTrue(task.result["points_applied"])
+        self.assertGreater(task.available_at, timezone.now())
+        self.assertEqual(self.supabase.tables["profiles"][0]["points"], 5)
+
+        GamificationTask.objects.filter(id=task.id).update(available_at=timezone.now())
+        badges = {"new_badges": [], "total_badges": 0, "next_milestone": 10}
+        with patch_supabase(self.supabase), \
+                mock.patch("myapp.badge_rewards.award_badges_for_points", return_value=badges):
+            counts = process_batch(*claim(10))
+        self.assertEqual(counts["done"], 1)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, GamificationTask.DONE)
+        self.assertEqual(task.attempts, 2)
+        self.assertEqual(self.supabase.tables["profiles"][0]["points"], 5)
+
+    def test_points_update_retries_when_the_total_changed(self):
+        from myapp.badge_rewards import add_user_points
+        from myapp.loaders import loader_scope
+
+        with patch_supabase(self.supabase), loader_scope() as loaders:
+            loaders.profiles.load(USER)  # memoized at 3
+            self.supabase.tables["profiles"][0]["points"] = 10  # another worker's award
+            self.assertEqual(add_user_points(USER, 1), (10, 11))
+        self.assertEqual(self.supabase.tables["profiles"][0]["points"], 11)
+
+    def test_worker_invalidation_is_shared_with_the_web_processes(self):
+        from django.core.cache import caches
+        from myapp.gamification_queue import claim, enqueue_report_accepted, process_batch
+
+        def award(user_id, points, lat, lon):
+            self.supabase.tables["user_badges"].append(
+                {"user_id": USER, "milestone": 5, "earned_at": "2026-01-01T00:00:00"})
+            return {"new_badges": [5], "total_badges": 1, "next_milestone": 10}
+
+        path = f"/api/badges/user-badges/{USER}"
+        enqueue_report_accepted(USER, 40.7, -74.0, [1], points=2)
+        with patch_supabase(self.supabase):
+            self.assertEqual(self.client.get(path).json()["total_badges"], 0)  # now cached
+            with mock.patch("myapp.badge_rewards.award_badges_for_points", side_effect=award):
+                process_batch(*claim(10))
+            response = self.client.get(path)
+        self.assertEqual(response.json()["total_badges"], 1)
+
+        # The bump is in the database, not in this process's memory
+        self.assertIsNotNone(caches["route-tags"].get(f"route-tag:user-badges:{USER}"))
+        self.assertIsNone(cache.get(f"route-tag:user-badges:{USER}"))
+
+
+@override_settings(POINT_SNAPSHOT_PATH="/nonexistent/points.snap")
+class NearestIndexTests(TestCase):
+    """KD-tree nearest-neighbour index (myapp.nearest)"""
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.points = {i: (rng.uniform(40.5, 40.9), rng.uniform(-74.25, -73.7)) for i in range(1, 2001)}
+
+    def make_index(self):
+        from myapp.nearest import LayerIndex
+
+        rows = [(i, lat, lon, {"name": f"p{i}"}) for i, (lat, lon) in self.points.items()]
+        index = LayerIndex("test", lambda: rows)
+        index.rebuild()
+        return index
+
+    def brute_force(self, lat, lon, k, max_distance_m=None):
+        from myapp.geo import haversine_m
+
+        distances = sorted((haversine_m(lat, lon, p_lat, p_lon), i) for i, (p_lat, p_lon) in self.points.items())
+        if max_distance_m is not None:
+            distances = [d for d in distances if d[0] <= max_distance_m]
+        return distances[:k]
+
+    def assertMatchesBruteForce(self, index, queries, k=5, max_distance_m=None):
+        for lat, lon in queries:
+            found = index.query(lat, lon, k, max_distance_m)
+            expected = self.brute_force(lat, lon, k, max_distance_m)
+            self.assertEqual([item["id"] for item, _ in found], [i for _, i in expected])
+            for (_, distance), (expected_distance, _) in zip(found, expected):
+                self.assertAlmostEqual(distance, expected_distance, delta=0.01)
+
+    def queries(self, count=50):
+        rng = random.Random(11)
+        return [(rng.uniform(40.5, 40.9), rng.uniform(-74.25, -73.7)) for _ in range(count)]
+
+    def test_knn_matches_brute_force(self):
+        index = self.make_index()
+        self.assertMatchesBruteForce(index, self.queries())
+        self.assertMatchesBruteForce(index, self.queries(), k=20, max_distance_m=1500)
+
+    def test_added_moved_and_removed_points(self):
+        index = self.make_index()
+        self.points[5000] = (40.7, -74.0)
+        index.add(5000, 40.7, -74.0)
+        self.points[1] = (40.7001, -74.0001)  # moved next to the new point
+        index.add(1, 40.7001, -74.0001)
+        del self.points[2]
+        index.remove(2)
+
+        queries = self.queries() + [(40.7, -74.0)]
+        self.assertMatchesBruteForce(index, queries)
+        ids = [item["id"] for item, _ in index.query(40.7, -74.0, 50)]
+        self.assertEqual(len(ids), len(set(ids)))
+
+        index.rebuild()  # the loader still has the old rows
+        self.assertMatchesBruteForce(index, queries)
+
+
+class LoaderTests(TestCase):
+    """Request-scoped batching loaders (myapp.loaders)"""
+
+    def setUp(self):
+        self.supabase = FakeSupabase(
+            profiles=[{"user_id": USER, "points": 7}, {"user_id": OTHER_USER, "points": 1}],
+            user_badges=[{"user_id": USER, "milestone": 5}],
+        )
+
+    def test_prefetched_keys_are_fetched_together_and_memoized(self):
+        from myapp.loaders import loader_scope
+
+        with patch_supabase(self.supabase), loader_scope() as loaders:
+            loaders.profiles.prefetch([USER, OTHER_USER])
+            self.assertEqual(loaders.profiles.load(USER)["points"], 7)
+            self.assertEqual(loaders.profiles.load(OTHER_USER)["points"], 1)
+            self.assertEqual(loaders.profiles.load(USER)["points"], 7)
+            self.assertEqual(loaders.profiles.queries, 1)
+            self.assertEqual(loaders.profiles.stats()["saved"], 2)
+
+            loaders.profiles.prime(USER, {"user_id": USER, "points": 8})
+            self.assertEqual(loaders.profiles.load(USER)["points"], 8)
+            loaders.profiles.clear(USER)
+            self.assertEqual(loaders.profiles.load(USER)["points"], 7)
+            self.assertEqual(loaders.profiles.queries, 2)
+
+    def test_keys_are_canonicalized(self):
+        from myapp.loaders import loader_scope
+
+        with patch_supabase(self.supabase), loader_scope() as loaders:
+            self.assertEqual(loaders.profiles.load(USER.upper())["points"], 7)
+            self.assertEqual(loaders.profiles.load(USER.replace("-", ""))["points"], 7)
+            self.assertEqual(loaders.user_badges.load(USER.upper()), [{"user_id": USER, "milestone": 5}])
+            self.assertEqual(loaders.profiles.queries, 1)
+
+            self.assertIsNone(loaders.profiles.load("nobody"))
+            self.assertEqual(loaders.user_badges.load("nobody"), [])
+            self.assertEqual(loaders.profiles.queries, 1)
+
+    def test_no_scope_means_no_sharing(self):
+        from myapp.loaders import get_loaders
+
+        with patch_supabase(self.supabase):
+            get_loaders().profiles.load(USER)
+            get_loaders().profiles.load(USER)
+        self.assertEqual(self.supabase.calls.count(("profiles", "select")), 2)
+
+    async def test_request_scope_under_asgi(self):
+        from myapp.loaders import get_loader_metrics
+
+        scopes = get_loader_metrics()["scopes"]
+        with patch_supabase(self.supabase):
+            response = await self.async_client.get(f"/api/badges/badge-progress/{USER}")
+        self.assertEqual(response.status_code, 200)
+        # The ETag watermark and the view read the profile through one scope
+        self.assertEqual(self.supabase.calls.count(("profiles", "select")), 1)
+        self.assertEqual(get_loader_metrics()["scopes"], scopes + 1)
+
+
+class ResponseCacheTests(TestCase):
+    """@cached_route and its single-flight (myapp.response_cache)"""
+
+    report = {"id": 1, "user_id": USER, "lat": 40.7, "lon": -74.0, "description": "Pothole",
+              "created_at": "2026-01-01T00:00:00"}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recent_reports_are_cached_until_invalidated(self):
+        from myapp.response_cache import invalidate
+
+        supabase = FakeSupabase(reports=[dict(self.report)])
+        with mock.patch("myapp.reports_api._get_supabase", return_value=supabase):
+            self.assertEqual(len(self.client.get("/api/reports/recent").json()), 1)
+            supabase.tables["reports"].append({**self.report, "id": 2})
+            self.assertEqual(len(self.client.get("/api/reports/recent").json()), 1)
+            self.assertEqual(len(self.client.get("/api/reports/recent?limit=5").json()), 2)  # own key
+
+            invalidate("reports")
+            self.assertEqual(len(self.client.get("/api/reports/recent").json()), 2)
+        self.assertEqual(supabase.calls.count(("reports", "select")), 3)
+
+    def run_concurrently(self, view, count):
+        """Call a @cached_route view from count threads; the first one blocks until the rest are waiting"""
+        import threading
+        from django.test import RequestFactory
+        from myapp.response_cache import cached_route
+
+        release = threading.Event()
+        calls = []
+
+        @cached_route(ttl=60)
+        def blocking(request):
+            calls.append(request)
+            if len(calls) == 1:
+                release.wait(5)
+            return view()
+
+        results = [None] * count
+
+        def call(n):
+            results[n] = blocking(RequestFactory().get("/flight"))
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(count)]
+        threads[0].start()
+        while not calls:
+            threading.Event().wait(0.005)
+        for thread in threads[1:]:
+            thread.start()
+        threading.Event().wait(0.1)  # followers are waiting on the flight
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results, calls
+
+    def test_concurrent_misses_share_one_view_call(self):
+        from django.http import HttpResponse
+
+        results, calls = self.run_concurrently(lambda: HttpResponse(b"body", headers={"X-Test": "1"}), 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.content for r in results], [b"body"] * 4)
+        self.assertEqual([r["X-Test"] for r in results], ["1"] * 4)
+        self.assertEqual(len({id(r) for r in results}), 4)  # each request mutates its own response
+
+    @override_settings(ROUTE_CACHE_FLIGHT_WAIT=0.01)
+    def test_waiters_give_up_on_a_slow_leader(self):
+        results, calls = self.run_concurrently(lambda: {"ok": True}, 3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(results, [{"ok": True}] * 3)
+
+
+class ConditionalRouteTests(TestCase):
+    """ETags and 304s on polled endpoints (myapp.response_cache)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_locations_etag(self):
+        from myapp.models import Location
+        from myapp.response_cache import invalidate
+
+        Location.objects.create(name="Pier", lat=40.70, lon=-74.00)
+        response = self.client.get("/api/locations")
+        etag = response["ETag"]
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        self.assertEqual(self.client.get("/api/locations", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        invalidate("locations")  # tag versions don't change the ETag
+        self.assertEqual(self.client.get("/api/locations", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Location.objects.create(name="Dock", lat=40.71, lon=-74.01)
+        response = self.client.get("/api/locations", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    async def test_locations_etag_under_asgi(self):
+        from myapp.models import Location
+
+        await Location.objects.acreate(name="Pier", lat=40.70, lon=-74.00)
+        response = await self.async_client.get("/api/locations")
+        etag = response["ETag"]
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = await self.async_client.get("/api/locations", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_user_badges_watermark_is_cached_until_invalidated(self):
+        from myapp.response_cache import invalidate
+
+        supabase = FakeSupabase(user_badges=[{"user_id": USER, "milestone": 5, "earned_at": "2026-01-01T00:00:00"}])
+        path = f"/api/badges/user-badges/{USER}"
+        with patch_supabase(supabase):
+            etag = self.client.get(path)["ETag"]
+            supabase.calls.clear()
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(supabase.calls, [])
+
+            supabase.tables["user_badges"].append(
+                {"user_id": USER, "milestone": 10, "earned_at": "2026-01-02T00:00:00"})
+            invalidate(f"user-badges:{USER}")
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_badges"], 2)
+
+
+class LocationArchiveTests(TestCase):
+    """Archiving old user_locations (myapp.location_archive)"""
+
+    day = date(2026, 1, 5)
+
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        override = override_settings(LOCATION_ARCHIVE_DIR=self.archive_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def add_pings(self, count, start_minute=0):
+        from myapp.models import UserLocation
+
+        start = datetime(2026, 1, 5, 9, tzinfo=dt_timezone.utc)
+        for n in range(start_minute, start_minute + count):
+            # Zig-zag so every point is kept by the simplification
+            UserLocation.objects.create(user_id=USER, session_id="walk", lat=40.70 + 0.001 * n,
+                                        lon=-74.00 + 0.001 * (n % 2), created_at=start + timedelta(minutes=n))
+
+    def archived_ids(self):
+        from myapp.location_archive import ID, read_day
+
+        tracks = read_day(self.day)
+        self.assertEqual(len(tracks), 1)
+        return [point[ID] for point in tracks[0]["points"]], tracks[0]["raw_points"]
+
+    def test_rerun_after_interrupted_delete_merges_without_duplicates(self):
+        from django.db.models.query import QuerySet
+        from myapp.location_archive import archive_day, load_history
+        from myapp.models import UserLocation
+
+        self.add_pings(4)
+        with mock.patch.object(QuerySet, "delete", side_effect=OperationalError("killed")):
+            with self.assertRaises(OperationalError):
+                archive_day(self.day, tolerance_m=0)
+        self.assertEqual(UserLocation.objects.count(), 4)
+        ids, raw_points = self.archived_ids()
+        self.assertEqual((len(ids), raw_points), (4, 4))
+
+        # Readers see each point once while rows and archive overlap
+        start = datetime(2026, 1, 5, tzinfo=dt_timezone.utc)
+        sessions = load_history(USER, start, start + timedelta(days=1))
+        self.assertEqual(len(sessions[0]["points"]), 4)
+
+        self.add_pings(2, start_minute=4)
+        result = archive_day(self.day, tolerance_m=0)
+        self.assertEqual(result["deleted"], 6)
+        self.assertEqual(UserLocation.objects.count(), 0)
+        ids, raw_points = self.archived_ids()
+        self.assertEqual((len(ids), len(set(ids)), raw_points), (6, 6, 6))
+
+
+class ProfilingTests(TestCase):
+    """Stack-sampled request profiles (myapp.profiling)"""
+
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        override = override_settings(PROFILING_ENABLED=True, PROFILING_TOKEN="secret", PROFILING_SAMPLE_RATE=0,
+                                     PROFILING_INTERVAL_MS=1, PROFILING_DIR=self.profile_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.supabase = FakeSupabase(profiles=[{"user_id": USER, "points": 7}])
+
+    def slow_milestone(self, points):
+        import time
+
+        time.sleep(0.05)
+        return 10
+
+    def assertViewSampled(self, response):
+        from myapp.profiling import load_profile
+
+        profile = load_profile(response["X-Profile-Id"])
+        self.assertGreater(profile["samples"], 0)
+        self.assertTrue(any("get_badge_progress" in stack for stack in profile["stacks"]))
+
+    def test_requests_without_the_token_are_not_profiled(self):
+        with patch_supabase(self.supabase):
+            response = self.client.get(f"/api/badges/badge-progress/{USER}", headers={"X-Profile": "wrong"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("X-Profile-Id"))
+
+    def test_profile_samples_the_view(self):
+        with patch_supabase(self.supabase), \
+                mock.patch("myapp.badge_rewards.get_next_milestone", side_effect=self.slow_milestone):
+            response = self.client.get(f"/api/badges/badge-progress/{USER}", headers={"X-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertViewSampled(response)
+
+    async def test_profile_samples_the_view_under_asgi(self):
+        with patch_supabase(self.supabase), \
+                mock.patch("myapp.badge_rewards.get_next_milestone", side_effect=self.slow_milestone):
+            response = await self.async_client.get(f"/api/badges/badge-progress/{USER}",
+                                                   headers={"X-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertViewSampled(response)
+
+
+class ReportFeedTests(TestCase):
+    """Live report fan-out (myapp.report_feed)"""
+
+    report = {"id": 1, "lat": 40.7128, "lon": -74.0060, "category": "pothole"}  # geohash dr5regw3p
+
+    async def test_publish_reaches_subscribers_of_containing_areas(self):
+        import asyncio
+        from myapp.report_feed import ReportBroker
+
+        broker = ReportBroker()
+        near, wide, elsewhere = broker.subscribe("dr5reg"), broker.subscribe("dr5"), broker.subscribe("9q8y")
+        delivered = await asyncio.to_thread(broker.publish, self.report)  # publishers run in view threads
+        self.assertEqual(delivered, 2)
+
+        for subscription in (near, wide):
+            event = await asyncio.wait_for(anext(subscription.events(keepalive=5)), 1)
+            self.assertIn(b'"geohash": "dr5regw3p', event)
+        self.assertTrue(elsewhere.queue.empty())
+
+    async def test_slow_subscriber_is_disconnected_with_overflow(self):
+        import asyncio
+        from myapp.report_feed import ReportBroker
+
+        broker = ReportBroker(max_queue=2, max_dropped=3)
+        subscription = broker.subscribe("dr5")
+        for n in range(6):
+            broker.publish({**self.report, "id": n})
+        await asyncio.sleep(0)  # let the queued offers run
+
+        events = [event async for event in subscription.events(keepalive=5)]
+        self.assertEqual(events, [b"event: overflow\ndata: {}\n\n"])
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    async def test_stream_view_under_asgi(self):
+        import asyncio
+        from myapp.report_feed import get_report_broker
+
+        response = await self.async_client.get("/api/reports/stream/", {"lat": 40.7128, "lon": -74.0060})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        get_report_broker().publish(self.report)
+        event = await asyncio.wait_for(anext(stream), 1)
+        self.assertTrue(event.startswith(b"event: report\n"))
+        await stream.aclose()
+
+        response = await self.async_client.get("/api/reports/stream/", {"area": "dr5a"})
+        self.assertEqual(response.status_code, 400)
+
+
+def _read_fields(data: bytes):
+    """(field number, value) pairs of a protobuf message; length-delimited values stay bytes"""
+    import struct
+
+    def varint(pos):
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            value |= (byte & 0x7F) << shift
+            pos, shift = pos + 1, shift + 7
+            if byte < 0x80:
+                return value, pos
+
+    pos = 0
+    while pos < len(data):
+        key, pos = varint(pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = varint(pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        else:
+            length, pos = varint(pos)
+            value, pos = data[pos:pos + length], pos + length
+        yield number, value
+
+
+def decode_tile(data: bytes) -> dict:
+    """{layer: [(id, x, y, properties)]} of an MVT tile of points"""
+    def unzigzag(n):
+        return (n >> 1) ^ -(n & 1)
+
+    def packed(blob):
+        values, pos = [], 0
+        while pos < len(blob):
+            value = shift = 0
+            while True:
+                byte = blob[pos]
+                value |= (byte & 0x7F) << shift
+                pos, shift = pos + 1, shift + 7
+                if byte < 0x80:
+                    break
+            values.append(value)
+        return values
+
+    tile = {}
+    for _, layer in _read_fields(data):
+        fields = list(_read_fields(layer))
+        keys = [v.decode() for n, v in fields if n == 3]
+        values = [next(v for _, v in _read_fields(blob)) for n, blob in fields if n == 4]
+        values = [v.decode() if isinstance(v, bytes) else v for v in values]
+        features = []
+        for n, blob in fields:
+            if n != 2:
+                continue
+            feature = dict(_read_fields(blob))
+            tags = packed(feature.get(2, b""))
+            command, x, y = packed(feature[4])
+            assert command == 9 and feature[3] == 1  # one MoveTo, POINT
+            properties = {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)}
+            features.append((feature.get(1), unzigzag(x), unzigzag(y), properties))
+        tile[next(v.decode() for n, v in fields if n == 1)] = features
+    return tile
+
+
+class MapTileTests(TestCase):
+    """Vector tile encoding and region invalidation (myapp.tiles)"""
+
+    z, x, y = 14, 4823, 6160  # lower Manhattan
+    pier = (40.7128, -74.0060)
+
+    def setUp(self):
+        import myapp.tiles
+
+        self.tile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tile_dir.cleanup)
+        override = override_settings(TILE_CACHE_DIR=self.tile_dir.name, TILE_EXTERNAL_CHECK_SECONDS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.supabase = FakeSupabase(hydrants=[{"id": 1, "lat": 40.7130, "lon": -74.0050}], reports=[])
+        for target in ("myapp.tiles.get_supabase_client", "myapp.auth.get_supabase_client"):
+            patcher = mock.patch(target, return_value=self.supabase)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        myapp.tiles._watermarks.clear()
+
+    def test_encode_tile(self):
+        from myapp.tiles import TILE_EXTENT, encode_tile
+
+        data = encode_tile(self.z, self.x, self.y, {
+            "locations": [(7, *self.pier, {"name": "Pier"}), (8, 10.0, 10.0, {"name": "Elsewhere"})],
+            "hydrants": [("H-12", 40.7130, -74.0050, {})],
+        })
+        tile = decode_tile(data)
+        self.assertEqual(sorted(tile), ["hydrants", "locations"])
+
+        (feature_id, px, py, properties), = tile["locations"]  # the point outside the tile is left out
+        self.assertEqual((feature_id, properties), (7, {"name": "Pier"}))
+        self.assertTrue(0 <= px < TILE_EXTENT and 0 <= py < TILE_EXTENT)
+        self.assertEqual(tile["hydrants"][0][0], None)  # non-integer ids become a property
+        self.assertEqual(tile["hydrants"][0][3], {"id": "H-12"})
+
+    def test_tile_is_rebuilt_only_when_its_area_changes(self):
+        from myapp.models import Location
+        from myapp.tiles import get_tile
+
+        layers = ("locations",)
+        Location.objects.create(name="Pier", lat=self.pier[0], lon=self.pier[1])
+        data, etag = get_tile(self.z, self.x, self.y, layers)
+        self.assertEqual([f[3] for f in decode_tile(data)["locations"]], [{"name": "Pier"}])
+
+        with mock.patch.dict("myapp.tiles.LAYER_LOADERS", locations=mock.Mock(side_effect=AssertionError)):
+            Location.objects.create(name="Elsewhere", lat=34.05, lon=-118.25)
+            self.assertEqual(get_tile(self.z, self.x, self.y, layers), (data, etag))  # served from disk
+
+        Location.objects.create(name="Dock", lat=40.7125, lon=-74.0065)
+        data, new_etag = get_tile(self.z, self.x, self.y, layers)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(len(decode_tile(data)["locations"]), 2)
+
+    def test_hydrant_tiles_follow_the_hydrants_table(self):
+        from myapp.tiles import get_tile, invalidate_layer
+
+        layers = ("hydrants",)
+        data, etag = get_tile(self.z, self.x, self.y, layers)
+        self.assertEqual(len(decode_tile(data)["hydrants"]), 1)
+
+        self.supabase.tables["hydrants"].append({"id": 2, "lat": 40.7126, "lon": -74.0058})
+        data, etag = get_tile(self.z, self.x, self.y, layers)
+        self.assertEqual(len(decode_tile(data)["hydrants"]), 2)
+
+        self.supabase.tables["hydrants"][0].update(lat=34.05, lon=-118.25)  # moved in place: same count and ids
+        self.assertEqual(get_tile(self.z, self.x, self.y, layers)[1], etag)
+        invalidate_layer("hydrants")
+        data, new_etag = get_tile(self.z, self.x, self.y, layers)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(len(decode_tile(data)["hydrants"]), 1)
+
+    def test_tile_endpoint_revalidates(self):
+        path = f"/api/tiles/{self.z}/{self.x}/{self.y}.mvt"
+        response = self.client.get(path, {"layers": "locations"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("must-revalidate", response["Cache-Control"])
+
+        response = self.client.get(path, {"layers": "locations"}, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(path, {"layers": "nope"}).status_code, 400)
+
+
+class HeatmapTests(TestCase):
+    """Report density pyramid and its snapshot (myapp.heatmap)"""
+
+    now = datetime(2026, 3, 10, 12, tzinfo=dt_timezone.utc).timestamp()
+
+    def setUp(self):
+        import myapp.heatmap as heatmap
+
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.snapshot_dir.cleanup)
+        self.path = f"{self.snapshot_dir.name}/heatmap.bin"
+        override = override_settings(HEATMAP_SNAPSHOT_PATH=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name, value in {"_pyramid": None, "_pyramid_mtime": None, "_loading": False, "_recorded": None}.items():
+            patcher = mock.patch.object(heatmap, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.supabase = FakeSupabase(reports=[
+            {"id": n, "lat": 40.7128, "lon": -74.0060, "created_at": self.now - n * 86400} for n in range(1, 4)
+        ])
+        patcher = mock.patch("myapp.auth.get_supabase_client", return_value=self.supabase)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counts(self, pyramid, precision=6, days=None):
+        since = self.now - days * 86400 if days is not None else None
+        return sum(cell["count"] for cell in pyramid.query(40.70, -74.02, 40.72, -73.99, precision, since))
+
+    def wait_for_pyramid(self):
+        import time
+        from myapp.heatmap import get_pyramid
+
+        for _ in range(200):
+            pyramid = get_pyramid()
+            if pyramid is not None:
+                return pyramid
+            time.sleep(0.01)
+        self.fail("the heatmap snapshot was never loaded")
+
+    def test_query_counts_and_time_buckets(self):
+        from myapp.heatmap import DensityPyramid
+
+        rows = [(40.7128, -74.0060, self.now - n * 86400) for n in range(5)] + [(34.05, -118.25, self.now)]
+        pyramid = DensityPyramid.build(rows, precisions=(4, 6), bucket_count=3)
+        self.assertEqual(self.counts(pyramid), 5)
+        self.assertEqual(self.counts(pyramid, precision=4), 5)
+        self.assertEqual(self.counts(pyramid, days=1), 2)  # today and yesterday's buckets
+
+        pyramid.add(40.7128, -74.0060, self.now)
+        self.assertEqual(self.counts(pyramid, days=0), 2)
+        pyramid.save(self.path)
+        self.assertEqual(self.counts(DensityPyramid.load(self.path)), 6)
+
+    def test_snapshot_is_loaded_outside_the_request(self):
+        import threading
+        import myapp.heatmap as heatmap
+        from myapp.heatmap import load_snapshot, rebuild_pyramid
+
+        rebuild_pyramid()  # counts reports 1-3
+        self.supabase.tables["reports"].append({"id": 4, "lat": 40.7128, "lon": -74.0060, "created_at": self.now})
+        release = threading.Event()
+
+        def slow_load(path):
+            release.wait(5)
+            return load_snapshot(path)  # replays report 4
+
+        with mock.patch("myapp.heatmap.load_snapshot", side_effect=slow_load):
+            response = self.client.get("/api/reports/heatmap",
+                                       {"south": 40.70, "west": -74.02, "north": 40.72, "east": -73.99})
+            self.assertEqual(response.status_code, 503)  # answered while the load waits
+
+            heatmap.record_report(40.7128, -74.0060, self.now, report_id=4)  # already in the table
+            heatmap.record_report(40.7128, -74.0060, self.now, report_id=5)  # committed after the replay
+            release.set()
+            pyramid = self.wait_for_pyramid()
+        self.assertEqual(self.counts(pyramid), 5)
+
+        response = self.client.get("/api/reports/heatmap",
+                                   {"south": 40.70, "west": -74.02, "north": 40.72, "east": -73.99, "zoom": 14})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(cell["count"] for cell in response.json()["cells"]), 5)
+
+
+class FacilityImportTests(TestCase):
+    """Batched geohashing and streamed facility imports (myapp.geohash_codec, import_facilities)"""
+
+    def test_encode_batch_matches_pygeohash(self):
+        import pygeohash as pgh
+        from myapp.geohash_codec import encode_batch
+
+        rng = random.Random(31)
+        lats = [rng.uniform(-90, 90) for _ in range(500)] + [90.0, -90.0, 0.0]
+        lons = [rng.uniform(-180, 180) for _ in range(500)] + [180.0, -180.0, 0.0]
+        for precision in (1, 5, 9, 12):
+            self.assertEqual(encode_batch(lats, lons, precision=precision),
+                             [pgh.encode(lat, lon, precision=precision) for lat, lon in zip(lats, lons)])
+
+    def test_feature_collection_is_streamed(self):
+        import json
+        import os
+        from myapp.management.commands.import_facilities import _iter_geojson
+
+        features = [{"type": "Feature", "properties": {"name": f"H{n}", "note": "x" * n},
+                     "geometry": {"type": "Point", "coordinates": [-74.0 + n / 1000, 40.7 + n / 1000]}}
+                    for n in range(40)]
+        features.insert(3, {"type": "Feature", "properties": {}, "geometry": {"type": "LineString",
+                                                                             "coordinates": [[0, 0], [1, 1]]}})
+        collection = {"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+                      "features": features, "totalFeatures": 123456}
+        with tempfile.NamedTemporaryFile("w", suffix=".geojson", delete=False) as f:
+            json.dump(collection, f, indent=1)
+        self.addCleanup(os.unlink, f.name)
+
+        expected = [(f"H{n}", 40.7 + n / 1000, -74.0 + n / 1000) for n in range(40)]
+        expected.insert(3, (None, None, None))
+        for chunk_size in (7, 64, 1 << 16):  # values split across reads, including the trailing number
+            self.assertEqual(list(_iter_geojson(f.name, "name", chunk_size=chunk_size)), expected)
+
+        os.truncate(f.name, 200)  # cut off inside a feature
+        with self.assertRaises(ValueError):
+            list(_iter_geojson(f.name, "name", chunk_size=7))
+
+    def test_import_command(self):
+        import json
+        import os
+        import pygeohash as pgh
+        from io import StringIO
+        from django.core.management import call_command
+        from myapp.models import Location
+
+        collection = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"name": "Pier"},
+             "geometry": {"type": "Point", "coordinates": [-74.006, 40.7128]}},
+            {"type": "Feature", "properties": {},
+             "geometry": {"type": "Point", "coordinates": [-73.99, 40.73]}},
+            {"type": "Feature", "properties": {"name": "Nowhere"},
+             "geometry": {"type": "Point", "coordinates": [-200, 40.73]}},
+        ]}
+        with tempfile.NamedTemporaryFile("w", suffix=".geojson", delete=False) as f:
+            json.dump(collection, f)
+        self.addCleanup(os.unlink, f.name)
+
+        call_command("import_facilities", f.name, stdout=StringIO())
+        rows = sorted(Location.objects.values_list("name", "geohash"))
+        self.assertEqual(rows, [("Fire Hydrant", pgh.encode(40.73, -73.99, precision=9)),
+                                ("Pier", pgh.encode(40.7128, -74.006, precision=9))])
+
+
+class NeighborhoodIndexTests(TestCase):
+    """Polygon neighborhood lookup (myapp.neighborhoods)"""
+
+    def make_index(self):
+        from myapp.neighborhoods import NeighborhoodIndex, PreparedPolygon
+
+        # An L-shaped polygon whose bounding box covers a small square it doesn't contain
+        l_shape = [[(0, 0), (4, 0), (4, 1), (1, 1), (1, 4), (0, 4), (0, 0)]]
+        square = [[(2, 2), (3, 2), (3, 3), (2, 3), (2, 2)]]
+        inner = [[(0.2, 0.2), (0.6, 0.2), (0.6, 0.6), (0.2, 0.6), (0.2, 0.2)]]  # overlaps the L
+        polygons = [PreparedPolygon("L", l_shape), PreparedPolygon("Square", square), PreparedPolygon("Inner", inner)]
+        return NeighborhoodIndex(polygons, cell_degrees=0.25)
+
+    def brute_force(self, index, lat, lon):
+        containing = [p for p in index.polygons if p.contains(lon, lat)]
+        if not containing:
+            return None
+        return min(containing, key=lambda p: (p.bbox[2] - p.bbox[0]) * (p.bbox[3] - p.bbox[1])).name
+
+    def test_lookup_matches_brute_force(self):
+        index = self.make_index()
+        rng = random.Random(3)
+        points = [(rng.uniform(-1, 5), rng.uniform(-1, 5)) for _ in range(2000)]
+        expected = [self.brute_force(index, lat, lon) for lat, lon in points]
+        self.assertEqual([index.lookup(lat, lon) for lat, lon in points], expected)
+        self.assertEqual(index.lookup_many([lat for lat, _ in points], [lon for _, lon in points]), expected)
+        self.assertEqual(index.lookup(2.5, 2.5), "Square")
+        self.assertEqual(index.lookup(3.5, 3.5), None)  # inside the L's bounding box only
+        self.assertEqual(index.lookup(0.4, 0.4), "Inner")  # smallest containing polygon wins
+
+    def test_nyc_boundaries(self):
+        from myapp.cities import city_for, find_neighborhood, lookup_many
+
+        self.assertEqual(find_neighborhood(40.7168, -74.009), "Tribeca")
+        self.assertEqual(find_neighborhood(40.758, -73.9855), "Times Square")
+        self.assertEqual(find_neighborhood(40.6782, -73.9442), "Crown Heights")
+        self.assertIsNone(city_for(40.0, -74.0))
+        self.assertIsNone(find_neighborhood(40.0, -74.0))
+        self.assertEqual(lookup_many([40.7168, 40.0], [-74.009, -74.0]), ["Tribeca", None])
+
+
+class TrendingTests(TestCase):
+    """Decayed heavy hitters and distinct-reporter estimates (myapp.trending)"""
+
+    def test_distinct_reporter_estimate(self):
+        from myapp.trending import HyperLogLog
+
+        for count in (10, 500, 20000):
+            hll = HyperLogLog()
+            for n in range(count):
+                hll.add(f"user-{n}")
+                hll.add(f"user-{n}")  # repeats don't count
+            self.assertAlmostEqual(hll.estimate(), count, delta=max(2, count * 0.1))
+
+    def test_scores_decay_and_stay_bounded(self):
+        from myapp.trending import DecayedTopK
+
+        start = 1_000_000.0
+        top = DecayedTopK(capacity=4, half_life=100)
+        top.landmark = start
+        for n in range(8):
+            top.add("hot", reporter=f"u{n % 3}", timestamp=start)
+        top.add("warm", timestamp=start)
+        for n in range(10):
+            top.add(f"noise-{n}", timestamp=start + 100)
+
+        self.assertEqual(len(top), 4)
+        ranked = top.top(limit=4, now=start + 100)
+        self.assertEqual(ranked[0]["key"], "hot")
+        self.assertAlmostEqual(ranked[0]["score"], 4.0, places=2)  # one half-life later
+        self.assertEqual(ranked[0]["error"], 0.0)
+        self.assertEqual(ranked[0]["distinct_reporters"], 3)
+        for entry in ranked[1:]:
+            self.assertGreaterEqual(entry["score"] - entry["error"], 0)  # error bounds the overcount
+
+        later = start + 100 * 60  # far enough to rescale the stored scores
+        top.add("hot", timestamp=later)
+        self.assertAlmostEqual(top.top(limit=1, now=later)[0]["score"], 1.0, places=2)
+        self.assertAlmostEqual(top.top(limit=1, now=later + 100)[0]["score"], 0.5, places=2)
+
+    def test_replay_counts_each_report_once(self):
+        import threading
+        import time
+        import myapp.trending as trending
+        from myapp.auth import iter_table_rows
+
+        for name in ("_tracker", "_warming"):
+            patcher = mock.patch.object(trending, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        now = timezone.now()
+        supabase = FakeSupabase(reports=[
+            {"id": n, "user_id": USER, "lat": 40.7168, "lon": -74.009, "created_at": now.isoformat()}
+            for n in range(1, 4)
+        ])
+        release = threading.Event()
+
+        def slow_rows(*args, **kwargs):
+            release.wait(5)
+            yield from iter_table_rows(*args, **kwargs)
+
+        with mock.patch("myapp.auth.get_supabase_client", return_value=supabase), \
+                mock.patch("myapp.auth.iter_table_rows", side_effect=slow_rows):
+            response = self.client.get("/api/reports/trending")
+            self.assertTrue(response.json()["warming_up"])
+
+            trending.record_report(40.7168, -74.009, USER, report_id=3)  # already in the table
+            trending.record_report(40.7168, -74.009, OTHER_USER, report_id=4)  # inserted after the replay read
+            release.set()
+            for _ in range(200):
+                if not trending.is_warming_up():
+                    break
+                time.sleep(0.01)
+
+        response = self.client.get("/api/reports/trending")
+        body = response.json()
+        self.assertFalse(body["warming_up"])
+        self.assertEqual(body["areas"][0]["key"], "Tribeca")
+        self.assertAlmostEqual(body["areas"][0]["score"], 4.0, places=1)
+        self.assertEqual(body["areas"][0]["distinct_reporters"], 2)
+
+
+class GeokeyTests(TestCase):
+    """Integer geohash keys and radius lookups over key ranges (myapp.geo, GeoQuerySet)"""
+
+    def test_key_ranges_cover_the_box(self):
+        from myapp.geo import bbox_key_ranges, geohash_to_int, geokey, int_to_geohash
+
+        self.assertEqual(int_to_geohash(geohash_to_int("dr5regw3p"), 9), "dr5regw3p")
+        self.assertLess(geohash_to_int("dr5r0000"), geohash_to_int("dr5rzzzz"))
+
+        rng = random.Random(5)
+        for south, west, north, east in [(40.70, -74.02, 40.72, -73.99), (40.5, -74.3, 40.9, -73.7),
+                                         (40.7127, -74.0061, 40.7129, -74.0059)]:
+            ranges = bbox_key_ranges(south, west, north, east)
+            self.assertLessEqual(len(ranges), 16)
+            self.assertEqual(ranges, sorted(ranges))
+            for _ in range(500):
+                key = geokey(rng.uniform(south, north), rng.uniform(west, east))
+                self.assertTrue(any(low <= key < high for low, high in ranges))
+
+    def test_within_radius_matches_brute_force(self):
+        from myapp.geo import haversine_m
+        from myapp.models import Location
+
+        rng = random.Random(9)
+        Location.objects.bulk_create(
+            Location(name=f"p{n}", lat=rng.uniform(40.70, 40.73), lon=rng.uniform(-74.02, -73.98)) for n in range(400)
+        )
+        self.assertFalse(Location.objects.filter(geokey__isnull=True).exists())
+
+        center = (40.715, -74.0)
+        for radius in (50, 300, 1500):
+            found = Location.objects.within_radius(*center, radius)
+            expected = sorted(
+                (haversine_m(*center, loc.lat, loc.lon), loc.id) for loc in Location.objects.all()
+                if haversine_m(*center, loc.lat, loc.lon) <= radius
+            )
+            self.assertEqual([loc.id for loc, _ in found], [i for _, i in expected])
+
+        response = self.client.get("/api/locations/nearby", {"lat": center[0], "lon": center[1], "radius": 300})
+        self.assertEqual(response.status_code, 200)
+        distances = [loc["distance"] for loc in response.json()]
+        self.assertTrue(distances)
+        self.assertEqual(distances, sorted(distances))
+        self.assertTrue(all(d <= 300 for d in distances))
+        response = self.client.get("/api/locations/nearby", {"lat": 95, "lon": 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class SQLiteProfileTests(TransactionTestCase):
+    """SQLite performance profile and read routing (SQLITE_PERFORMANCE, myapp.db_router)"""
+
+    def test_reads_go_to_the_replica_outside_write_transactions(self):
+        from django.db import transaction
+        from myapp.db_router import ReadReplicaRouter
+        from myapp.models import Location
+
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Location), "replica")
+        self.assertEqual(router.db_for_write(Location), "default")
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Location), "default")  # sees its own uncommitted rows
+        self.assertTrue(router.allow_migrate("default", "myapp"))
+        self.assertFalse(router.allow_migrate("replica", "myapp"))
+
+    def test_writer_and_read_only_connections(self):
+        from pathlib import Path
+        from django.conf import settings
+        from django.db.utils import ConnectionHandler
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "db.sqlite3"
+        handler = ConnectionHandler({
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": path,
+                        "OPTIONS": {"init_command": settings.SQLITE_WRITE_PRAGMAS, "transaction_mode": "IMMEDIATE"}},
+            "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": path.as_uri() + "?mode=ro",
+                        "OPTIONS": {"init_command": settings.SQLITE_READ_PRAGMAS + "PRAGMA query_only=ON;"}},
+        })
+        self.addCleanup(handler.close_all)
+
+        with handler["default"].cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("CREATE TABLE t (n INTEGER)")
+            cursor.execute("INSERT INTO t VALUES (1)")
+        with handler["replica"].cursor() as cursor:
+            cursor.execute("SELECT n FROM t")
+            self.assertEqual(cursor.fetchall(), [(1,)])
+            with self.assertRaises(OperationalError):
+                cursor.execute("INSERT INTO t VALUES (2)")
+
+
+class GuardedCallTests(TestCase):
+    """Latency budget and circuit breaker (myapp.circuit_breaker)"""
+
+    def make_call(self, **kwargs):
+        from myapp.circuit_breaker import GuardedCall
+
+        guarded = GuardedCall("test", **{"budget": 0.05, "failure_threshold": 2, "reset_timeout": 0.1, **kwargs})
+        self.addCleanup(guarded._executor.shutdown, wait=False)
+        return guarded
+
+    def wait_for(self, condition):
+        import time
+
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("condition never became true")
+
+    def test_slow_calls_fall_back_and_open_the_breaker(self):
+        import threading
+        import time
+        from myapp.circuit_breaker import CLOSED, OPEN
+
+        guarded = self.make_call()
+        release = threading.Event()
+        primary = mock.Mock(side_effect=lambda: release.wait(5) and "late")
+        fallback = mock.Mock(return_value="local")
+
+        started = time.perf_counter()
+        self.assertEqual(guarded.call(primary, fallback), ("local", "fallback"))
+        self.assertLess(time.perf_counter() - started, 1)  # bounded by the budget, not the call
+        self.assertEqual(guarded.call(primary, fallback), ("local", "fallback"))
+        self.assertEqual(guarded.breaker.state, OPEN)
+
+        self.assertEqual(guarded.call(primary, fallback), ("local", "fallback"))
+        self.assertEqual(primary.call_count, 2)  # open: the service isn't called at all
+        release.set()
+        self.wait_for(lambda: guarded._in_flight == 0)
+        self.assertEqual(guarded.breaker.state, OPEN)  # finishing late doesn't count as a success
+
+        time.sleep(0.1)
+        self.assertEqual(guarded.call(lambda: "fast", fallback), ("fast", "primary"))  # half-open probe
+        self.assertEqual(guarded.breaker.state, CLOSED)
+        metrics = guarded.metrics()
+        self.assertEqual((metrics["calls"], metrics["primary"], metrics["fallback_timeout"], metrics["fallback_open"]),
+                         (4, 1, 2, 1))
+
+    def test_errors_and_saturation_fall_back(self):
+        import threading
+        from myapp.circuit_breaker import OPEN
+
+        guarded = self.make_call(max_concurrency=1, budget=0.02)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fail():
+            raise RuntimeError("unavailable")
+
+        self.assertEqual(guarded.call(fail, lambda: "local"), ("local", "fallback"))
+        self.wait_for(lambda: guarded._in_flight == 0)
+        self.assertEqual(guarded.breaker.failures, 1)
+
+        self.assertEqual(guarded.call(lambda: release.wait(5), lambda: "local"), ("local", "fallback"))
+        self.assertEqual(guarded.breaker.state, OPEN)
+        guarded.breaker.record_success()  # closed again, but the only worker is still busy
+        self.assertEqual(guarded.call(lambda: "fast", lambda: "local"), ("local", "fallback"))
+        self.assertEqual(guarded.metrics()["fallback_saturated"], 1)
+
+
+@override_settings(POINT_SNAPSHOT_PATH="/nonexistent/points.snap")
+class BatchReportTests(TestCase):
+    """POST /reports/submit-batch"""
+
+    def setUp(self):
+        cache.clear()
+        self.supabase = FakeSupabase(reports=[], user_badges=[], profiles=[
+            {"user_id": USER, "points": 3}, {"user_id": OTHER_USER, "points": 0},
+        ])
+        for target in ("myapp.reports_api._get_supabase", "myapp.badge_rewards._get_supabase"):
+            patcher = mock.patch(target, return_value=self.supabase)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self, reports):
+        return self.client.post("/api/reports/submit-batch", {"reports": reports}, content_type="application/json")
+
+    def item(self, ref, user_id=USER, lat=40.7168, lon=-74.009):
+        return {"user_id": user_id, "lat": lat, "lon": lon, "description": f"report {ref}", "client_ref": ref}
+
+    @override_settings(GAMIFICATION_ASYNC=False)
+    def test_one_insert_and_one_award_per_user(self):
+        badges = {"new_badges": [], "total_badges": 0, "next_milestone": 10}
+        with mock.patch("myapp.badge_rewards.award_badges_for_points", return_value=badges) as award:
+            response = self.submit([self.item("a"), self.item("bad", lat=91), self.item("b", OTHER_USER),
+                                    self.item("c", lat=40.758, lon=-73.9855)])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["total"], body["created"], body["failed"]), (4, 3, 1))
+        self.assertEqual([r["client_ref"] for r in body["results"]], ["a", "bad", "b", "c"])
+        self.assertEqual([r["status"] for r in body["results"]], ["created", "error", "created", "created"])
+
+        self.assertEqual(self.supabase.calls.count(("reports", "insert")), 1)
+        self.assertEqual(self.supabase.calls.count(("profiles", "select")), 1)  # prefetched for both users
+        points = {row["user_id"]: row["points"] for row in self.supabase.tables["profiles"]}
+        self.assertEqual(points, {USER: 5, OTHER_USER: 1})
+        award.assert_any_call(USER, 5, 40.758, -73.9855)  # milestones once, at the latest location
+        self.assertEqual(award.call_count, 2)
+
+    def test_queued_per_user_when_async(self):
+        from myapp.models import GamificationTask
+
+        body = self.submit([self.item("a"), self.item("b"), self.item("c", OTHER_USER)]).json()
+        self.assertEqual(body["created"], 3)
+        tasks = {task.user_id: task.payload["points"] for task in GamificationTask.objects.all()}
+        self.assertEqual(tasks, {USER: 2, OTHER_USER: 1})
+        self.assertEqual({user["user_id"]: user["task_id"] is not None for user in body["users"]},
+                         {USER: True, OTHER_USER: True})
+
+    @override_settings(REPORT_BATCH_MAX=2)
+    def test_batch_size_is_limited(self):
+        self.assertEqual(self.submit([]).status_code, 400)
+        self.assertEqual(self.submit([self.item(n) for n in "abc"]).status_code, 400)
+        self.assertEqual(self.supabase.calls, [])
+
+
+class StreamingJSONTests(TestCase):
+    """Chunked JSON and NDJSON collections (myapp.streaming)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_documents_and_chunks(self):
+        import json
+        from django.test import RequestFactory
+        from myapp.streaming import CHUNK_BYTES, stream_collection
+
+        rows = [{"id": n, "name": "x" * 100} for n in range(2000)]
+        response = stream_collection(RequestFactory().get("/rows"), iter(rows), "rows", head={"count": 2000},
+                                     tail=lambda count: {"streamed": count})
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) >= CHUNK_BYTES for chunk in chunks[:-1]))
+        self.assertEqual(json.loads(b"".join(chunks)), {"count": 2000, "rows": rows, "streamed": 2000})
+
+        response = stream_collection(RequestFactory().get("/rows"), iter([]), "rows")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), {"rows": []})
+
+        request = RequestFactory().get("/rows", HTTP_ACCEPT="application/x-ndjson")
+        response = stream_collection(request, iter(rows[:3]), "rows")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line) for line in b"".join(response.streaming_content).splitlines()], rows[:3])
+
+    def test_locations_endpoint(self):
+        import json
+        from myapp.models import Location
+
+        Location.objects.bulk_create(Location(name=f"p{n}", lat=40.7, lon=-74.0 + n / 1000) for n in range(3))
+        response = self.client.get("/api/locations")
+        self.assertTrue(response.streaming)
+        body = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(body["count"], 3)
+        self.assertEqual(sorted(row["name"] for row in body["locations"]), ["p0", "p1", "p2"])
+
+        response = self.client.get("/api/locations", {"format": "ndjson"})
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_supabase_table_pages_are_streamed_and_cached(self):
+        import json
+
+        supabase = FakeSupabase(things=[{"id": n} for n in range(1, 2501)])
+        with mock.patch("myapp.auth.get_supabase_client", return_value=supabase):
+            response = self.client.get("/api/supabase/things")
+            body = json.loads(b"".join(response.streaming_content))
+            self.assertEqual(body["count"], 2500)
+            self.assertEqual([row["id"] for row in body["data"]], list(range(1, 2501)))
+            self.assertEqual(supabase.calls.count(("things", "select")), 3)  # one per page
+
+            response = self.client.get("/api/supabase/things")  # served from the cached copy
+            self.assertEqual(json.loads(response.content)["count"], 2500)
+        self.assertEqual(supabase.calls.count(("things", "select")), 3)
+
+
+class ReportSearchTests(TestCase):
+    """Local full-text report search (myapp.report_search)"""
+
+    def setUp(self):
+        from myapp.report_search import index_reports
+
+        self.reports = [
+            {"id": 1, "user_id": USER, "lat": 40.7168, "lon": -74.009, "description": "Huge pothole on the corner",
+             "created_at": "2026-03-01T10:00:00+00:00"},
+            {"id": 2, "user_id": USER, "lat": 40.758, "lon": -73.9855, "description": "Two potholes near the plaza",
+             "created_at": "2026-03-02T10:00:00+00:00"},
+            {"id": 3, "user_id": OTHER_USER, "lat": 40.6782, "lon": -73.9442, "description": "Broken streetlight",
+             "created_at": "2026-03-03T10:00:00+00:00"},
+            {"id": 4, "user_id": OTHER_USER, "lat": 40.7170, "lon": -74.008, "description": "Streetlights flickering",
+             "created_at": "2026-03-04T10:00:00+00:00"},
+        ]
+        self.assertEqual(index_reports(self.reports + [{"id": 5, "lat": 1}]), 4)  # the bad row is skipped
+
+    def ids(self, **kwargs):
+        from myapp.report_search import search
+
+        return [result["id"] for result in search(**kwargs)["results"]]
+
+    def test_keywords_area_and_time(self):
+        self.assertEqual(sorted(self.ids(query="pothole")), [1, 2])  # stemmed
+        self.assertEqual(sorted(self.ids(query="street*")), [3, 4])
+        self.assertEqual(self.ids(query="pothole corner"), [1])
+        self.assertEqual(self.ids(query='"); DROP'), [])
+        self.assertEqual(self.ids(), [4, 3, 2, 1])  # newest first without keywords
+        self.assertEqual(self.ids(query="street*", bounds=(40.70, -74.02, 40.72, -74.00)), [4])
+        self.assertEqual(self.ids(geohash="dr5reu"), [4, 1])
+        self.assertEqual(self.ids(query="pothole", geohash="dr5reuk"), [1])
+        self.assertEqual(self.ids(since=datetime(2026, 3, 2, tzinfo=dt_timezone.utc),
+                                  until=datetime(2026, 3, 4, tzinfo=dt_timezone.utc)), [3, 2])
+
+    def test_pages_and_reindexing(self):
+        from myapp.report_search import index_reports, search
+
+        first = search(page_size=3)
+        self.assertTrue(first["has_more"])
+        self.assertEqual([r["id"] for r in first["results"]], [4, 3, 2])
+        self.assertEqual([r["id"] for r in search(page=2, page_size=3)["results"]], [1])
+
+        index_reports([{**self.reports[0], "description": "Fixed now"}])
+        self.assertEqual(self.ids(query="pothole"), [2])
+        self.assertEqual(self.ids(query="fixed"), [1])
+
+    def test_endpoint_validation(self):
+        response = self.client.get("/api/reports/search", {"q": "pothole"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertEqual(self.client.get("/api/reports/search", {"south": 40.7}).status_code, 400)
+        self.assertEqual(self.client.get("/api/reports/search", {"geohash": "dr5a"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/reports/search", {"page": 10 ** 6}).status_code, 400)
+
+
+class ReportRollupTests(TestCase):
+    """Neighborhood tagging and hourly/daily report rollups (myapp.report_rollups)"""
+
+    def reports(self):
+        from myapp.report_rollups import tag_reports
+
+        return tag_reports([
+            {"lat": 40.7168, "lon": -74.009, "created_at": "2026-03-01T10:15:00Z"},
+            {"lat": 40.7170, "lon": -74.008, "created_at": "2026-03-01T10:45:00+00:00"},
+            {"lat": 40.7168, "lon": -74.009, "created_at": "2026-03-01T23:30:00-05:00"},  # next UTC day
+            {"lat": 40.758, "lon": -73.9855, "created_at": "2026-03-01T11:00:00"},
+            {"lat": 40.0, "lon": -74.0, "created_at": "2026-03-01T11:00:00Z"},
+        ])
+
+    def test_reports_are_tagged(self):
+        from myapp.report_rollups import UNMAPPED
+
+        reports = self.reports()
+        self.assertEqual([r["neighborhood"] for r in reports],
+                         ["Tribeca", "Tribeca", "Tribeca", "Times Square", UNMAPPED])
+        self.assertEqual(reports[0]["geohash"], "dr5reuk29")
+
+    def test_rollups_accumulate_and_rebuild(self):
+        from myapp.report_rollups import activity, rebuild_rollups, record_reports
+
+        since = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        until = datetime(2026, 3, 3, tzinfo=dt_timezone.utc)
+        record_reports(self.reports()[:2])
+        record_reports(self.reports()[2:])  # same buckets are added to, not replaced
+
+        hourly = activity("hour", since, until, neighborhood="Tribeca")
+        self.assertEqual(hourly["total_reports"], 3)
+        self.assertEqual([(p["bucket_start"][:13], p["count"]) for p in hourly["neighborhoods"][0]["series"]],
+                         [("2026-03-01T10", 2), ("2026-03-02T04", 1)])
+
+        daily = activity("day", since, until, limit=2)
+        self.assertEqual(daily["total_reports"], 5)
+        self.assertEqual([(n["neighborhood"], n["total"]) for n in daily["neighborhoods"]],
+                         [("Tribeca", 3), ("Times Square", 1)])
+
+        self.assertEqual(rebuild_rollups(self.reports()[:1]), 1)
+        self.assertEqual(activity("day", since, until)["total_reports"], 1)
+
+    def test_activity_endpoint(self):
+        from myapp.report_rollups import record_reports
+
+        record_reports(self.reports())
+        response = self.client.get("/api/reports/neighborhoods/activity",
+                                   {"granularity": "day", "since": "2026-03-01T00:00:00", "until": "2026-03-02"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_reports"], 4)
+        self.assertEqual(self.client.get("/api/reports/neighborhoods/activity", {"granularity": "week"}).status_code,
+                         400)
+        self.assertEqual(self.client.get("/api/reports/neighborhoods/activity",
+                                         {"since": "2026-03-02", "until": "2026-03-01"}).status_code, 400)
+
+
+class CityRegistryTests(TestCase):
+    """Per-city shards loaded on demand (myapp.cities)"""
+
+    def make_registry(self):
+        import json
+        from pathlib import Path
+        from myapp.cities import CityRegistry
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        square = {"type": "FeatureCollection", "features": [{
+            "type": "Feature", "properties": {"label": "Center"},
+            "geometry": {"type": "Polygon", "coordinates": [[[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]},
+        }]}
+        Path(directory.name, "square.geojson").write_text(json.dumps(square))
+        config = {
+            "a": {"name": "A", "bounds": [0, 0, 3, 3], "neighborhood_geojson": "square.geojson",
+                  "neighborhood_name_property": "label", "default_neighborhood": "Outskirts",
+                  "sponsor_neighborhoods": ["Center"], "sponsor_badge_locations": ["Acme", "Center"]},
+            "b": {"bounds": [10, 10, 11, 11]},
+            "c": {"bounds": [20, 20, 21, 21]},
+        }
+        path = Path(directory.name, "cities.json")
+        path.write_text(json.dumps(config))
+        return CityRegistry.from_file(path)
+
+    def test_shards_load_on_first_use(self):
+        from myapp.cities import CityShard
+
+        registry = self.make_registry()
+        city = registry.city_for(1.5, 1.5)
+        self.assertEqual(city.name, "A")
+        self.assertIsNone(registry.city_for(5, 5))
+        self.assertFalse(any(status["loaded"] for status in registry.status()))
+
+        with mock.patch("myapp.cities.CityShard", wraps=CityShard) as load:
+            shard = registry.shard(city)
+            self.assertIs(registry.shard(city), shard)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(shard.find_neighborhood(1.5, 1.5), "Center")
+        self.assertEqual(shard.find_neighborhood(0.5, 0.5), "Outskirts")
+        self.assertEqual([status["neighborhoods"] for status in registry.status()], [1, None, None])
+
+    @override_settings(CITY_MAX_LOADED=2, CITY_IDLE_SECONDS=60)
+    def test_idle_and_least_recently_used_shards_are_dropped(self):
+        registry = self.make_registry()
+        a, b, c = (registry.get(key) for key in "abc")
+        registry.shard(a)
+        registry.shard(b)
+        registry.shard(a)
+        registry.shard(c)  # over the limit: b was used least recently
+        self.assertEqual([s["key"] for s in registry.status() if s["loaded"]], ["a", "c"])
+
+        registry._shards["c"].last_used -= 120
+        registry._last_sweep -= 120
+        registry.shard(a)
+        self.assertEqual([s["key"] for s in registry.status() if s["loaded"]], ["a"])
+        registry.evict()
+        self.assertFalse(any(s["loaded"] for s in registry.status()))
+
+    @override_settings(CITY_BADGE_CACHE_SECONDS=60)
+    def test_badge_pools(self):
+        from myapp.loaders import loader_scope
+
+        registry = self.make_registry()
+        supabase = FakeSupabase(badges=[
+            {"id": 1, "location_name": "Acme"}, {"id": 2, "location_name": "Center"},
+            {"id": 3, "location_name": "Outskirts"},
+        ])
+        shard = registry.shard(registry.get("a"))
+        with patch_supabase(supabase), loader_scope():
+            self.assertEqual(sorted(b["id"] for b in shard.badge_pool("Center")), [1, 2])  # sponsor pool
+            self.assertEqual([b["id"] for b in shard.badge_pool("Outskirts")], [3])
+            self.assertEqual(shard.badge_pool("Acme"), [])  # sponsor badges only in sponsor neighborhoods
+            calls = len(supabase.calls)
+            shard.badge_pool("Center")
+        self.assertEqual(len(supabase.calls), calls)  # cached
+
+
+class PointColumnsTests(TestCase):
+    """Struct-of-arrays map point storage (myapp.columnar)"""
+
+    def make_columns(self):
+        from myapp.columnar import PointColumns
+
+        rng = random.Random(13)
+        self.points = [(n, rng.uniform(40.70, 40.73), rng.uniform(-74.02, -73.98), f"h{n}" if n % 3 else None)
+                       for n in range(1, 1001)]
+        columns = PointColumns.from_rows(self.points, "hydrant")
+        bad = [(2000, None, -74.0, "x"), (2001, float("nan"), -74.0, "x"), (2002, 91.0, -74.0, "x")]
+        columns.extend(bad + [("HYD-7", 40.7128, -74.006, "Pier"), (None, 40.7129, -74.006, None),
+                              (3000.0, 40.7, -74.0, None)], "location")
+        return columns
+
+    def test_rows_round_trip(self):
+        import pygeohash as pgh
+        from myapp.columnar import stand_in_id
+
+        columns = self.make_columns()
+        self.assertEqual(len(columns), 1003)  # rows without usable coordinates are skipped
+        self.assertEqual((columns.count("hydrant"), columns.count("location")), (1000, 3))
+
+        row = columns[10]
+        self.assertEqual((row.id, row.lat, row.lon, row.name, row.kind), self.points[10][:3] + ("h11", "hydrant"))
+        self.assertEqual(row.geohash, pgh.encode(row.lat, row.lon, precision=9))
+        self.assertEqual(row.geohash_at(5), row.geohash[:5])
+
+        external, no_id, float_id = columns[-3], columns[-2], columns[-1]
+        self.assertEqual(external.as_dict(), {"id": "HYD-7", "lat": 40.7128, "lon": -74.006, "name": "Pier",
+                                              "type": "location"})
+        self.assertEqual(columns.ids[len(columns) - 3], stand_in_id("HYD-7", 40.7128, -74.006))
+        self.assertLess(columns.ids[len(columns) - 3], 0)
+        self.assertIsNone(no_id.id)
+        self.assertEqual(float_id.id, 3000)
+
+        ordered = columns.sorted_by_id()
+        self.assertEqual(list(ordered.ids), sorted(columns.ids))
+        self.assertEqual({(row.id, row.name) for row in ordered}, {(row.id, row.name) for row in columns})
+        self.assertEqual(next(row for row in ordered if row.id == "HYD-7").name, "Pier")
+
+    def test_within_matches_brute_force(self):
+        from contextlib import nullcontext
+        from myapp.geo import haversine_m
+
+        columns = self.make_columns()
+        for radius in (100, 800):
+            expected = sorted((haversine_m(40.715, -74.0, row.lat, row.lon), row.index) for row in columns
+                              if haversine_m(40.715, -74.0, row.lat, row.lon) <= radius)
+            for without_numpy in (False, True):
+                with mock.patch("myapp.columnar._numpy", return_value=None) if without_numpy else nullcontext():
+                    found = columns.within(40.715, -74.0, radius)
+                self.assertEqual([index for index, _ in found], [index for _, index in expected])
+                for (_, distance), (expected_distance, _) in zip(found, expected):
+                    self.assertAlmostEqual(distance, expected_distance, delta=0.01)
+
+
+class PointSnapshotTests(TestCase):
+    """Memory-mapped point snapshots shared by the workers (myapp.point_snapshot)"""
+
+    def setUp(self):
+        import myapp.point_snapshot as point_snapshot
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/points.snap"
+        override = override_settings(POINT_SNAPSHOT_PATH=self.path, POINT_SNAPSHOT_CHECK_SECONDS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name, value in {"_snapshot": None, "_checked_at": 0.0}.items():
+            patcher = mock.patch.object(point_snapshot, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        rng = random.Random(17)
+        self.rows = {
+            "hydrants": [(n, rng.uniform(40.70, 40.73), rng.uniform(-74.02, -73.98), {"name": f"h{n}"})
+                         for n in rng.sample(range(1, 10000), 300)] + [("H-1", 40.71, -74.0, {})],
+            "reports": [(n, rng.uniform(40.70, 40.73), rng.uniform(-74.02, -73.98), {}) for n in range(1, 51)],
+        }
+        loaders = {name: (lambda rows: lambda bounds=None: iter(rows))(rows) for name, rows in self.rows.items()}
+        patcher = mock.patch.dict("myapp.tiles.LAYER_LOADERS", loaders)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_layers_round_trip(self):
+        from myapp.nearest import _xyz
+        from myapp.point_snapshot import PointSnapshot, build_layer, refresh_snapshot
+
+        self.assertEqual(refresh_snapshot(("hydrants", "reports")), 1)
+        snapshot = PointSnapshot(self.path)
+        hydrants = snapshot.layer("hydrants")
+        points, tree = build_layer("hydrants")
+        self.assertEqual(list(hydrants.points.ids), list(points.ids))
+        self.assertEqual(list(hydrants.points.ids), sorted(points.ids))
+        self.assertEqual([row.as_dict() for row in hydrants.points], [row.as_dict() for row in points])
+        self.assertIn(points.ids[5], hydrants.ids)
+        self.assertNotIn(10001, hydrants.ids)
+        query = _xyz(40.715, -74.0)
+        self.assertEqual(hydrants.tree.query(query, 5), tree.query(query, 5))
+
+        self.rows["reports"].append((51, 40.72, -74.0, {}))
+        self.assertEqual(refresh_snapshot(("reports",)), 2)  # hydrants are copied over
+        snapshot = PointSnapshot(self.path)
+        self.assertEqual(len(snapshot.layer("reports").points), 51)
+        self.assertEqual(list(snapshot.layer("hydrants").points.ids), list(points.ids))
+
+    def test_workers_map_new_versions(self):
+        from myapp.nearest import LayerIndex
+        from myapp.point_snapshot import get_snapshot, refresh_snapshot
+
+        self.assertIsNone(get_snapshot())
+        refresh_snapshot(("reports",))
+        first = get_snapshot()
+        self.assertEqual(first.version, 1)
+        self.assertIs(get_snapshot(), first)
+
+        index = LayerIndex("reports", mock.Mock(side_effect=AssertionError("loaded from the snapshot")))
+        index.rebuild()
+        self.assertEqual(index.snapshot_version, 1)
+        self.assertEqual(len(index.query(40.715, -74.0, 3)), 3)
+
+        self.rows["reports"].append((51, 40.72, -74.0, {}))
+        refresh_snapshot(("reports",))
+        second = get_snapshot()
+        self.assertEqual(second.version, 2)
+        self.assertEqual(len(second.layer("reports").points), 51)
+        self.assertEqual(len(first.layer("reports").points), 50)  # the old mapping stays readable
+
+
+class AdmissionControlTests(TestCase):
+    """Token-bucket admission for write endpoints (myapp.admission)"""
+
+    def setUp(self):
+        patcher = mock.patch("myapp.admission._stores", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_buckets_refill_and_charge_all_or_nothing(self):
+        from myapp.admission import _admit
+
+        requests = [("user", 3, 4, 1.0), ("ip", 3, 20, 5.0)]
+        wait, rows = _admit({}, requests, now=100.0)
+        self.assertEqual(wait, 0)
+        levels = {key: (tokens, updated) for key, tokens, updated, _ in rows}
+        self.assertEqual(levels, {"user": (1.0, 100.0), "ip": (17.0, 100.0)})
+
+        wait, rows = _admit(levels, requests, now=101.0)  # the user bucket has refilled to 2 of 3
+        self.assertEqual((wait, rows), (1.0, []))  # nothing is taken from the IP bucket either
+        wait, rows = _admit(levels, requests, now=102.0)
+        self.assertEqual(wait, 0)
+        # The IP bucket refilled to its capacity of 20, not past it
+        self.assertEqual(dict((key, tokens) for key, tokens, *_ in rows), {"user": 0.0, "ip": 17.0})
+
+        wait, _ = _admit({}, [("user", 10, 4, 1.0)], now=0.0)  # bigger than the burst: needs a full bucket
+        self.assertEqual(wait, 0)
+
+    def test_sqlite_buckets_are_shared_between_workers(self):
+        from myapp.admission import SQLiteBuckets
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f"{directory.name}/admission.sqlite3"
+        first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+        request = [("report-submit:user:u", 1, 2, 2 / 3600)]
+        self.assertEqual(first.take(request), 0)
+        self.assertEqual(second.take(request), 0)
+        self.assertGreater(first.take(request), 0)
+
+    def test_rejected_before_the_view_runs(self):
+        from django.conf import settings
+
+        rates = {**settings.ADMISSION_RATES, "check-milestones": "2/60"}
+        result = {"new_badges": [], "total_badges": 0, "next_milestone": 5}
+        params = "user_id=u1&points=3&latitude=40.7&longitude=-74.0"
+        with override_settings(ADMISSION_RATES=rates), \
+                mock.patch("myapp.badge_api.award_badges_for_points", return_value=result) as award:
+            statuses = [self.client.post(f"/api/badges/check-milestones?{params}").status_code for _ in range(3)]
+            response = self.client.post(f"/api/badges/check-milestones?{params}")
+            other_user = self.client.post(f"/api/badges/check-milestones?{params.replace('u1', 'u2')}")
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(other_user.status_code, 200)  # the shared IP bucket still has room
+        self.assertEqual(award.call_count, 3)
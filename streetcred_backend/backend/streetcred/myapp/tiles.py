@@ -0,0 +1,355 @@
+"""
+Mapbox Vector Tile (MVT) rendering and caching for map data
+
+Tiles are encoded straight to protobuf (no extra dependency) and cached on
+disk per layer set and zoom level. Each cached tile records the version of
+every geohash region it overlaps (see TileRegion); writes bump the versions
+of the regions around the changed point, so only tiles covering that area
+are rebuilt on their next request.
+
+Hydrants are written to Supabase outside the app, so there is no save() to
+call invalidate_point() from. Tiles with the hydrants layer also record a
+watermark of that table (row count and highest id, re-read at most every
+TILE_EXTERNAL_CHECK_SECONDS) and a whole-layer version that
+invalidate_layer("hydrants") bumps after an edit the watermark can't see
+(a hydrant moved in place).
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .auth import get_supabase_client, iter_table_rows
+from .geo import (
+    geohashes_in_bbox,
+    lonlat_to_world,
+    region_precision_for_zoom,
+    region_prefixes,
+    tile_bounds,
+)
+
+TILE_EXTENT = 4096
+MAX_ZOOM = 20
+LAYERS = ("hydrants", "locations", "reports")
+EXTERNAL_LAYERS = ("hydrants",)  # Supabase tables written outside the app
+LAYER_KEY_PREFIX = "#"  # TileRegion prefix of a whole-layer version ("#hydrants"); geohashes never contain "#"
+
+
+# Protobuf encoding (vector_tile.proto v2)
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field"""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _uint_field(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _packed(values: list[int]) -> bytes:
+    return b"".join(_varint(v) for v in values)
+
+
+def _encode_value(value) -> bytes:
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    if isinstance(value, int):
+        return _uint_field(6, _zigzag(value)) if value < 0 else _uint_field(5, value)
+    if isinstance(value, float):
+        return _varint((3 << 3) | 1) + struct.pack("<d", value)
+    return _field(1, str(value).encode("utf-8"))
+
+
+def encode_layer(name: str, features: list[tuple], extent: int = TILE_EXTENT) -> bytes:
+    """
+    Encode one MVT layer of point features
+
+    Args:
+        name: Layer name
+        features: (feature_id, x, y, properties) tuples in tile coordinates
+        extent: Tile extent in pixels
+
+    Returns:
+        bytes: Encoded Layer message (without the enclosing Tile field)
+    """
+    keys, values = {}, {}
+    encoded_features = []
+
+    for feature_id, x, y, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+
+        feature = b""
+        if isinstance(feature_id, int) and feature_id >= 0:
+            feature += _uint_field(1, feature_id)
+        if tags:
+            feature += _field(2, _packed(tags))
+        feature += _uint_field(3, 1)  # GeomType.POINT
+        feature += _field(4, _packed([9, _zigzag(x), _zigzag(y)]))  # MoveTo(1)
+        encoded_features.append(_field(2, feature))
+
+    layer = _uint_field(15, 2) + _field(1, name.encode("utf-8"))
+    layer += b"".join(encoded_features)
+    layer += b"".join(_field(3, key.encode("utf-8")) for key in keys)
+    layer += b"".join(_field(4, _encode_value(value)) for _, value in values)
+    layer += _uint_field(5, extent)
+    return layer
+
+
+def encode_tile(z: int, x: int, y: int, layers: dict) -> bytes:
+    """
+    Encode point rows into an MVT tile
+
+    Args:
+        z, x, y: Tile coordinates
+        layers: {layer_name: [(id, lat, lon, properties), ...]}
+
+    Returns:
+        bytes: Encoded Tile message
+    """
+    scale = 1 << z
+    tile = b""
+    for name in sorted(layers):
+        features = []
+        for row_id, lat, lon, properties in layers[name]:
+            world_x, world_y = lonlat_to_world(lat, lon)
+            px = int((world_x * scale - x) * TILE_EXTENT)
+            py = int((world_y * scale - y) * TILE_EXTENT)
+            if not (0 <= px < TILE_EXTENT and 0 <= py < TILE_EXTENT):
+                continue
+            if not isinstance(row_id, int):
+                properties = {"id": row_id, **properties}
+            features.append((row_id, px, py, properties))
+        if features:
+            tile += _field(3, encode_layer(name, features))
+    return tile
+
+
+# Layer sources
+
+def _load_hydrants(bounds=None):
+    for hydrant in iter_table_rows("hydrants", "*", bounds):
+        lat = hydrant.get("lat") or hydrant.get("latitude")
+        lon = hydrant.get("lon") or hydrant.get("longitude")
+        if lat is None or lon is None:
+            continue
+        yield hydrant.get("id"), float(lat), float(lon), {}
+
+
+def _load_locations(bounds=None):
+    from .models import Location
+
+    locations = Location.objects.all()
+    if bounds:
+        locations = locations.in_bbox(*bounds)
+    for row_id, lat, lon, name in locations.values_list("id", "lat", "lon", "name").iterator(chunk_size=2000):
+        yield row_id, lat, lon, {"name": name}
+
+
+def _load_reports(bounds=None):
+    for report in iter_table_rows("reports", "id, lat, lon", bounds):
+        yield report["id"], float(report["lat"]), float(report["lon"]), {}
+
+
+LAYER_LOADERS = {
+    "hydrants": _load_hydrants,
+    "locations": _load_locations,
+    "reports": _load_reports,
+}
+
+
+def parse_layers(layers: str = None) -> tuple:
+    """Validate a comma-separated layer list, defaulting to every layer"""
+    if not layers:
+        return LAYERS
+    requested = tuple(sorted({name.strip() for name in layers.split(",") if name.strip()}))
+    unknown = [name for name in requested if name not in LAYER_LOADERS]
+    if unknown or not requested:
+        raise ValueError(f"Unknown tile layers: {', '.join(unknown) or layers}")
+    return requested
+
+
+# Region versions and the on-disk cache
+
+def invalidate_point(lat: float, lon: float):
+    """Mark every region containing a point as changed so tiles covering it get rebuilt"""
+    invalidate_regions(region_prefixes(lat, lon))
+
+
+def invalidate_regions(prefixes):
+    """Bump the version of each region prefix (e.g. once per touched region after a bulk load)"""
+    from .models import TileRegion
+
+    prefixes = sorted(set(prefixes))
+    with transaction.atomic():
+        TileRegion.objects.bulk_create([TileRegion(prefix=p) for p in prefixes], ignore_conflicts=True)
+        TileRegion.objects.filter(prefix__in=prefixes).update(
+            version=F("version") + 1,
+            updated_at=timezone.now()
+        )
+
+
+def invalidate_layer(name: str):
+    """Rebuild every tile with this layer (for writes without a location, e.g. a hydrant edited in Supabase)"""
+    invalidate_regions([LAYER_KEY_PREFIX + name])
+
+
+_watermarks = {}  # layer -> (checked_at, watermark)
+_watermarks_lock = threading.Lock()
+
+
+def _layer_watermark(name: str) -> str:
+    """Row count and highest id of an external layer's table, re-read every TILE_EXTERNAL_CHECK_SECONDS"""
+    now = time.monotonic()
+    with _watermarks_lock:
+        cached = _watermarks.get(name)
+    if cached and now - cached[0] < settings.TILE_EXTERNAL_CHECK_SECONDS:
+        return cached[1]
+
+    try:
+        result = get_supabase_client().table(name).select("id", count="exact")\
+            .order("id", desc=True).limit(1).execute()
+        watermark = f"{result.count}-{result.data[0]['id'] if result.data else 0}"
+    except Exception as e:
+        print(f"ERROR: Could not read the {name} watermark: {e}")
+        watermark = cached[1] if cached else "unknown"
+    with _watermarks_lock:
+        _watermarks[name] = (now, watermark)
+    return watermark
+
+
+def _region_stamp(regions: list[str], versions: dict) -> str:
+    return ",".join(f"{prefix}:{versions.get(prefix, 0)}" for prefix in sorted(regions))
+
+
+def _layer_keys(layers: tuple) -> list[str]:
+    return [LAYER_KEY_PREFIX + name for name in layers if name in EXTERNAL_LAYERS]
+
+
+def _tile_stamp(regions: list[str], layers: tuple, versions: dict) -> str:
+    """Versions of the tile's regions, plus the version and watermark of each external layer"""
+    stamp = _region_stamp(regions + _layer_keys(layers), versions)
+    for name in layers:
+        if name in EXTERNAL_LAYERS:
+            stamp += f",{name}@{_layer_watermark(name)}"
+    return stamp
+
+
+def _tile_regions(z: int, x: int, y: int) -> list[str]:
+    south, west, north, east = tile_bounds(z, x, y)
+    return geohashes_in_bbox(south, west, north, east, region_precision_for_zoom(z))
+
+
+def _tile_path(layers: tuple, z: int, x: int, y: int) -> str:
+    return os.path.join(str(settings.TILE_CACHE_DIR), "-".join(layers), str(z), str(x), f"{y}.mvt")
+
+
+def _read_cached(path: str):
+    try:
+        with open(path, "rb") as f:
+            etag = f.readline().rstrip(b"\n").decode()
+            stamp = f.readline().rstrip(b"\n").decode()
+            return etag, stamp, f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_cached(path: str, stamp: str, data: bytes) -> str:
+    etag = hashlib.md5(data).hexdigest()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(f"{etag}\n{stamp}\n".encode())
+        f.write(data)
+    os.replace(tmp_path, path)
+    return etag
+
+
+def get_tile(z: int, x: int, y: int, layers: tuple = LAYERS) -> tuple[bytes, str]:
+    """
+    Get an encoded tile, rebuilding it only if a region it covers has changed
+
+    Args:
+        z, x, y: Tile coordinates
+        layers: Layer names to include (from parse_layers)
+
+    Returns:
+        tuple: (tile_bytes, etag)
+    """
+    from .models import TileRegion
+
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+
+    regions = _tile_regions(z, x, y)
+    keys = regions + _layer_keys(layers)
+    versions = dict(TileRegion.objects.filter(prefix__in=keys).values_list("prefix", "version"))
+    stamp = _tile_stamp(regions, layers, versions)
+
+    path = _tile_path(layers, z, x, y)
+    cached = _read_cached(path)
+    if cached and cached[1] == stamp:
+        return cached[2], cached[0]
+
+    bounds = tile_bounds(z, x, y)
+    data = encode_tile(z, x, y, {name: list(LAYER_LOADERS[name](bounds)) for name in layers})
+    etag = _write_cached(path, stamp, data)
+    return data, etag
+
+
+def pregenerate_zoom(z: int, layers: tuple = LAYERS, bounds=None) -> int:
+    """
+    Render and cache every non-empty tile at a zoom level from a single pass over the data
+
+    Args:
+        z: Zoom level
+        layers: Layer names to include
+        bounds: Optional (south, west, north, east) box to restrict the source rows
+
+    Returns:
+        int: Number of tiles written
+    """
+    from .models import TileRegion
+
+    scale = 1 << z
+    tiles = defaultdict(lambda: {name: [] for name in layers})
+    for name in layers:
+        for row in LAYER_LOADERS[name](bounds):
+            world_x, world_y = lonlat_to_world(row[1], row[2])
+            key = (min(int(world_x * scale), scale - 1), min(int(world_y * scale), scale - 1))
+            tiles[key][name].append(row)
+
+    precision = region_precision_for_zoom(z)
+    versions = {
+        prefix: version
+        for prefix, version in TileRegion.objects.values_list("prefix", "version")
+        if len(prefix) == precision or prefix.startswith(LAYER_KEY_PREFIX)
+    }
+
+    for (x, y), rows in tiles.items():
+        stamp = _tile_stamp(_tile_regions(z, x, y), layers, versions)
+        _write_cached(_tile_path(layers, z, x, y), stamp, encode_tile(z, x, y, rows))
+    return len(tiles)
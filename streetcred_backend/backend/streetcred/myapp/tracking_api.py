@@ -0,0 +1,124 @@
+from ninja import NinjaAPI, Schema
+from ninja.errors import HttpError
+from typing import List, Optional
+from uuid import UUID
+from datetime import datetime, timedelta, timezone as dt_timezone
+from .location_ingest import get_location_buffer
+
+api = NinjaAPI(urls_namespace='tracking')
+
+
+# Request/Response Schemas
+class LocationPing(Schema):
+    user_id: UUID
+    lat: float
+    lon: float
+    accuracy: Optional[float] = None  # Meters, as reported by the device
+    session_id: Optional[str] = None
+
+
+class PingBatchRequest(Schema):
+    pings: List[LocationPing]
+
+
+class PingResponse(Schema):
+    received: int
+    accepted: int
+
+
+class EndSessionRequest(Schema):
+    user_id: UUID
+    session_id: Optional[str] = None
+
+
+def _check_coordinates(ping: LocationPing):
+    if not -90 <= ping.lat <= 90 or not -180 <= ping.lon <= 180:
+        raise HttpError(400, f"Invalid coordinates: {ping.lat}, {ping.lon}")
+
+
+@api.post("/ping", response=PingResponse)
+def record_ping(request, payload: LocationPing):
+    """
+    Record a device location ping
+
+    Pings are buffered and written in bulk. A ping is dropped (accepted=0)
+    if the device has not moved far enough since the last kept ping.
+    """
+    _check_coordinates(payload)
+    buffer = get_location_buffer()
+    accepted = buffer.add(payload.user_id, payload.lat, payload.lon, payload.accuracy, payload.session_id)
+    return {"received": 1, "accepted": int(accepted)}
+
+
+@api.post("/pings", response=PingResponse)
+def record_pings(request, payload: PingBatchRequest):
+    """
+    Record several pings at once (e.g. queued while the app was offline)
+
+    The batch is rejected as a whole if any ping has invalid coordinates.
+    """
+    for ping in payload.pings:
+        _check_coordinates(ping)
+    buffer = get_location_buffer()
+    accepted = sum(
+        buffer.add(ping.user_id, ping.lat, ping.lon, ping.accuracy, ping.session_id)
+        for ping in payload.pings
+    )
+    return {"received": len(payload.pings), "accepted": accepted}
+
+
+@api.post("/session/end")
+def end_session(request, payload: EndSessionRequest):
+    """
+    Stop tracking a session and mark its locations inactive
+    """
+    deactivated = get_location_buffer().end_session(payload.user_id, payload.session_id)
+    return {"user_id": payload.user_id, "session_id": payload.session_id, "deactivated": deactivated}
+
+
+@api.get("/history/{user_id}")
+def location_history(request, user_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     session_id: Optional[str] = None):
+    """
+    Get a user's tracked locations between start and end (default: the last 24 hours), per session
+
+    Days past LOCATION_RETENTION_DAYS come from the location archive, where
+    tracks are simplified (points marked archived=true).
+    """
+    import uuid
+    from django.conf import settings
+    from django.utils import timezone
+    from .location_archive import load_history
+
+    try:
+        user_id = str(uuid.UUID(user_id))
+    except ValueError:
+        raise HttpError(400, "user_id must be a UUID")
+    end = end or timezone.now()
+    start = start or end - timedelta(days=1)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start, dt_timezone.utc)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end, dt_timezone.utc)
+    if start >= end:
+        raise HttpError(400, "start must be before end")
+    if end - start > timedelta(days=settings.LOCATION_HISTORY_MAX_DAYS):
+        raise HttpError(400, f"At most {settings.LOCATION_HISTORY_MAX_DAYS} days per request")
+
+    sessions = load_history(user_id, start, end, session_id)
+    return {
+        "user_id": user_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total_points": sum(len(s["points"]) for s in sessions),
+        "sessions": sessions,
+    }
+
+
+@api.get("/stats")
+def ingest_stats(request):
+    """
+    Get ping buffer counters for this worker process
+    """
+    buffer = get_location_buffer()
+    return {**buffer.stats, "pending": buffer.pending_count()}
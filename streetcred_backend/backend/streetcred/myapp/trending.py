@@ -0,0 +1,215 @@
+"""
+"Hot right now" ranking of areas by recent reporting activity
+
+Activity is tracked with fixed-size streaming structures so memory does not
+grow with the number of reports ingested:
+
+- DecayedTopK: Space-Saving heavy hitters over exponentially decayed
+  counts. At most `capacity` keys are kept; a new key evicts the lowest
+  scoring one and inherits its score as an error bound.
+- HyperLogLog: distinct reporter estimate for each tracked key
+  (1 KB per key at the default precision, ~3% standard error).
+
+Decay uses a moving landmark: each hit adds exp((t - landmark) / tau), and
+scores are rescaled when the exponent gets large, so updates stay O(1)
+apart from the occasional O(capacity) eviction scan.
+
+A new process replays the last few half-lives of reports in a background
+thread, so neither report submission nor /trending waits on it; rankings
+fill in as the replay runs.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+import pygeohash as pgh
+from django.conf import settings
+
+# Rescale stored scores before exp() gets anywhere near overflow
+MAX_EXPONENT = 50.0
+
+
+class HyperLogLog:
+    """Distinct-count estimator with 2^p single-byte registers"""
+
+    __slots__ = ("p", "m", "registers")
+
+    def __init__(self, p: int = 10):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, item: str):
+        x = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            raw = self.m * math.log(self.m / zeros)  # linear counting for small cardinalities
+        return int(round(raw))
+
+
+class DecayedTopK:
+    """Bounded Space-Saving top-K over exponentially decayed counts"""
+
+    def __init__(self, capacity: int, half_life: float, hll_precision: int = 10):
+        self.capacity = capacity
+        self.tau = half_life / math.log(2)
+        self.hll_precision = hll_precision
+        self.landmark = time.time()
+        self._entries = {}  # key -> [scaled_score, scaled_error, HyperLogLog, last_seen]
+        self._lock = threading.Lock()
+
+    def _rescale(self, now: float):
+        factor = math.exp(-(now - self.landmark) / self.tau)
+        for entry in self._entries.values():
+            entry[0] *= factor
+            entry[1] *= factor
+        self.landmark = now
+
+    def add(self, key: str, reporter: str = None, timestamp: float = None, weight: float = 1.0):
+        now = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if (now - self.landmark) / self.tau > MAX_EXPONENT:
+                self._rescale(now)
+            increment = weight * math.exp((now - self.landmark) / self.tau)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                error = 0.0
+                if len(self._entries) >= self.capacity:
+                    victim = min(self._entries, key=lambda k: self._entries[k][0])
+                    error = self._entries.pop(victim)[0]
+                entry = self._entries[key] = [error, error, HyperLogLog(self.hll_precision), now]
+
+            entry[0] += increment
+            entry[3] = max(entry[3], now)
+            if reporter:
+                entry[2].add(str(reporter))
+
+    def top(self, limit: int = 10, now: float = None) -> list[dict]:
+        """
+        Get the highest scoring keys
+
+        Scores are in "recent reports" units: a report just now counts 1,
+        one half-life ago counts 0.5. `error` is the most the score may be
+        overstated by (inherited from an evicted key).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            factor = math.exp(-(now - self.landmark) / self.tau)
+            ranked = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+            return [
+                {
+                    "key": key,
+                    "score": round(score * factor, 3),
+                    "error": round(error * factor, 3),
+                    "distinct_reporters": hll.estimate(),
+                    "last_report_at": datetime.fromtimestamp(last_seen, dt_timezone.utc).isoformat(),
+                }
+                for key, (score, error, hll, last_seen) in ranked
+            ]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TrendingTracker:
+    """Trending geohash cells and neighborhoods"""
+
+    def __init__(self, capacity: int, half_life: float, cell_precision: int):
+        self.cell_precision = cell_precision
+        self.cells = DecayedTopK(capacity, half_life)
+        self.neighborhoods = DecayedTopK(capacity, half_life)
+
+    def add(self, lat: float, lon: float, user_id: str = None, timestamp: float = None):
+        from .views import get_fallback_neighborhood
+
+        cell = pgh.encode(float(lat), float(lon), precision=self.cell_precision)
+        self.cells.add(cell, user_id, timestamp)
+        neighborhood = get_fallback_neighborhood(lat, lon)
+        if neighborhood:  # None outside every configured city
+            self.neighborhoods.add(neighborhood, user_id, timestamp)
+
+    def top_cells(self, limit: int = 10) -> list[dict]:
+        results = self.cells.top(limit)
+        for result in results:
+            result["lat"], result["lon"] = pgh.decode(result["key"])
+        return results
+
+    def top_neighborhoods(self, limit: int = 10) -> list[dict]:
+        return self.neighborhoods.top(limit)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+_warming = None  # reports recorded during the warm-up replay: [(report_id, lat, lon, user_id, timestamp)]
+
+
+def _parse_timestamp(value) -> float:
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def get_trending_tracker() -> TrendingTracker:
+    """Get the process-wide tracker, starting the replay of recent reports on first use"""
+    global _tracker, _warming
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                tracker = TrendingTracker(
+                    capacity=settings.TRENDING_CAPACITY,
+                    half_life=settings.TRENDING_HALF_LIFE,
+                    cell_precision=settings.TRENDING_CELL_PRECISION,
+                )
+                _warming = []
+                _tracker = tracker
+                threading.Thread(target=_warm_up, args=(tracker,), name="trending-warm-up", daemon=True).start()
+    return _tracker
+
+
+def is_warming_up() -> bool:
+    return _warming is not None
+
+
+def _warm_up(tracker: TrendingTracker):
+    """Replay the last few half-lives of reports so a restart doesn't start from zero"""
+    global _warming
+    from .auth import iter_table_rows
+
+    since = datetime.now(dt_timezone.utc) - timedelta(seconds=5 * settings.TRENDING_HALF_LIFE)
+    replayed = 0  # newest report id replayed; reports are paged in id order
+    try:
+        for report in iter_table_rows("reports", "id, user_id, lat, lon, created_at", since=since.isoformat()):
+            tracker.add(report["lat"], report["lon"], report.get("user_id"), _parse_timestamp(report["created_at"]))
+            replayed = report["id"]
+    except Exception as e:
+        print(f"ERROR: Could not replay recent reports for trending: {e}")
+    finally:
+        # Count the reports submitted meanwhile that the replay didn't reach
+        with _tracker_lock:
+            recorded, _warming = _warming, None
+        for report_id, lat, lon, user_id, timestamp in recorded:
+            if report_id is None or report_id > replayed:
+                tracker.add(lat, lon, user_id, timestamp)
+
+
+def record_report(lat: float, lon: float, user_id: str = None, report_id: int = None):
+    """Count a newly inserted report, never failing the caller"""
+    try:
+        tracker = get_trending_tracker()
+        if _warming is not None:
+            with _tracker_lock:
+                if _warming is not None:
+                    _warming.append((report_id, lat, lon, user_id, time.time()))
+                    return
+        tracker.add(lat, lon, user_id)
+    except Exception as e:
+        print(f"ERROR: Could not update trending counters: {e}")
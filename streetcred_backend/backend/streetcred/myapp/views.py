@@ -1,11 +1,12 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 import pygeohash as pgh
 import folium
 from folium import plugins
 from django.http import JsonResponse
+from .admission import admission_control
 from .auth import get_supabase_client
-from .locater import identify_location
+from .locater import resolve_neighborhood
 
 # Create your views here.
 
@@ -27,54 +28,29 @@ def create_user(request):
 def map_view(request):
     """Display interactive map with locations"""
     from .models import Location
+    from .auth import iter_table_rows
+    from .columnar import PointColumns
+    from .point_snapshot import get_layer
+
+    # Locations and hydrants share one columnar store (see columnar.py)
+    points = PointColumns.from_rows(
+        Location.objects.order_by('-created_at').values_list('id', 'lat', 'lon', 'name').iterator(chunk_size=2000),
+        'location'
+    )
 
-    # Get all locations from Django database
-    location_objs = Location.objects.all().order_by('-created_at')
-
-    # Convert to list of dicts for template
-    locations = [
-        {
-            "id": loc.id,
-            "lat": loc.lat,
-            "lon": loc.lon,
-            "name": loc.name,
-            "geohash": loc.geohash,
-            "type": "location"
-        }
-        for loc in location_objs
-    ]
-
-    # Get hydrants from Supabase (with error handling)
+    # Get hydrants from the shared point snapshot, or from Supabase (with error handling)
     try:
-        supabase = get_supabase_client()
-        hydrants_response = supabase.table('hydrants').select('*').execute()
-
-        print(f"DEBUG: Fetched {len(hydrants_response.data)} hydrants from Supabase")
-        print(f"DEBUG: Sample hydrant data: {hydrants_response.data[:2] if hydrants_response.data else 'None'}")
-
-        # Add hydrants to locations list
-        hydrants_added = 0
-        for hydrant in hydrants_response.data:
-            lat = hydrant.get('lat') or hydrant.get('latitude')
-            lng = hydrant.get('lon') or hydrant.get('longitude') or hydrant.get('longitude')
-
-            # Skip hydrants with invalid coordinates
-            if lat is None or lng is None:
-                print(f"DEBUG: Skipping hydrant with missing coords: {hydrant}")
-                continue
-
-            # Generate geohash for hydrants
-            geohash = pgh.encode(float(lat), float(lng), precision=7)
-            locations.append({
-                "id": hydrant.get('id'),
-                "lat": float(lat),
-                "lon": float(lng),
-                "name": hydrant.get('name') or hydrant.get('id') or 'Hydrant',
-                "geohash": geohash,
-                "type": "hydrant"
-            })
-            hydrants_added += 1
-
+        snapshot_hydrants = get_layer('hydrants')
+        if snapshot_hydrants is not None:
+            hydrant_rows = ((p.id, p.lat, p.lon, p.name) for p in snapshot_hydrants.points)
+        else:
+            hydrant_rows = (
+                (hydrant.get('id'), hydrant.get('lat') or hydrant.get('latitude'),
+                 hydrant.get('lon') or hydrant.get('longitude'), hydrant.get('name'))
+                for hydrant in iter_table_rows('hydrants')
+            )
+        # Hydrants with missing/invalid coordinates are skipped; string or missing ids are kept
+        hydrants_added = points.extend(hydrant_rows, 'hydrant')
         print(f"DEBUG: Added {hydrants_added} hydrants to map")
     except Exception as e:
         # If Supabase fails, just skip hydrants and continue with locations
@@ -83,15 +59,8 @@ def map_view(request):
         traceback.print_exc()
 
     # Create base map centered on all markers
-    # Filter out any locations with None coordinates
-    valid_locations = [loc for loc in locations if loc.get('lat') is not None and loc.get('lon') is not None]
-
-    if valid_locations:
-        center_lat = sum(loc['lat'] for loc in valid_locations) / len(valid_locations)
-        center_lng = sum(loc['lon'] for loc in valid_locations) / len(valid_locations)
-    else:
-        # Default to San Francisco if no locations
-        center_lat, center_lng = 37.7749, -122.4194
+    # Default to San Francisco if no locations
+    center_lat, center_lng = points.centroid() or (37.7749, -122.4194)
 
     # Create folium map
     m = folium.Map(
@@ -100,22 +69,26 @@ def map_view(request):
         tiles='OpenStreetMap'
     )
 
-    # Add markers for each valid location
-    for loc in valid_locations:
+    # Add markers for each location
+    for point in points:
         # Different icons for different types
-        if loc.get('type') == 'hydrant':
+        if point.kind == 'hydrant':
             icon_color = 'blue'
             icon_name = 'tint'
             marker_type = '💧 Hydrant'
+            name = point.name or point.id or 'Hydrant'
+            geohash = point.geohash_at(7)
         else:
             icon_color = 'red'
             icon_name = 'info-sign'
             marker_type = '📍 Location'
+            name = point.name
+            geohash = point.geohash
 
         folium.Marker(
-            location=[loc['lat'], loc['lon']],
-            popup=f"<b>{marker_type}</b><br><b>{loc['name']}</b><br>Geohash: {loc['geohash']}",
-            tooltip=loc['name'],
+            location=[point.lat, point.lon],
+            popup=f"<b>{marker_type}</b><br><b>{name}</b><br>Geohash: {geohash}",
+            tooltip=name,
             icon=folium.Icon(color=icon_color, icon=icon_name)
         ).add_to(m)
 
@@ -138,15 +111,15 @@ def map_view(request):
     map_html = m._repr_html_()
 
     # Count how many of each type
-    location_count = sum(1 for loc in valid_locations if loc.get('type') == 'location')
-    hydrant_count = sum(1 for loc in valid_locations if loc.get('type') == 'hydrant')
+    location_count = points.count('location')
+    hydrant_count = points.count('hydrant')
 
     print(f"DEBUG FINAL: Rendering {location_count} locations and {hydrant_count} hydrants")
-    print(f"DEBUG FINAL: Total valid_locations: {len(valid_locations)}")
+    print(f"DEBUG FINAL: Total points: {len(points)} ({points.nbytes()} bytes)")
 
     context = {
         'map_html': map_html,
-        'locations': valid_locations
+        'locations': points  # PointRow views: id, lat, lon, name, kind
     }
 
     return render(request, 'myapp/map.html', context)
@@ -176,40 +149,66 @@ def add_location(request):
     return JsonResponse({'status': 'error', 'message': 'POST required'}, status=400)
 
 
+async def report_stream(request):
+    """
+    Server-Sent Events stream of new reports inside a geohash area
+
+    Query params: either `area` (geohash prefix, 1-9 chars) or `lat`, `lon`
+    and optional `precision` (default 5, roughly 5km x 5km).
+    """
+    from django.conf import settings
+    from .report_feed import GEOHASH_CHARS, MAX_PRECISION, get_report_broker
+
+    area = request.GET.get('area', '').lower()
+    if not area:
+        try:
+            precision = int(request.GET.get('precision', 5))
+            area = pgh.encode(float(request.GET.get('lat')), float(request.GET.get('lon')), precision=precision)
+        except (TypeError, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'Provide area or lat/lon'}, status=400)
+
+    if not (1 <= len(area) <= MAX_PRECISION and set(area) <= GEOHASH_CHARS):
+        return JsonResponse({'status': 'error', 'message': 'Invalid geohash area'}, status=400)
+
+    subscription = get_report_broker().subscribe(area)
+    response = StreamingHttpResponse(
+        subscription.events(settings.REPORT_FEED_KEEPALIVE),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+    return response
+
+
+@admission_control("identify-neighborhood")
 def identify_neighborhood(request):
-    """API endpoint to identify NYC neighborhood from coordinates"""
+    """API endpoint to identify the neighborhood (and city) of coordinates"""
+    from .cities import city_for
+
     if request.method == 'GET':
         try:
             lat = float(request.GET.get('lat'))
             lng = float(request.GET.get('lng'))
             
-            # Validate coordinates are in NYC area
-            if not (40.4774 <= lat <= 40.9176 and -74.2591 <= lng <= -73.7004):
+            # Validate coordinates are in a supported city
+            city = city_for(lat, lng)
+            if city is None:
                 return JsonResponse({
                     'status': 'error', 
-                    'message': 'Coordinates are outside NYC area'
+                    'message': 'Coordinates are outside every supported city'
                 }, status=400)
             
-            # Use the locater function with error handling
-            try:
-                neighborhood = identify_location(lat, lng)
-                
-                return JsonResponse({
-                    'status': 'success',
-                    'neighborhood': neighborhood,
-                    'coordinates': {'lat': lat, 'lng': lng}
-                })
-            except Exception as ai_error:
-                # If AI fails, use fallback
-                print(f"AI location detection failed: {ai_error}")
-                fallback_neighborhood = get_fallback_neighborhood(lat, lng)
-                
-                return JsonResponse({
-                    'status': 'success',
-                    'neighborhood': fallback_neighborhood,
-                    'coordinates': {'lat': lat, 'lng': lng},
-                    'method': 'fallback'
-                })
+            # AI lookup within the latency budget, local ranges otherwise
+            neighborhood, method = resolve_neighborhood(lat, lng)
+            response = {
+                'status': 'success',
+                'neighborhood': neighborhood,
+                'city': city.key,
+                'coordinates': {'lat': lat, 'lng': lng}
+            }
+            if method == 'fallback':
+                response['method'] = 'fallback'
+            return JsonResponse(response)
             
         except (ValueError, TypeError) as e:
             return JsonResponse({
@@ -227,23 +226,11 @@ def identify_neighborhood(request):
 
 
 def get_fallback_neighborhood(lat, lng):
-    """Fallback neighborhood detection using coordinate ranges"""
-    neighborhoods = [
-        {'name': 'Times Square', 'lat_min': 40.75, 'lat_max': 40.77, 'lng_min': -73.99, 'lng_max': -73.98},
-        {'name': 'Central Park', 'lat_min': 40.76, 'lat_max': 40.80, 'lng_min': -73.98, 'lng_max': -73.95},
-        {'name': 'Battery Park City', 'lat_min': 40.70, 'lat_max': 40.72, 'lng_min': -74.02, 'lng_max': -74.00},
-        {'name': 'Chelsea', 'lat_min': 40.74, 'lat_max': 40.76, 'lng_min': -74.01, 'lng_max': -73.99},
-        {'name': 'Greenwich Village', 'lat_min': 40.73, 'lat_max': 40.74, 'lng_min': -74.01, 'lng_max': -73.99},
-        {'name': 'SoHo', 'lat_min': 40.72, 'lat_max': 40.73, 'lng_min': -74.01, 'lng_max': -73.99},
-        {'name': 'Financial District', 'lat_min': 40.70, 'lat_max': 40.72, 'lng_min': -74.02, 'lng_max': -74.00},
-        {'name': 'Upper East Side', 'lat_min': 40.77, 'lat_max': 40.80, 'lng_min': -73.96, 'lng_max': -73.93},
-        {'name': 'Upper West Side', 'lat_min': 40.78, 'lat_max': 40.80, 'lng_min': -73.98, 'lng_max': -73.95},
-        {'name': 'Harlem', 'lat_min': 40.80, 'lat_max': 40.82, 'lng_min': -73.95, 'lng_max': -73.93}
-    ]
-    
-    for neighborhood in neighborhoods:
-        if (neighborhood['lat_min'] <= lat <= neighborhood['lat_max'] and
-            neighborhood['lng_min'] <= lng <= neighborhood['lng_max']):
-            return neighborhood['name']
-    
-    return 'Manhattan'  # Default fallback
+    """Local neighborhood detection from the city's boundary polygons (see cities.py)"""
+    from .cities import get_city_registry
+
+    registry = get_city_registry()
+    city = registry.city_for(float(lat), float(lng))
+    if city is None:
+        return None
+    return registry.shard(city).find_neighborhood(float(lat), float(lng))  # city default outside its polygons
@@ -6,14 +6,24 @@ set -e
 # Run migrations
 python manage.py migrate --noinput
 
+# Table behind the shared response cache tags (CACHES["route-tags"])
+python manage.py createcachetable
+
 # Collect static files
 python manage.py collectstatic --noinput
 
-# Start Gunicorn
-gunicorn streetcred.wsgi:application \
+# Apply queued points and badge awards (GAMIFICATION_ASYNC)
+python manage.py run_gamification_worker &
+
+# Keep the heatmap snapshot fresh
+python manage.py rebuild_heatmap --interval 3600 &
+
+# Start Gunicorn with uvicorn workers: the ASGI entry point is required for
+# the /api/reports/stream/ SSE feed (sync views run in Django's thread pool)
+gunicorn streetcred.asgi:application \
+    --worker-class uvicorn_worker.UvicornWorker \
     --bind 0.0.0.0:${PORT:-8000} \
     --workers 2 \
-    --threads 4 \
     --timeout 120 \
     --access-logfile - \
     --error-logfile -
@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.profiling.ProfilingMiddleware',  # removed at start-up unless PROFILING_ENABLED
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -59,6 +60,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'myapp.loaders.LoaderScopeMiddleware',  # batches/memoizes Supabase lookups per request
+    'myapp.response_cache.ConditionalRouteMiddleware',  # ETags for @conditional_route endpoints
 ]
 
 ROOT_URLCONF = 'streetcred.urls'
@@ -91,6 +94,48 @@ DATABASES = {
     }
 }
 
+# Opt-in SQLite performance profile: WAL journaling (readers don't block on
+# the writer), memory-mapped reads, a bigger page cache, fewer fsyncs and
+# persistent connections. Reads are routed to a separate read-only
+# connection ('replica' alias, same file) by myapp.db_router.
+SQLITE_PERFORMANCE = os.getenv('SQLITE_PERFORMANCE', 'False') == 'True'
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))  # page cache per connection
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # NORMAL is durable enough under WAL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CONN_MAX_AGE = int(os.getenv('SQLITE_CONN_MAX_AGE', '600'))  # seconds to keep connections open
+
+SQLITE_READ_PRAGMAS = (
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};"
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};"
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB};"
+    "PRAGMA temp_store=MEMORY;"
+)
+SQLITE_WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    f"PRAGMA synchronous={SQLITE_SYNCHRONOUS};"
+    + SQLITE_READ_PRAGMAS
+)
+
+if SQLITE_PERFORMANCE:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': SQLITE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_WRITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',  # take the write lock up front instead of failing mid-transaction
+        },
+    })
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': Path(DATABASES['default']['NAME']).as_uri() + '?mode=ro',
+        'CONN_MAX_AGE': SQLITE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': SQLITE_READ_PRAGMAS + "PRAGMA query_only=ON;"},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['myapp.db_router.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,10 +179,123 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache (per-process memory; point at Redis/Memcached to share across workers)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'streetcred',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000'))},
+    },
+    # Response cache invalidation tags, shared by the web workers and run_gamification_worker
+    # through the database (create the table with `manage.py createcachetable`)
+    'route-tags': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'route_cache_tags',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('ROUTE_TAG_MAX_ENTRIES', '100000'))},
+    },
+}
+
+# API response cache (see myapp.response_cache)
+ROUTE_CACHE_ENABLED = os.getenv('ROUTE_CACHE_ENABLED', 'True') == 'True'
+ROUTE_CACHE_TTL = int(os.getenv('ROUTE_CACHE_TTL', '30'))  # default seconds per cached response
+ROUTE_CACHE_MAX_BYTES = int(os.getenv('ROUTE_CACHE_MAX_BYTES', str(1024 * 1024)))  # streamed bodies larger than this aren't cached
+ROUTE_CACHE_FLIGHT_WAIT = float(os.getenv('ROUTE_CACHE_FLIGHT_WAIT', '10'))  # seconds a request waits for a concurrent miss of the same key before running the view itself
+ROUTE_CACHE_STREAM_WAIT = float(os.getenv('ROUTE_CACHE_STREAM_WAIT', '10'))  # seconds a request waits for a concurrent stream of the same key to be cached
+
+# Per-request profiling (see myapp.profiling)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')  # requests with `X-Profile: <token>` are profiled
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))  # fraction of other requests profiled
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))  # stack sampling interval
+PROFILING_DIR = Path(os.getenv('PROFILING_DIR', BASE_DIR / 'cache' / 'profiles'))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '50'))  # oldest profiles are deleted beyond this
+
+# Gemini neighborhood lookups (see myapp.circuit_breaker)
+AI_LATENCY_BUDGET = float(os.getenv('AI_LATENCY_BUDGET', '1.5'))  # seconds before using the local resolver
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '8'))  # Gemini calls in flight per process
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))  # consecutive failures that open the breaker
+AI_BREAKER_RESET = float(os.getenv('AI_BREAKER_RESET', '30'))  # seconds before probing again
+
+# Cities: bounds, neighborhood boundaries and badge rules per city (see myapp.cities)
+CITIES_CONFIG_PATH = Path(os.getenv('CITIES_CONFIG_PATH', BASE_DIR / 'myapp' / 'data' / 'cities.json'))
+CITY_IDLE_SECONDS = int(os.getenv('CITY_IDLE_SECONDS', '1800'))  # unload a city's data after this long unused
+CITY_MAX_LOADED = int(os.getenv('CITY_MAX_LOADED', '8'))  # cities kept loaded per process
+CITY_BADGE_CACHE_SECONDS = int(os.getenv('CITY_BADGE_CACHE_SECONDS', '300'))  # badge pool cache lifetime
+
 # Supabase Configuration
 SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL', '')
 SUPABASE_KEY = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY', '')
 
+# Map vector tiles
+TILE_CACHE_DIR = Path(os.getenv('TILE_CACHE_DIR', BASE_DIR / 'cache' / 'tiles'))
+TILE_CACHE_MAX_AGE = int(os.getenv('TILE_CACHE_MAX_AGE', '60'))  # seconds clients reuse a tile before revalidating
+TILE_EXTERNAL_CHECK_SECONDS = float(os.getenv('TILE_EXTERNAL_CHECK_SECONDS', '60'))  # how often the hydrants table is checked for changes
+
+# Location ping ingestion
+LOCATION_BUFFER_SIZE = int(os.getenv('LOCATION_BUFFER_SIZE', '500'))  # rows per bulk insert
+LOCATION_FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', '2.0'))  # seconds
+LOCATION_MIN_DISTANCE_M = float(os.getenv('LOCATION_MIN_DISTANCE_M', '10'))  # drop pings closer than this
+
+# user_locations retention (`manage.py archive_user_locations`, see myapp.location_archive)
+LOCATION_RETENTION_DAYS = int(os.getenv('LOCATION_RETENTION_DAYS', '7'))  # whole UTC days older than this are archived
+LOCATION_SIMPLIFY_TOLERANCE_M = float(os.getenv('LOCATION_SIMPLIFY_TOLERANCE_M', '10'))  # max error of archived tracks
+LOCATION_ARCHIVE_DIR = Path(os.getenv('LOCATION_ARCHIVE_DIR', BASE_DIR / 'archive' / 'user_locations'))
+LOCATION_ARCHIVE_DELETE_BATCH = int(os.getenv('LOCATION_ARCHIVE_DELETE_BATCH', '500'))  # rows per DELETE
+LOCATION_HISTORY_MAX_DAYS = int(os.getenv('LOCATION_HISTORY_MAX_DAYS', '31'))  # longest range /tracking/history serves
+
+# Batch report submission
+REPORT_BATCH_MAX = int(os.getenv('REPORT_BATCH_MAX', '500'))  # reports per /reports/submit-batch call
+REPORT_TAG_COLUMNS = os.getenv('REPORT_TAG_COLUMNS', 'True') == 'True'  # False until the reports_setup.sql ALTERs have run
+
+# Nearest-neighbour index (hydrants, locations, reports)
+NEAREST_REFRESH_SECONDS = float(os.getenv('NEAREST_REFRESH_SECONDS', '600'))  # rebuild in the background after this
+NEAREST_DELTA_MAX = int(os.getenv('NEAREST_DELTA_MAX', '5000'))  # points added since the build before a rebuild
+FACILITY_SNAP_METERS = float(os.getenv('FACILITY_SNAP_METERS', '25'))  # attach a report to a facility this close
+
+# Shared point snapshot written by `manage.py refresh_point_snapshot` (see myapp.point_snapshot)
+POINT_SNAPSHOT_PATH = Path(os.getenv('POINT_SNAPSHOT_PATH', BASE_DIR / 'cache' / 'points.snap'))
+POINT_SNAPSHOT_CHECK_SECONDS = float(os.getenv('POINT_SNAPSHOT_CHECK_SECONDS', '5'))  # how often workers look for a new version
+POINT_SNAPSHOT_MAX_AGE = float(os.getenv('POINT_SNAPSHOT_MAX_AGE', '3600'))  # older snapshots are ignored (refresher down)
+
+# Report search (SQLite FTS5 index, rebuild with `manage.py rebuild_report_search`)
+REPORT_SEARCH_MAX_PAGE_SIZE = int(os.getenv('REPORT_SEARCH_MAX_PAGE_SIZE', '100'))  # results per page
+REPORT_SEARCH_MAX_RESULTS = int(os.getenv('REPORT_SEARCH_MAX_RESULTS', '10000'))  # deepest result reachable by paging
+
+# Points and badge awards (processed by `manage.py run_gamification_worker`)
+GAMIFICATION_ASYNC = os.getenv('GAMIFICATION_ASYNC', 'True') == 'True'  # False awards inline in /reports/submit
+GAMIFICATION_MAX_ATTEMPTS = int(os.getenv('GAMIFICATION_MAX_ATTEMPTS', '5'))  # then the task is marked failed
+GAMIFICATION_RETRY_SECONDS = float(os.getenv('GAMIFICATION_RETRY_SECONDS', '5'))  # first retry delay, doubles each attempt
+GAMIFICATION_LEASE_SECONDS = float(os.getenv('GAMIFICATION_LEASE_SECONDS', '120'))  # reclaim tasks from crashed workers
+
+# Admission control for write endpoints (see myapp.admission)
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'True') == 'True'
+ADMISSION_STORE = os.getenv('ADMISSION_STORE', 'memory')  # "memory" (per process) or "sqlite" (shared by the workers on a host)
+ADMISSION_SQLITE_PATH = Path(os.getenv('ADMISSION_SQLITE_PATH', BASE_DIR / 'cache' / 'admission.sqlite3'))
+ADMISSION_IP_MULTIPLIER = float(os.getenv('ADMISSION_IP_MULTIPLIER', '5'))  # a client IP gets this many times the user rate
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv('ADMISSION_TRUST_FORWARDED_FOR', 'False') == 'True'  # behind a reverse proxy
+ADMISSION_RATES = {  # "<requests>/<seconds>" per user (bursts up to <requests>)
+    'report-submit': os.getenv('ADMISSION_RATE_REPORT_SUBMIT', '20/60'),
+    'report-batch': os.getenv('ADMISSION_RATE_REPORT_BATCH', '500/3600'),  # counted per report
+    'add-points': os.getenv('ADMISSION_RATE_ADD_POINTS', '20/60'),
+    'check-milestones': os.getenv('ADMISSION_RATE_CHECK_MILESTONES', '10/60'),
+    'identify-neighborhood': os.getenv('ADMISSION_RATE_IDENTIFY_NEIGHBORHOOD', '30/60'),  # no user: only the IP bucket applies
+}
+
+# Live report feed (Server-Sent Events, requires the ASGI server)
+REPORT_FEED_QUEUE_SIZE = int(os.getenv('REPORT_FEED_QUEUE_SIZE', '100'))  # events buffered per subscriber
+REPORT_FEED_MAX_DROPPED = int(os.getenv('REPORT_FEED_MAX_DROPPED', '500'))  # disconnect slower consumers
+REPORT_FEED_KEEPALIVE = float(os.getenv('REPORT_FEED_KEEPALIVE', '15'))  # seconds between keepalive comments
+
+# Report density heatmap
+HEATMAP_SNAPSHOT_PATH = Path(os.getenv('HEATMAP_SNAPSHOT_PATH', BASE_DIR / 'cache' / 'heatmap.bin'))
+HEATMAP_BUCKET_SECONDS = int(os.getenv('HEATMAP_BUCKET_SECONDS', '86400'))  # one bucket per day
+HEATMAP_BUCKET_COUNT = int(os.getenv('HEATMAP_BUCKET_COUNT', '14'))  # days kept for time filtering
+
+# Trending areas
+TRENDING_HALF_LIFE = float(os.getenv('TRENDING_HALF_LIFE', '3600'))  # seconds for a report's weight to halve
+TRENDING_CAPACITY = int(os.getenv('TRENDING_CAPACITY', '256'))  # areas tracked per ranking
+TRENDING_CELL_PRECISION = int(os.getenv('TRENDING_CELL_PRECISION', '6'))  # ~1.2km x 0.6km cells
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",  # Vite dev server
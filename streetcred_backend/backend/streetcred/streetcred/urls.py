@@ -20,6 +20,8 @@ from django.http import JsonResponse
 from myapp import views
 from myapp.api import api
 from myapp.badge_api import api as badge_api
+from myapp.reports_api import api as reports_api
+from myapp.tracking_api import api as tracking_api
 
 def health_check(request):
     """Health check endpoint for deployment platforms"""
@@ -30,6 +32,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api.urls),  # Django Ninja API endpoints
     path('api/badges/', badge_api.urls),  # Badge rewards API
+    path('api/reports/stream/', views.report_stream, name='report_stream'),  # Live report feed (SSE)
+    path('api/reports/', reports_api.urls),  # Reports API
+    path('api/tracking/', tracking_api.urls),  # Location ping ingestion
     path('map/', views.map_view, name='map_view'),
     path('map/add-location/', views.add_location, name='add_location'),
     path('api/identify-neighborhood/', views.identify_neighborhood, name='identify_neighborhood'),